@@ -0,0 +1,263 @@
+import os
+import sys
+import csv
+import argparse
+import warnings
+import traceback
+import importlib.util
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from sweep import Sweep
+from sweepscanner import iter_sweep_dirs
+from pseudodata import add_fingerprints
+
+
+reductions = {
+    'mean': np.nanmean,
+    'median': np.nanmedian,
+    'min': np.nanmin,
+    'max': np.nanmax,
+    'std': np.nanstd,
+    'sum': np.nansum,
+    'first': lambda values: values.flat[0],
+    'last': lambda values: values.flat[-1],
+}
+
+# The pseudocolumn functions of a worker process. See init_worker.
+worker_name_func_dict = None
+
+
+def load_pcols(pcols_path):
+    """
+    Loads the pseudocolumn file pcols_path and returns its name_func_dict
+    with fingerprints (see pseudodata.add_fingerprints).
+    """
+    spec = importlib.util.spec_from_file_location('', pcols_path)
+    pcols = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(pcols)
+    add_fingerprints(pcols.name_func_dict)
+    return pcols.name_func_dict
+
+
+def get_reduction(reduction):
+    """
+    Returns a function which takes a column and the sweep and returns a
+    single value. reduction is the name of a function in reductions, or
+    at:<column name>=<value> for the value at the row where the column is
+    closest to value, e.g., at:dc_bias_left=0. Returns None if reduction is
+    None.
+    """
+    if reduction is None:
+        return None
+    if reduction in reductions:
+        func = reductions[reduction]
+        return lambda values, sweep: func(values)
+    if reduction.startswith('at:') and '=' in reduction:
+        col_name, value = reduction[3:].rsplit('=', 1)
+        value = float(value)
+        def reduce_at(values, sweep):
+            # 2D columns are searched as a whole.
+            distance = np.abs(np.asarray(sweep.get_data(col_name)) - value)
+            return values.flat[np.nanargmin(distance)]
+        return reduce_at
+    err_str = 'Unknown reduction {}. Use one of {} or at:<column>=<value>.'
+    raise ValueError(err_str.format(reduction, ', '.join(sorted(reductions))))
+
+
+def init_worker(pcols_path):
+    global worker_name_func_dict
+    worker_name_func_dict = load_pcols(pcols_path)
+
+
+def evaluate_sweep(path, col_names, reduction=None, cache_dir=None):
+    """
+    Calculates the columns col_names of the sweep at path in a worker process
+    and returns a dictionary with the keys path, time_stamp, name, values,
+    error and traceback. values maps column names to the columns, or to single
+    values if reduction is given (see get_reduction). If anything fails error
+    and traceback describe the error and values contains the columns
+    calculated before the failure. The ColumnCache is only used if cache_dir
+    is given, so a batch does not write to the data directories.
+    """
+    result = {
+        'path': path,
+        'time_stamp': os.path.basename(path),
+        'name': '',
+        'values': {},
+        'error': None,
+        'traceback': None,
+    }
+    try:
+        reduce_func = get_reduction(reduction)
+        sweep = Sweep(path, use_cache=cache_dir is not None,
+                      cache_dir=cache_dir)
+        result['name'] = sweep.meta.get('name', '')
+        sweep.set_pdata(worker_name_func_dict)
+        for col_name in col_names:
+            values = np.asarray(sweep.get_data(col_name))
+            if reduce_func is not None:
+                with warnings.catch_warnings():
+                    # Columns containing only NaN give NaN.
+                    warnings.simplefilter('ignore', RuntimeWarning)
+                    values = float(reduce_func(values, sweep))
+            result['values'][col_name] = values
+    except Exception as error:
+        result['error'] = '{}: {}'.format(type(error).__name__,
+                                          str(error).strip())
+        result['traceback'] = traceback.format_exc()
+    return result
+
+
+def iter_batch(paths, pcols_path, col_names, reduction=None, max_workers=None,
+               cache_dir=None):
+    """
+    Evaluates the columns col_names for the sweeps in paths on a pool of
+    max_workers processes (by default one per CPU) and yields the results of
+    evaluate_sweep as soon as they are ready, not in any particular order.
+    The sweeps which have not started are cancelled if the iteration is
+    stopped.
+    """
+    get_reduction(reduction)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=init_worker,
+                             initargs=(pcols_path,)) as executor:
+        futures = [executor.submit(evaluate_sweep, path, col_names,
+                                   reduction, cache_dir)
+                   for path in paths]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+
+
+def run_batch(dir_path, pcols_path, col_names, out_path=None, reduction=None,
+              max_workers=None, cache_dir=None, progress=None):
+    """
+    Evaluates the columns col_names, which may be raw columns or
+    pseudocolumns defined in pcols_path, for every sweep below dir_path.
+
+    The sweeps are evaluated in parallel on a process pool (see iter_batch),
+    and errors are recorded per sweep instead of stopping the batch. If
+    progress is given it is called with (n_done, n_total, result) after each
+    sweep. Returns the results sorted by path and writes them to out_path if
+    given (see write_table). If the batch is stopped by an exception, e.g.,
+    KeyboardInterrupt, the results so far are written before it is raised.
+    """
+    if out_path is not None:
+        # Fail before the sweeps are evaluated.
+        check_out_path(out_path, is_reduced=reduction is not None)
+    paths = sorted(path for path, _, _ in iter_sweep_dirs(dir_path))
+    results = []
+    try:
+        for result in iter_batch(paths, pcols_path, col_names, reduction,
+                                 max_workers, cache_dir):
+            results.append(result)
+            if progress is not None:
+                progress(len(results), len(paths), result)
+    except BaseException:
+        if out_path is not None and results:
+            results.sort(key=lambda result: result['path'])
+            write_table(results, col_names, out_path)
+        raise
+    results.sort(key=lambda result: result['path'])
+    if out_path is not None:
+        write_table(results, col_names, out_path)
+    return results
+
+
+def check_out_path(out_path, is_reduced):
+    ext = os.path.splitext(out_path)[1].lower()
+    if ext not in ('.npz', '.csv', '.parquet'):
+        raise ValueError('out_path must end with .npz, .csv or .parquet.')
+    if not is_reduced and ext != '.npz':
+        raise ValueError('Whole columns can only be written to .npz files. '
+                         'Pass a reduction to write a table.')
+    return ext
+
+
+def make_table(results, col_names):
+    """
+    Returns a dictionary of equally long arrays with the fields time_stamp,
+    name, path and error of results followed by the reduced values of the
+    columns col_names, which are NaN where the value is missing.
+    """
+    table = {
+        'time_stamp': np.array([r['time_stamp'] for r in results], dtype=str),
+        'name': np.array([r['name'] for r in results], dtype=str),
+        'path': np.array([r['path'] for r in results], dtype=str),
+        'error': np.array([r['error'] or '' for r in results], dtype=str),
+    }
+    for col_name in col_names:
+        table[col_name] = np.array(
+            [r['values'].get(col_name, np.nan) for r in results], dtype=float)
+    return table
+
+
+def write_table(results, col_names, out_path):
+    """
+    Writes results to out_path as .npz, .csv or .parquet depending on the
+    extension. Parquet requires pandas with pyarrow or fastparquet. Results
+    without a reduction can only be written to .npz, in which case column
+    col_name of row i is stored as '<col_name>/<i>'.
+    """
+    is_reduced = all(np.ndim(value) == 0 for r in results
+                     for value in r['values'].values())
+    ext = check_out_path(out_path, is_reduced)
+    if is_reduced:
+        table = make_table(results, col_names)
+    else:
+        table = make_table(results, ())
+        for i, result in enumerate(results):
+            for col_name, values in result['values'].items():
+                table['{}/{}'.format(col_name, i)] = values
+    if ext == '.npz':
+        np.savez_compressed(out_path, **table)
+    elif ext == '.csv':
+        with open(out_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(list(table))
+            writer.writerows(zip(*table.values()))
+    else:
+        import pandas
+        pandas.DataFrame(table).to_parquet(out_path)
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(
+        description='Evaluate columns and pseudocolumns for every sweep in a '
+                    'tree on a process pool.')
+    parser.add_argument('dir_path', help='Directory containing data folders.')
+    parser.add_argument('pcols_path', help='Pseudocolumn file.')
+    parser.add_argument('col_names', nargs='+',
+                        help='Names of the columns to evaluate.')
+    parser.add_argument('--reduce', default=None,
+                        help='Reduce each column to a single value with one '
+                             'of {} or at:<column>=<value>.'.format(
+                                 ', '.join(sorted(reductions))))
+    parser.add_argument('--out', default=None,
+                        help='Write the results to this .npz, .csv or '
+                             '.parquet file.')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of processes (default: one per CPU).')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Directory of the column caches (see '
+                             'columncache.py). Without it the sweeps are '
+                             'parsed from data.dat and no cache is written.')
+    args = parser.parse_args()
+    def print_progress(n_done, n_total, result):
+        status = result['error'] or 'ok'
+        print('[{}/{}] {}: {}'.format(n_done, n_total, result['path'], status))
+    try:
+        results = run_batch(args.dir_path, args.pcols_path, args.col_names,
+                            out_path=args.out, reduction=args.reduce,
+                            max_workers=args.workers,
+                            cache_dir=args.cache_dir, progress=print_progress)
+    except KeyboardInterrupt:
+        if args.out is not None:
+            print('Interrupted. The sweeps evaluated so far were written to '
+                  '{}.'.format(args.out))
+        sys.exit(130)
+    n_failed = sum(1 for result in results if result['error'])
+    print('{} evaluated, {} failed'.format(len(results) - n_failed, n_failed))
+    sys.exit(1 if n_failed else 0)
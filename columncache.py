@@ -0,0 +1,246 @@
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import tempfile
+import argparse
+import numpy as np
+from columnstore import ColumnStore
+
+
+class ColumnCache(object):
+    """
+    Binary per-column cache of the data.dat file in a sweep directory.
+
+    Every column of data.dat is stored as a separate .npy file together with an
+    index file, cache.json, which records the column names, the number of rows
+    and the signature (size and modification time) of data.dat and meta.json at
+    the time the cache was written. The cache is only used if the signature
+    still matches the files on disk, so a cache becomes stale as soon as either
+    file is modified.
+
+    Every write stores the columns in a new generation directory, which the
+    index points at, since the columns of the previous generation may still
+    be memory-mapped by open sweeps. Such files cannot be replaced or removed
+    on Windows. Old generations are removed by the following writes once they
+    are no longer in use.
+
+    Parameters
+    ----------
+    sweep_path : str
+        Full path to a sweep directory containing data.dat and meta.json.
+    cache_dir : str or None
+        Directory in which to store the cache. If None the cache is stored in a
+        hidden subdirectory (see dir_name) of the sweep directory. Otherwise
+        the cache is stored in a subdirectory of cache_dir named after a hash
+        of the full sweep path, which is useful if the data directories are
+        read-only.
+    """
+    dir_name = '.fbcache'
+    index_name = 'cache.json'
+    generation_prefix = 'gen'
+    version = 2
+    sig_fnames = ('data.dat', 'meta.json')
+
+    def __init__(self, sweep_path, cache_dir=None):
+        self.sweep_path = sweep_path
+        self.cache_dir = cache_dir
+        self.path = self.get_cache_path(sweep_path, cache_dir)
+        self.index_path = os.path.join(self.path, self.index_name)
+
+    def read(self, columns, mmap_mode='c'):
+        """
+        Returns the cached data as a ColumnStore or None if the cache is
+        missing, stale or does not contain the requested columns. The columns
+        are memory-mapped with mmap_mode and only read from disk when they are
+        used.
+
+        The files are mapped here, right after the index is checked, so the
+        store always reads the columns described by that index. write never
+        changes the files of an existing generation, so the maps stay valid
+        if the cache is written again while the store is in use.
+        """
+        index = self.read_index()
+        if index is None:
+            return None
+        names = [c['name'] for c in columns]
+        if index['columns'] != names:
+            return None
+        paths = [self.get_column_path(i, index['generation'])
+                 for i in range(len(names))]
+        try:
+            store = ColumnStore.from_files(names, paths, index['n_rows'],
+                                           mmap_mode)
+        except (OSError, ValueError):
+            return None
+        # The cache may have been written again between reading the index
+        # and mapping the files.
+        if self.read_index() != index:
+            return None
+        return store
+
+    def read_index(self):
+        """
+        Returns the contents of cache.json if the cache is valid, otherwise
+        None.
+        """
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if index.get('version') != self.version:
+            return None
+        if index.get('signature') != self.get_signature(self.sweep_path):
+            return None
+        return index
+
+    def write(self, data, signature):
+        """
+        Writes data to the cache. signature must be obtained with get_signature
+        before data was read from disk, such that the cache is invalidated if
+        data.dat changed while it was being parsed. Returns True if the cache
+        was written.
+        """
+        if signature is None:
+            return False
+        if signature != self.get_signature(self.sweep_path):
+            return False
+        names = list(data.dtype.names)
+        gen_path = None
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            # The index is replaced last, so a reader never sees a valid index
+            # pointing at half-written columns.
+            gen_path = tempfile.mkdtemp(prefix=self.generation_prefix,
+                                        dir=self.path)
+            generation = os.path.basename(gen_path)
+            for i, name in enumerate(names):
+                col = np.ascontiguousarray(data[name], dtype=float)
+                np.save(self.get_column_path(i, generation), col)
+            index = {
+                'version': self.version,
+                'signature': signature,
+                'columns': names,
+                'n_rows': len(data),
+                'generation': generation,
+            }
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError:
+            if gen_path is not None:
+                shutil.rmtree(gen_path, ignore_errors=True)
+            return False
+        self.remove_old_generations(generation)
+        return True
+
+    def remove_old_generations(self, generation):
+        """
+        Removes the columns of all generations but generation, and the
+        columns written by version 1 of the cache. Files which cannot be
+        removed, e.g., because they are still memory-mapped on Windows, are
+        left for the next write.
+        """
+        try:
+            entries = list(os.scandir(self.path))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.name == generation:
+                continue
+            if entry.name.startswith(self.generation_prefix):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            elif re.match(r'col\d+(\.tmp)?\.npy$', entry.name):
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+
+    def is_valid(self):
+        return self.read_index() is not None
+
+    def get_column_path(self, col_idx, generation):
+        # Column names may contain characters like '/' so we use the column
+        # index in the file name.
+        return os.path.join(self.path, generation, 'col{}.npy'.format(col_idx))
+
+    @classmethod
+    def get_cache_path(cls, sweep_path, cache_dir=None):
+        if cache_dir is None:
+            return os.path.join(sweep_path, cls.dir_name)
+        abs_path = os.path.normcase(os.path.abspath(sweep_path))
+        path_hash = hashlib.sha1(abs_path.encode('utf-8')).hexdigest()
+        return os.path.join(cache_dir, path_hash)
+
+    @classmethod
+    def get_signature(cls, sweep_path):
+        """
+        Returns a list of [size, mtime_ns] for data.dat and meta.json in
+        sweep_path or None if either file is missing.
+        """
+        signature = []
+        for fname in cls.sig_fnames:
+            try:
+                st = os.stat(os.path.join(sweep_path, fname))
+            except OSError:
+                return None
+            signature.append([st.st_size, st.st_mtime_ns])
+        return signature
+
+
+def warm_cache(dir_path, cache_dir=None, force=False, verbose=False):
+    """
+    Walks dir_path and writes a ColumnCache for every sweep directory whose
+    cache is missing or stale. Returns a dictionary with the number of sweeps
+    that were cached, already up to date and failed.
+    """
+    # Imported here to avoid a circular import since sweep imports this module.
+    from sweep import Sweep
+    counts = {'cached': 0, 'up_to_date': 0, 'failed': 0}
+    for sub_dir_path, dir_names, fnames in os.walk(dir_path):
+        # Do not descend into cache directories.
+        dir_names[:] = [d for d in dir_names if d != ColumnCache.dir_name]
+        if 'meta.json' not in fnames or 'data.dat' not in fnames:
+            continue
+        cache = ColumnCache(sub_dir_path, cache_dir)
+        if not force and cache.is_valid():
+            counts['up_to_date'] += 1
+            continue
+        signature = cache.get_signature(sub_dir_path)
+        try:
+            data, _ = Sweep.load_dir(sub_dir_path, use_cache=False)
+        except Exception as error:
+            counts['failed'] += 1
+            if verbose:
+                print('Failed: {} ({})'.format(sub_dir_path, error))
+            continue
+        if cache.write(data, signature):
+            counts['cached'] += 1
+            if verbose:
+                print('Cached: {}'.format(sub_dir_path))
+        else:
+            counts['failed'] += 1
+            if verbose:
+                print('Could not write cache: {}'.format(sub_dir_path))
+    return counts
+
+
+if __name__=='__main__':
+    parser = argparse.ArgumentParser(
+        description='Warm the binary column cache for every sweep in a tree.')
+    parser.add_argument('dir_path', help='Directory containing data folders.')
+    parser.add_argument('--cache-dir', default=None,
+                        help='Store caches in this directory instead of next '
+                             'to the data.')
+    parser.add_argument('--force', action='store_true',
+                        help='Rewrite caches that are already up to date.')
+    args = parser.parse_args()
+    counts = warm_cache(args.dir_path, cache_dir=args.cache_dir,
+                        force=args.force, verbose=True)
+    print('{cached} cached, {up_to_date} up to date, {failed} failed'.format(
+        **counts))
+    sys.exit(1 if counts['failed'] else 0)
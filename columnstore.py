@@ -0,0 +1,116 @@
+import numpy as np
+
+
+class ColumnStore(object):
+    """
+    Lazy container for the columns of a sweep.
+
+    ColumnStore mimics the parts of a numpy structured array used by
+    FolderBrowser, i.e., indexing by column name (store[name]), dtype.names,
+    shape and ndim. Columns are only materialized when they are indexed, and
+    when the store is backed by a ColumnCache the columns are memory-mapped so
+    only the columns that are actually used are paged in from disk.
+
+    Parameters
+    ----------
+    names : list of str
+        Column names in the order given by meta.json.
+    loaders : dictionary
+        Maps each column name to a function without arguments which returns the
+        one-dimensional column.
+    shape : tuple
+        Shape of the columns returned by __getitem__.
+    transform : function or None
+        Function applied to a loaded one-dimensional column before it is
+        returned, e.g., for reshaping 2D data. The transform must map a column
+        to an array of shape shape.
+    base : numpy array or None
+        Array which the loaded columns are views into, if any. Used for
+        calculating the resident size of the store.
+    """
+    def __init__(self, names, loaders, shape, transform=None, base=None):
+        self.names = list(names)
+        self.loaders = loaders
+        self.shape = tuple(shape)
+        self.transform = transform
+        self.base = base
+        self.dtype = np.dtype([(name, float) for name in self.names])
+        self.columns = {}
+
+    def __getitem__(self, name):
+        if name in self.columns:
+            return self.columns[name]
+        if name not in self.loaders:
+            # Raise the same exception as a structured array.
+            raise ValueError('no field of name {}'.format(name))
+        column = self.load_1d(name)
+        if self.transform is not None:
+            column = self.transform(column)
+        self.columns[name] = column
+        return column
+
+    def __contains__(self, name):
+        return name in self.loaders
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def load_1d(self, name):
+        return self.loaders[name]()
+
+    def reshaped(self, transform, shape):
+        """
+        Returns a new ColumnStore with the same loaders where transform is
+        applied to every column when it is loaded.
+        """
+        return ColumnStore(self.names, self.loaders, shape, transform,
+                           self.base)
+
+    def get_loaded_names(self):
+        return list(self.columns.keys())
+
+    def get_nbytes(self):
+        """
+        Returns the number of bytes held by the store. If the columns are views
+        into a single array the size of that array is returned, otherwise the
+        sum of the sizes of the loaded columns.
+        """
+        if self.base is not None:
+            return self.base.nbytes
+        return sum(column.nbytes for column in list(self.columns.values()))
+
+    @classmethod
+    def from_array(cls, data):
+        """
+        Wraps a structured array. The columns are views into data.
+        """
+        names = data.dtype.names
+        loaders = {name: cls.make_field_loader(data, name) for name in names}
+        return cls(names, loaders, data.shape, base=data)
+
+    @classmethod
+    def from_files(cls, names, paths, n_rows, mmap_mode='c'):
+        """
+        Creates a store where column names[i] is loaded from the .npy file at
+        paths[i]. By default the files are memory-mapped copy-on-write so
+        writing to a column never modifies the file. The files are opened
+        here, so the store keeps reading them even if they are replaced
+        later, but with mmap_mode their data is only read when it is used.
+        """
+        loaders = {}
+        for name, path in zip(names, paths):
+            column = np.load(path, mmap_mode=mmap_mode)
+            loaders[name] = cls.make_column_loader(column)
+        return cls(names, loaders, (n_rows,))
+
+    @staticmethod
+    def make_field_loader(data, name):
+        return lambda: data[name]
+
+    @staticmethod
+    def make_column_loader(column):
+        return lambda: column
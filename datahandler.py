@@ -1,5 +1,9 @@
 import numpy as np
-from numpy import nanmin, nanmax
+from collections import OrderedDict
+from resampling import resample_to_raster, get_axis_profiles, \
+    get_line_indices
+from pyramid import ImagePyramid
+import executors
 
 
 class DataHandler(object):
@@ -16,6 +20,11 @@ class DataHandler(object):
         three. For Transformed2DData x and y must be one-dimensional, that is
         x.ndim == y.ndim == 1
         For Transformed3Ddata x, y and z must be two-dimensional.
+    lin_axes : list or None
+        For each of the arrays, the axis along which it is known to vary
+        linearly, e.g., from Sweep.get_grid, or None if it is unknown. Arrays
+        with a known axis are not searched for linearity, which is the
+        expensive part of making a DataHandler for 2D data.
 
     Attributes
     ----------
@@ -28,8 +37,11 @@ class DataHandler(object):
 
     The transformed data (tdata) has the following properties:
     - The tdata arrays are verified to have the same shape.
+    - The tdata arrays are views of the data arrays, i.e., transposing and
+      reversing do not copy any data.
     - Values in the tdata arrays larger or smaller than clip_min and clip_max
-      are set to np.nan.
+      are kept in tdata, but they are masked when the arrays are plotted (see
+      get_plot_data) and ignored by get_extent_of_data_dim.
     - The tdata arrays are sorted according to the order in array x for 2D data
       and arrays x and y for 3D data. Typically this just means reversing the
       arrays along an axis if the sweep was made from positive toward negative
@@ -45,14 +57,31 @@ class DataHandler(object):
     If the tdata is not eligible for imshow (that is, imshow_eligible == False)
     the data can still be plotted with Matplotlib's pcolormesh, which is,
     however, slower than imshow.
+    - Large 3D tdata which is eligible for imshow can be plotted at the
+      resolution of the canvas from an ImagePyramid made in the background
+      (see start_pyramid and get_level).
     """
-    def __init__(self, x, y):
+    def __init__(self, x, y, lin_axes=None):
         self.clip_min = -1e25
         self.clip_max = 1e25
         self.x = x
         self.y = y
         self.data = [self.x, self.y]
+        self.lin_axes = lin_axes
         self.data_is_valid = False
+        # Maps the index of a tdata array to its (nanmin, nanmax).
+        self.raw_extents = {}
+        # See Transformed3DData.start_pyramid.
+        self.pyramid = None
+
+    def stop_pyramid(self):
+        if self.pyramid is not None:
+            self.pyramid.cancel()
+
+    def get_known_lin_axis(self, i):
+        if self.lin_axes is None or i >= len(self.lin_axes):
+            return None
+        return self.lin_axes[i]
 
     def set_data_validity(self):
         """
@@ -69,30 +98,57 @@ class DataHandler(object):
             data_is_valid = False
         self.data_is_valid = data_is_valid
 
-    def clip_tdata_to_nan(self):
-        for tdata in self.tdata:
-            if tdata is None:
-                continue
-            tdata = self.clip_to_nan(tdata, self.clip_min, self.clip_max)
-
     def get_extent_of_data_dim(self, dim):
         """
-        Depends on _set_tdata
+        Returns the smallest and largest value of tdata[dim] within clip_min
+        and clip_max. Depends on _set_tdata
         """
         assert dim in range(self.n_data_arrs)
         arr = self.tdata[dim]
-        return [nanmin(arr), nanmax(arr)]
+        if self.data_is_linear[dim]:
+            # A linear array has its extremes in the corners.
+            ends = [arr.flat[0], arr.flat[-1]]
+            if self.clip_min <= min(ends) and max(ends) <= self.clip_max:
+                return [min(ends), max(ends)]
+        if not self.needs_clipping(dim):
+            return list(self.get_raw_extent(dim))
+        # Comparisons with NaN are False, so NaN is left out as well.
+        with np.errstate(invalid='ignore'):
+            values = arr[(arr >= self.clip_min) & (arr <= self.clip_max)]
+        if values.size == 0:
+            return [np.nan, np.nan]
+        return [values.min(), values.max()]
 
-    @staticmethod
-    def clip_to_nan(arr, clip_min, clip_max):
-        assert type(arr) is np.ndarray
-        # By default Numpy gives a RuntimeWarning when a nan is generated. We
-        # are explicitly generating nans here so we don't want to see the
-        # warning.
+    def get_raw_extent(self, dim):
+        """
+        Returns the NaN-ignoring minimum and maximum of tdata[dim] including
+        values outside clip_min and clip_max.
+        """
+        if dim not in self.raw_extents:
+            arr = self.tdata[dim]
+            # fmin and fmax ignore NaN and, unlike nanmin and nanmax, do not
+            # copy subclasses of ndarray such as memory-mapped columns.
+            self.raw_extents[dim] = (np.fmin.reduce(arr, axis=None),
+                                     np.fmax.reduce(arr, axis=None))
+        return self.raw_extents[dim]
+
+    def needs_clipping(self, dim):
+        lo, hi = self.get_raw_extent(dim)
+        return lo < self.clip_min or hi > self.clip_max
+
+    def get_plot_data(self, dim):
+        """
+        Returns tdata[dim] for plotting with the values outside clip_min and
+        clip_max masked. Only a mask is allocated, and only if there are such
+        values, so the only contiguous copy of the data is the one made by
+        Matplotlib when it renders the array.
+        """
+        arr = self.tdata[dim]
+        if not self.needs_clipping(dim):
+            return arr
         with np.errstate(invalid='ignore'):
-            arr[arr < clip_min] = np.nan
-            arr[arr > clip_max] = np.nan
-        return arr
+            return np.ma.masked_outside(arr, self.clip_min, self.clip_max,
+                                        copy=False)
 
     @staticmethod
     def is_linear(arr):
@@ -116,7 +172,7 @@ class DataHandler(object):
         for axis in (0,1):
             idx = [0,0]
             idx[axis] = slice(None)
-            arr_1D = arr[idx]
+            arr_1D = arr[tuple(idx)]
             if not self.is_linear(arr_1D):
                 continue
             # Check that arr consists solely of copies of arr_1D. First,
@@ -133,61 +189,114 @@ class DataHandler(object):
         assert axis in range(arr.ndim)
         idx = [slice(None)] * arr.ndim
         idx[axis] = slice(None, None, -1)
-        return arr[idx]
+        return arr[tuple(idx)]
 
 
 class Transformed2DData(DataHandler):
-    def __init__(self, x, y):
-        super().__init__(x, y)
+    def __init__(self, x, y, lin_axes=None):
+        super().__init__(x, y, lin_axes)
         self.n_data_arrs = len(self.data)
         self.data_dim = 1
         self.imshow_eligible = False
+        # See get_x_order.
+        self.x_order = None
         self.set_data_validity()
         if not self.data_is_valid:
             return
         self._set_data_is_linear()
         self._set_tdata()
-        self.clip_tdata_to_nan()
 
     def _set_data_is_linear(self):
         data_is_linear = [False] * self.n_data_arrs
         for i, data in enumerate(self.data):
-            data_is_linear[i] = self.is_linear(data)
+            if self.get_known_lin_axis(i) == 0:
+                data_is_linear[i] = True
+            else:
+                data_is_linear[i] = self.is_linear(data)
         self.data_is_linear = data_is_linear
 
     def _set_tdata(self):
-        tdata = np.copy(self.data)
-        for i, arr in enumerate(tdata):
-            if not self.data_is_linear[i]:
-                continue
-            if arr[0] > arr[-1]:
-                # We can sort the array by simply reversing the elements
-                # because we know it is linearly increasing or decreasing
-                # monotonously from self.data_is_linear.
-                arr = self.reverse_axis(arr, 0)
+        """
+        Sets tdata to views of x and y, which are reversed together if x is
+        linear and decreasing, so x increases in the plotted line. Versions
+        before the transforms were made copy-free computed this reversal but
+        discarded it. Such lines are now drawn from the smallest x to the
+        largest, which is seen, e.g., in Line2D.get_xdata, but the points are
+        the same. Other x, including decreasing x which is not linear, keep
+        their order.
+        """
+        tdata = list(self.data)
+        x = tdata[0]
+        if self.data_is_linear[0] and x[0] > x[-1]:
+            # We can sort the arrays by simply reversing the elements because
+            # we know x is linearly decreasing from self.data_is_linear. Both
+            # arrays are reversed so the points stay the same.
+            tdata = [self.reverse_axis(arr, 0) for arr in tdata]
         self.tdata = tdata
 
+    def get_x_order(self):
+        """
+        Returns 1 if tdata[0] is non-decreasing, -1 if it is non-increasing
+        and 0 otherwise, e.g., if it contains NaN.
+        """
+        if self.x_order is None:
+            x = self.tdata[0]
+            with np.errstate(invalid='ignore'):
+                steps = np.diff(x)
+                if np.all(steps >= 0):
+                    self.x_order = 1
+                elif np.all(steps <= 0):
+                    self.x_order = -1
+                else:
+                    self.x_order = 0
+        return self.x_order
+
+    def get_decimated(self, xlim, n_bins):
+        """
+        Returns the plot data (see get_plot_data) reduced to the points which
+        determine how the line looks between xlim when drawn n_bins pixels
+        wide (see resampling.get_line_indices). Lines whose x is not sorted
+        are returned in full.
+        """
+        x, y = self.get_plot_data(0), self.get_plot_data(1)
+        order = self.get_x_order()
+        if order == 0:
+            return x, y
+        if order < 0:
+            x, y = x[::-1], y[::-1]
+        idx = get_line_indices(self.tdata[0][::order], y, xlim, n_bins)
+        return x[idx], y[idx]
+
 
 class Transformed3DData(DataHandler):
-    def __init__(self, x, y, z):
-        super().__init__(x, y)
+    def __init__(self, x, y, z, lin_axes=None):
+        super().__init__(x, y, lin_axes)
         if z is not None:
             self.data.append(z)
         self.n_data_arrs = len(self.data)
         self.data_dim = 2
+        # Maps (xlim, ylim, shape) to the result of get_resampled.
+        self.resampled = OrderedDict()
+        self.max_resampled = 4
+        # See get_resampled.
+        self.axis_profiles = None
+        self.pyramid_min_points = 1024**2
         self.set_data_validity()
         if not self.data_is_valid:
             return
         self._set_data_is_linear()
         self._set_imshow_eligible()
         self._set_tdata()
-        self.clip_tdata_to_nan()
 
     def _set_data_is_linear(self):
         data_is_linear = [False] * self.n_data_arrs
         lin_axis_for_data = [None] * self.n_data_arrs
         for i, data in enumerate(self.data):
-            axis = self.is_linear_on_axis(data)
+            axis = self.get_known_lin_axis(i)
+            if axis is None:
+                # Only arrays which are not described by the grid of the
+                # sweep are searched.
+                axis = self.is_linear_on_axis(data)
             if axis is False:
                 continue
             data_is_linear[i] = True
@@ -212,14 +321,13 @@ class Transformed3DData(DataHandler):
         """
         Depends on
         - _set_data_is_linear
-        Must run before
-        - clip_tdata_to_nan
+        The tdata arrays are views of the data arrays.
         """
         lin_axes = [ax for ax in self.lin_axis_for_data if ax is not None]
         if lin_axes == [0, 1]:
-            tdata = [arr.copy().T for arr in self.data]
+            tdata = [arr.T for arr in self.data]
         else:
-            tdata = [arr.copy() for arr in self.data]
+            tdata = list(self.data)
         tdata_lin_axes = [1, 0]
         # Sort tdata along dimensions where the x and y arrays vary linearly.
         for i in (0, 1):
@@ -236,15 +344,69 @@ class Transformed3DData(DataHandler):
                     tdata[2] = self.reverse_axis(tdata[2], lin_axis)
         self.tdata = tdata
 
+    def get_resampled(self, xlim, ylim, shape):
+        """
+        Returns z resampled to a regular raster of shape (rows, cols) covering
+        xlim and ylim, and the extent of the raster, such that data which is
+        not imshow_eligible can be plotted with imshow. See
+        resampling.resample_to_raster. The last few rasters are cached, so
+        returning to a previous view or redrawing is cheap.
+        """
+        key = (tuple(xlim), tuple(ylim), tuple(shape))
+        if key in self.resampled:
+            self.resampled.move_to_end(key)
+            return self.resampled[key]
+        x, y, _ = self.tdata
+        if self.axis_profiles is None:
+            # Found once for all views.
+            self.axis_profiles = get_axis_profiles(x, y) or False
+        result = resample_to_raster(x, y, self.get_plot_data(2), xlim, ylim,
+                                    shape, self.axis_profiles)
+        self.resampled[key] = result
+        while len(self.resampled) > self.max_resampled:
+            self.resampled.popitem(last=False)
+        return result
+
+    def start_pyramid(self, callback=None):
+        """
+        Starts building an ImagePyramid of z in the background if the data is
+        eligible for imshow and has at least pyramid_min_points points.
+        callback is called without arguments, from the background thread,
+        when the pyramid is done. Returns True if there is a pyramid.
+        """
+        if self.pyramid is not None:
+            return True
+        if not self.data_is_valid or not self.imshow_eligible or \
+                self.n_data_arrs != 3 or \
+                self.tdata[2].size < self.pyramid_min_points:
+            return False
+        x, y, _ = self.tdata
+        extent = [x[0,0], x[-1,-1], y[0,0], y[-1,-1]]
+        self.pyramid = ImagePyramid(self.get_plot_data(2), extent)
+        future = executors.get_executor('background').submit(
+            self.pyramid.build)
+        if callback is not None:
+            future.add_done_callback(lambda future: callback())
+        return True
+
+    def get_level(self, xlim, ylim, shape, statistic='mean'):
+        """
+        Returns the part of z covering xlim and ylim at the coarsest
+        resolution made so far which still has a value per pixel of a canvas
+        of shape (rows, cols), together with its extent and the number of
+        rows and columns of z per value. See ImagePyramid.get_level.
+        """
+        return self.pyramid.get_level(xlim, ylim, shape, statistic)
+
 
-def data_handler_factory(x, y, z=None):
+def data_handler_factory(x, y, z=None, lin_axes=None):
     dim = try_get_arr_dim(x, y, z)
     assert dim in (1, 2, None)
     if dim == 1:
         assert z is None
-        return Transformed2DData(x, y)
+        return Transformed2DData(x, y, lin_axes)
     elif dim == 2:
-        return Transformed3DData(x, y, z)
+        return Transformed3DData(x, y, z, lin_axes)
     elif dim is None:
         return DataHandler()
 
@@ -0,0 +1,95 @@
+import os
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+block_size = 8 * 1024**2
+max_workers = min(8, os.cpu_count() or 1)
+
+
+def parse_dat_file(dat_path, n_cols, offset=0, complete_lines_only=False):
+    """
+    Parses the tab-separated data.dat file at dat_path into a two-dimensional
+    float array with n_cols columns.
+
+    The file is read in blocks of block_size bytes. Each block is cut at its
+    last line break and the chunks are parsed in parallel on a thread pool
+    with vectorized float conversion, so no Python objects are created per
+    line or per value. Trailing tabs and blank lines, as written by matlab-qd,
+    are ignored.
+
+    Parameters
+    ----------
+    dat_path : str
+        Path to data.dat.
+    n_cols : integer
+        Number of columns in the file.
+    offset : integer
+        Byte offset at which to start reading. Must be at a line boundary.
+    complete_lines_only : bool
+        If True a last line which is not terminated by a line break is not
+        parsed, e.g., since it may still be being written.
+
+    Returns
+    -------
+    values : numpy array
+        Array of shape (number of lines, n_cols).
+    end_offset : integer
+        Byte offset just after the last parsed line.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        with open(dat_path, 'rb') as f:
+            f.seek(offset)
+            end_offset = offset
+            remainder = b''
+            while True:
+                block = f.read(block_size)
+                if not block:
+                    break
+                block = remainder + block
+                cut = block.rfind(b'\n') + 1
+                remainder = block[cut:]
+                if cut:
+                    futures.append(executor.submit(
+                        parse_dat_bytes, block[:cut], n_cols))
+                    end_offset += cut
+        if remainder and not complete_lines_only:
+            futures.append(executor.submit(parse_dat_bytes, remainder, n_cols))
+            end_offset += len(remainder)
+        chunks = [future.result() for future in futures]
+    if not chunks:
+        return np.empty((0, n_cols)), end_offset
+    if len(chunks) == 1:
+        return chunks[0], end_offset
+    return np.concatenate(chunks), end_offset
+
+
+def parse_dat_bytes(content, n_cols):
+    """
+    Parses whitespace-separated floats in content into an array of shape
+    (number of lines, n_cols). content must consist of whole lines.
+    """
+    values = np.fromstring(content, dtype=float, sep=' ')
+    if values.size % n_cols != 0:
+        msg = 'data.dat does not contain {} values per line'.format(n_cols)
+        raise ValueError(msg)
+    values = values.reshape(values.size // n_cols, n_cols)
+    # Older versions of Numpy stop silently at an unparsable value instead of
+    # raising, so we check that the last line was actually reached.
+    last_line = content.rstrip().rsplit(b'\n', 1)[-1]
+    if last_line:
+        last_values = [float(x) for x in last_line.split()]
+        if (len(values) == 0 or
+                not np.array_equal(values[-1], last_values, equal_nan=True)):
+            raise ValueError('data.dat could not be parsed to its end')
+    return values
+
+
+def to_structured(values, dtype):
+    """
+    Returns a structured array with dtype which shares memory with the
+    two-dimensional float array values.
+    """
+    values = np.ascontiguousarray(values, dtype=float)
+    return values.view(dtype).reshape(len(values))
@@ -0,0 +1,188 @@
+import os
+from PyQt5 import QtCore
+from columncache import ColumnCache
+
+
+class DirWatcher(QtCore.QObject):
+    """
+    Watches the directories of a data tree which contain sweep directories and
+    reports when sweep directories are added, renamed or removed.
+
+    Only container directories are watched, i.e., dir_path and the
+    directories holding sweeps, together with new directories which do not
+    contain meta.json yet (sweeps which are just being created). Changes
+    inside known sweeps, e.g., to data.dat while it is measured, are not
+    reported, since the index only depends on meta.json, which is written
+    when the sweep is created. Such sweeps are followed with F7. Changes are
+    detected with QFileSystemWatcher, which uses inotify on Linux and the
+    corresponding native APIs on other platforms. Native notifications are
+    not delivered for changes made by other machines on network drives, so in
+    that case the directories should be polled by passing mode='poll'.
+    Polling costs one stat per watched directory per poll_interval.
+
+    Parameters
+    ----------
+    dir_path : str
+        Root of the data tree.
+    mode : str
+        'auto' to use native notifications and fall back to polling for the
+        directories which cannot be watched natively, or 'poll' to poll all
+        directories.
+    poll_interval : integer
+        Interval in milliseconds between two polls.
+    delay : integer
+        Changes are collected for delay milliseconds before dirs_changed is
+        emitted, since a new sweep directory is usually changed several times
+        in quick succession.
+    parent : QtCore.QObject instance
+        Parent of the watcher.
+
+    Signals
+    -------
+    dirs_changed(paths)
+        Emitted with a list of the watched directories which have changed.
+        The sweeps below them should be rescanned.
+    """
+    dirs_changed = QtCore.pyqtSignal(object)
+
+    def __init__(self, dir_path, mode='auto', poll_interval=1000, delay=300,
+                 parent=None):
+        super().__init__(parent)
+        if mode not in ('auto', 'poll'):
+            raise ValueError('mode must be \'auto\' or \'poll\'.')
+        self.dir_path = os.path.normpath(os.path.abspath(dir_path))
+        self.mode = mode
+        self.sweep_paths = set()
+        # Maps polled directories to their last modification time.
+        self.polled_mtimes = {}
+        self.changed_dirs = set()
+        self.fs_watcher = QtCore.QFileSystemWatcher(self)
+        self.fs_watcher.directoryChanged.connect(self.on_dir_changed)
+        self.poll_timer = QtCore.QTimer(self)
+        self.poll_timer.setInterval(poll_interval)
+        self.poll_timer.timeout.connect(self.poll)
+        self.delay_timer = QtCore.QTimer(self)
+        self.delay_timer.setSingleShot(True)
+        self.delay_timer.setInterval(delay)
+        self.delay_timer.timeout.connect(self.emit_changes)
+
+    def set_sweep_paths(self, sweep_paths):
+        """
+        Updates the set of known sweep directories and watches their parent
+        directories. Should be called whenever the sweeps have been rescanned.
+        """
+        self.sweep_paths = set(sweep_paths)
+        dirs = {self.dir_path}
+        for path in self.sweep_paths:
+            parent = os.path.dirname(path)
+            # Watch the chain of directories up to dir_path such that new
+            # container directories are detected as well.
+            while is_in_dir(parent, self.dir_path) and parent not in dirs:
+                dirs.add(parent)
+                parent = os.path.dirname(parent)
+        # New directories which are not sweeps yet are kept.
+        for path in self.get_watched_dirs():
+            if path not in self.sweep_paths and os.path.isdir(path):
+                dirs.add(path)
+        self.set_watched_dirs(dirs)
+
+    def get_watched_dirs(self):
+        return set(self.fs_watcher.directories()) | set(self.polled_mtimes)
+
+    def set_watched_dirs(self, dirs):
+        old_dirs = self.get_watched_dirs()
+        removed = old_dirs - dirs
+        native_dirs = set(self.fs_watcher.directories())
+        if removed & native_dirs:
+            self.fs_watcher.removePaths(list(removed & native_dirs))
+        for path in removed:
+            self.polled_mtimes.pop(path, None)
+        self.add_dirs(dirs - old_dirs)
+
+    def add_dirs(self, dirs):
+        if not dirs:
+            return
+        if self.mode == 'auto':
+            failed = self.fs_watcher.addPaths(list(dirs))
+        else:
+            failed = dirs
+        for path in failed:
+            self.polled_mtimes[path] = self.get_mtime(path)
+        if self.polled_mtimes and not self.poll_timer.isActive():
+            self.poll_timer.start()
+
+    def stop(self):
+        self.poll_timer.stop()
+        self.delay_timer.stop()
+        self.set_watched_dirs(set())
+
+    def poll(self):
+        for path, mtime in list(self.polled_mtimes.items()):
+            new_mtime = self.get_mtime(path)
+            if new_mtime != mtime:
+                self.polled_mtimes[path] = new_mtime
+                self.on_dir_changed(path)
+
+    def on_dir_changed(self, path):
+        """
+        Records that path has changed and starts watching the new directories
+        below path which are not known sweeps.
+        """
+        self.changed_dirs.add(path)
+        self.add_dirs(self.find_new_dirs(path, self.get_watched_dirs()))
+        self.delay_timer.start()
+
+    def find_new_dirs(self, path, watched_dirs):
+        """
+        Returns the directories below path which are neither watched nor known
+        sweeps. New directories are searched recursively, since directories
+        may have been created in them before they were watched.
+        """
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            return set()
+        new_dirs = set()
+        for entry in entries:
+            if entry.name == ColumnCache.dir_name:
+                continue
+            try:
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+            except OSError:
+                continue
+            if entry.path in self.sweep_paths or entry.path in watched_dirs:
+                continue
+            new_dirs.add(entry.path)
+            new_dirs.update(self.find_new_dirs(entry.path, watched_dirs))
+        return new_dirs
+
+    def emit_changes(self):
+        changed_dirs = sorted(self.changed_dirs)
+        self.changed_dirs = set()
+        # Directories below another changed directory are rescanned with it.
+        paths = []
+        for path in changed_dirs:
+            if not any(is_in_dir(path, p) for p in paths):
+                paths.append(path)
+        if paths:
+            self.dirs_changed.emit(paths)
+
+    @staticmethod
+    def get_mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+
+def is_in_dir(path, dir_path):
+    """
+    Returns True if path is dir_path or below it. The paths are compared
+    normalized and, on Windows, case-insensitively.
+    """
+    path = os.path.normcase(os.path.normpath(path))
+    dir_path = os.path.normcase(os.path.normpath(dir_path))
+    if path == dir_path:
+        return True
+    return path.startswith(dir_path.rstrip(os.sep) + os.sep)
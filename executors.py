@@ -0,0 +1,76 @@
+import os
+import atexit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Number of threads of each shared executor. The compute executor calculates
+# pseudocolumns (see PseudoData.compute) and evaluates expressions in chunks
+# (see Expression), and the background executor builds image pyramids (see
+# ImagePyramid) on a single thread, such that they do not compete with the
+# pseudocolumns. See set_max_workers.
+max_workers = {'compute': os.cpu_count(), 'background': 1}
+executors = {}
+lock = threading.Lock()
+# Holds the name of the executor of a worker thread. See in_executor.
+thread_state = threading.local()
+
+
+def get_executor(name='compute'):
+    """
+    Returns the shared ThreadPoolExecutor name, which is created when it is
+    first used.
+    """
+    with lock:
+        if name not in executors:
+            executors[name] = ThreadPoolExecutor(
+                max_workers=max_workers[name], thread_name_prefix=name,
+                initializer=set_thread_executor, initargs=(name,))
+        return executors[name]
+
+
+def set_thread_executor(name):
+    thread_state.executor_name = name
+
+
+def in_executor(name='compute'):
+    """
+    Returns True if the calling thread belongs to the executor name. A task
+    must not wait for tasks it submits to its own executor, since they may be
+    queued behind the waiting tasks, so such tasks should do the work in the
+    calling thread instead.
+    """
+    return getattr(thread_state, 'executor_name', None) == name
+
+
+def set_max_workers(name, n_workers):
+    """
+    Sets the number of threads of the executor name. If the executor exists
+    it is replaced, and the tasks already submitted to it still finish.
+    """
+    with lock:
+        max_workers[name] = n_workers
+        executor = executors.pop(name, None)
+    if executor is not None:
+        executor.shutdown(wait=False)
+
+
+def shutdown():
+    """
+    Shuts the executors down and cancels the tasks which have not started.
+    Executors used afterwards are created again. FolderBrowser calls this
+    when it is closed, such that queued pseudocolumns and pyramids do not
+    delay the exit.
+    """
+    with lock:
+        old_executors = list(executors.values())
+        executors.clear()
+    for executor in old_executors:
+        try:
+            executor.shutdown(wait=False, cancel_futures=True)
+        except TypeError:
+            # Python older than 3.9.
+            executor.shutdown(wait=False)
+
+
+atexit.register(shutdown)
@@ -1,24 +1,301 @@
 from PyQt5 import QtCore, QtWidgets
 from sweep import Sweep
+from bisect import bisect_left
 import os
 
-class FileList(QtWidgets.QListWidget):
+class FileList(QtWidgets.QListView):
     """
     Contains a list of sweeps to plot.
+
+    The names are held by a FileListModel, so no widget item is created per
+    sweep and only the visible rows are drawn. The list can be restricted to a
+    subset of the names with set_filter.
+
+    Signals
+    -------
+    itemClicked(name), itemActivated(name)
+        Emitted with the name of the sweep that was clicked or activated.
     """
+    itemClicked = QtCore.pyqtSignal(str)
+    itemActivated = QtCore.pyqtSignal(str)
+
     def __init__(self, names):
         super().__init__()
         self.names = names
-        self.setSortingEnabled(True)
-        self.sortItems(order=QtCore.Qt.DescendingOrder)
-        self.reload_items()
+        self.all_names = set(names)
+        self.filter_names = None
+        self.hidden_name = None
+        self.setUniformItemSizes(True)
+        self.list_model = FileListModel(names, parent=self)
+        self.setModel(self.list_model)
+        self.clicked.connect(self.emit_item_signal(self.itemClicked))
+        self.activated.connect(self.emit_item_signal(self.itemActivated))
         self.setCurrentRow(0)
 
+    def emit_item_signal(self, signal):
+        def emit(index):
+            signal.emit(self.list_model.get_name(index.row()))
+        return emit
+
     def reload_items(self):
-        self.clear()
-        self.set_items()
+        self.all_names = set(self.names)
+        self.set_filter(self.filter_names)
 
     def set_items(self):
-        for name in self.names:
-            item = QtWidgets.QListWidgetItem(name, parent=self)
-            self.addItem(item)
+        self.add_names(self.names)
+
+    def add_names(self, names):
+        """
+        Adds the names which are not already in the list. The list stays
+        sorted.
+        """
+        names = set(names)
+        self.all_names.update(names)
+        if self.filter_names is not None:
+            names.intersection_update(self.filter_names)
+        self.list_model.add_names(names)
+
+    def remove_names(self, names):
+        self.all_names.difference_update(names)
+        self.list_model.remove_names(names)
+
+    def get_names(self):
+        """
+        Returns all names, including the ones hidden by the filter.
+        """
+        return set(self.all_names)
+
+    def set_filter(self, names):
+        """
+        Shows only the names in names, or all names if names is None. The
+        current name stays selected if it is shown.
+        """
+        current_name = self.get_current_name()
+        if current_name is None:
+            # The current name was hidden by the previous filter.
+            current_name = self.hidden_name
+        self.hidden_name = current_name
+        if names is None:
+            self.filter_names = None
+            shown_names = self.all_names
+        else:
+            self.filter_names = set(names)
+            shown_names = self.all_names.intersection(self.filter_names)
+        self.list_model.set_names(shown_names)
+        if current_name in shown_names:
+            i = bisect_left(self.list_model.keys, current_name)
+            self.setCurrentRow(len(self.list_model.keys) - 1 - i)
+
+    def count(self):
+        return len(self.list_model.keys)
+
+    def currentRow(self):
+        index = self.currentIndex()
+        if not index.isValid():
+            return -1
+        return index.row()
+
+    def setCurrentRow(self, row):
+        model = self.list_model
+        if not 0 <= row < self.count():
+            return
+        while row >= model.rowCount() and model.canFetchMore():
+            model.fetchMore()
+        self.setCurrentIndex(model.index(row))
+
+    def get_name(self, row):
+        """
+        Returns the name in row or None if there is no such row.
+        """
+        return self.list_model.get_name(row)
+
+    def set_decoration_func(self, decoration_func, icon_size):
+        """
+        Shows icons next to the names. decoration_func is called with a name
+        when its row is drawn and returns a QPixmap or None.
+        """
+        self.list_model.decoration_func = decoration_func
+        self.setIconSize(QtCore.QSize(*icon_size))
+
+    def update_name(self, name):
+        """
+        Redraws the row of name, e.g., when its icon has changed.
+        """
+        self.list_model.update_name(name)
+
+    def get_nearby_names(self):
+        """
+        Returns the names in the visible rows followed by the names in the
+        page of rows below and the page of rows above them.
+        """
+        n_rows = self.list_model.rowCount()
+        if n_rows == 0:
+            return []
+        first = self.indexAt(QtCore.QPoint(0, 0)).row()
+        last = self.indexAt(QtCore.QPoint(0, self.viewport().height()-1)).row()
+        first = max(first, 0)
+        if last < 0:
+            last = n_rows - 1
+        n_visible = last - first + 1
+        rows = list(range(first, last + 1))
+        rows += list(range(last + 1, min(last + 1 + n_visible, n_rows)))
+        rows += list(range(first - 1, max(first - 1 - n_visible, -1), -1))
+        return [self.get_name(row) for row in rows]
+
+    def get_current_name(self):
+        return self.get_name(self.currentRow())
+
+
+class FileListModel(QtCore.QAbstractListModel):
+    """
+    List model holding the sweep names sorted in descending order, i.e., with
+    the newest sweep first since names start with the time stamp.
+
+    The names are kept in a sorted Python list, so adding or removing a name
+    costs a binary search and only the affected row is announced to the view.
+    Rows are handed to the view in pages of fetch_size through fetchMore, so
+    a view of a very long list only lays out the rows that have been scrolled
+    to.
+
+    Parameters
+    ----------
+    names : iterable of str
+        Initial names.
+    fetch_size : integer
+        Number of rows added to the view by each call to fetchMore.
+    parent : QtCore.QObject instance
+        Parent of the model.
+
+    Attributes
+    ----------
+    keys : list of str
+        All names in ascending order. Row i of the model is
+        keys[len(keys)-1-i].
+    """
+    def __init__(self, names=(), fetch_size=1000, parent=None):
+        super().__init__(parent)
+        self.fetch_size = fetch_size
+        self.decoration_func = None
+        self.keys = []
+        self.n_fetched = 0
+        self.set_names(names)
+
+    def set_names(self, names):
+        self.beginResetModel()
+        self.keys = sorted(set(names))
+        self.n_fetched = min(self.fetch_size, len(self.keys))
+        self.endResetModel()
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self.n_fetched
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            return self.get_name(index.row())
+        if role == QtCore.Qt.DecorationRole and \
+                self.decoration_func is not None:
+            # Only called for rows which are drawn.
+            return self.decoration_func(self.get_name(index.row()))
+        return None
+
+    def canFetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return False
+        return self.n_fetched < len(self.keys)
+
+    def fetchMore(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return
+        n_new = min(self.fetch_size, len(self.keys) - self.n_fetched)
+        if n_new <= 0:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), self.n_fetched,
+                             self.n_fetched + n_new - 1)
+        self.n_fetched += n_new
+        self.endInsertRows()
+
+    def get_name(self, row):
+        if not 0 <= row < len(self.keys):
+            return None
+        return self.keys[len(self.keys) - 1 - row]
+
+    def add_names(self, names):
+        """
+        Adds the names which are not in the model yet. New names which end up
+        in adjacent rows are inserted together, so a large number of new
+        sweeps is added quickly without resetting the model, which would
+        clear the selection and scroll position of the view.
+        """
+        names = sorted(name for name in set(names) if not self.contains(name))
+        runs = []
+        for name in names:
+            i = bisect_left(self.keys, name)
+            if runs and runs[-1][0] == i:
+                runs[-1][1].append(name)
+            else:
+                runs.append((i, [name]))
+        # Starting from the end of keys, i.e., the top row, such that the
+        # positions of the remaining runs in keys are not shifted.
+        for i, run in reversed(runs):
+            self.insert_run(i, run)
+
+    def insert_run(self, i, names):
+        """
+        Inserts the sorted names, which all belong at position i of keys.
+        """
+        row = len(self.keys) - i
+        if row < self.n_fetched:
+            n_shown = len(names)
+        elif row == self.n_fetched == len(self.keys):
+            # Names below the last row are shown up to a page and the rest is
+            # fetched by the view.
+            n_shown = min(len(names), self.fetch_size)
+        else:
+            n_shown = 0
+        n_hidden = len(names) - n_shown
+        # The lowest names end up in the rows below the fetched rows.
+        self.keys[i:i] = names[:n_hidden]
+        if n_shown == 0:
+            return
+        self.beginInsertRows(QtCore.QModelIndex(), row, row + n_shown - 1)
+        self.keys[i + n_hidden:i + n_hidden] = names[n_hidden:]
+        self.n_fetched += n_shown
+        self.endInsertRows()
+
+    def contains(self, name):
+        i = bisect_left(self.keys, name)
+        return i < len(self.keys) and self.keys[i] == name
+
+    def add_name(self, name):
+        if not self.contains(name):
+            self.insert_run(bisect_left(self.keys, name), [name])
+
+    def remove_names(self, names):
+        for name in names:
+            self.remove_name(name)
+
+    def update_name(self, name):
+        if not self.contains(name):
+            return
+        i = bisect_left(self.keys, name)
+        row = len(self.keys) - 1 - i
+        if row < self.n_fetched:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [QtCore.Qt.DecorationRole])
+
+    def remove_name(self, name):
+        i = bisect_left(self.keys, name)
+        if i == len(self.keys) or self.keys[i] != name:
+            return
+        row = len(self.keys) - 1 - i
+        if row < self.n_fetched:
+            self.beginRemoveRows(QtCore.QModelIndex(), row, row)
+            del self.keys[i]
+            self.n_fetched -= 1
+            self.endRemoveRows()
+        else:
+            del self.keys[i]
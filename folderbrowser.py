@@ -6,7 +6,14 @@ from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtWidgets import QMainWindow, QDockWidget, QDesktopWidget, QShortcut
 from PyQt5.QtGui import QKeySequence
 from filelistwidget import FileList
-from sweep import Sweep
+from sweeploader import SweepLoader, SweepPrefetcher, SweepScanner
+from sweepcache import SweepCache
+from sweepindex import SweepIndex
+from dirwatcher import DirWatcher
+from thumbnails import ThumbnailProvider
+from statspanel import StatsPanel
+from pseudodata import add_fingerprints
+import executors
 from mpllayout import MplLayout
 from customdockwidget import CustomDockWidget
 from textforcopying import TextForCopying
@@ -14,14 +21,6 @@ import importlib.util
 import textwrap
 
 
-def show_loading(func):
-    def func_wrapper(self, *args, **kwargs):
-        self.statusBar.showMessage('Loading...')
-        func(self, *args, **kwargs)
-        self.statusBar.showMessage('')
-    return func_wrapper
-
-
 class FolderBrowser(QMainWindow):
     """
     This class is the main window.
@@ -38,13 +37,75 @@ class FolderBrowser(QMainWindow):
         pseudocolumns.
     window_title : string
         Title of the window.
+    cache_dir : string or None
+        Directory for the binary column caches of the sweeps. If None the
+        caches are stored in the sweep directories next to data.dat.
+    follow_interval : integer
+        Interval in milliseconds between checks for new data when following
+        a sweep which is still being measured (hotkey F7).
+    sweep_cache_bytes : integer
+        Memory budget in bytes for keeping recently viewed sweeps (including
+        their calculated pseudocolumns) in memory. The cache statistics are
+        available from sweep_cache.get_stats().
+    prefetch_depth : integer
+        Number of sweeps on each side of the selected sweep in the FileList to
+        load in the background. Use 0 to disable prefetching.
+    prefetch_threads : integer
+        Maximum number of sweeps prefetched concurrently.
+    prefetch_max_bytes : integer or None
+        Ceiling on the memory used by prefetched sweeps which have not been
+        selected yet. If None the limit is sweep_cache_bytes.
+    pdata_max_bytes : integer or None
+        Memory budget in bytes for the pseudocolumns of each sweep. The
+        pseudocolumns which are cheapest to calculate again are evicted
+        first, and the pseudocolumns shown in the MplLayouts are never
+        evicted. If None pseudocolumns are kept until the sweep is evicted
+        from the sweep cache.
+    index_path : string or None
+        Path to the SQLite file of the persistent SweepIndex. If None the file
+        is stored in cache_dir or, if cache_dir is None, in
+        SweepIndex.default_dir.
+    watch_mode : str or None
+        How to detect new and removed sweeps without pressing F5: 'auto' to
+        use native file system notifications where possible, 'poll' to poll
+        the directories (needed for network drives written to by another
+        machine), or None to disable watching. See DirWatcher.
+    poll_interval : integer
+        Interval in milliseconds between polls when watch_mode is 'poll'.
+    thumbnail_size : tuple of integers or None
+        Width and height in pixels of the previews shown in the FileList. Use
+        None to disable previews. See ThumbnailProvider.
+    index_values : boolean
+        If True the instrument values in meta.json are indexed for the filter
+        box in the background after each scan, which reads all of meta.json
+        of new and changed sweeps. Use False on slow network drives if
+        filtering on instrument values is not needed.
     """
     def __init__(self, n_layouts, dir_path, pcols_path,
-                 window_title='FolderBrowser'):
+                 window_title='FolderBrowser', cache_dir=None,
+                 follow_interval=1000, sweep_cache_bytes=1024**3,
+                 prefetch_depth=2, prefetch_threads=1,
+                 prefetch_max_bytes=None, index_path=None, watch_mode='auto',
+                 poll_interval=1000, thumbnail_size=(64, 40),
+                 pdata_max_bytes=256*1024**2, index_values=True):
         super().__init__()
         self.n_layouts = n_layouts
         self.dir_path = dir_path
         self.pcols_path = pcols_path
+        self.cache_dir = cache_dir
+        self.follow_interval = follow_interval
+        self.sweep_cache = SweepCache(max_bytes=sweep_cache_bytes)
+        self.prefetch_depth = prefetch_depth
+        self.prefetch_threads = prefetch_threads
+        self.prefetch_max_bytes = prefetch_max_bytes
+        self.pdata_max_bytes = pdata_max_bytes
+        self.prev_row = None
+        self.selection_step = 1
+        self.index_path = index_path
+        self.index_values = index_values
+        self.watch_mode = watch_mode
+        self.poll_interval = poll_interval
+        self.thumbnail_size = thumbnail_size
         self.assert_exists(dir_path)
         self.assert_exists(pcols_path)
         self.set_pcols()
@@ -54,27 +115,92 @@ class FolderBrowser(QMainWindow):
         self.dock_widgets = []
         self.init_statusbar()
         self.init_mpl_layouts()
-        self.load_sweeps_in_dir()
+        self.init_sweep_index()
+        # Show the sweeps in the index immediately and rescan the directory in
+        # the background when the window has been shown. Sweeps found by the
+        # scan are added to the FileList as they are found.
+        self.load_sweeps_in_dir(rescan=False)
         self.init_file_list()
+        self.init_thumbnails()
+        self.init_sweep_scanner()
+        self.init_dir_watcher()
+        self.init_follow_timer()
+        self.init_sweep_loader()
+        self.init_stats_panel()
         self.setDockNestingEnabled(True)
         self.setAttribute(QtCore.Qt.WA_DeleteOnClose)
         self.set_hotkeys()
         self.set_icon()
         self.show()
+        QtCore.QTimer.singleShot(0, self.reload_file_list)
 
-    @show_loading
     def set_new_sweep(self, file_list_widget=None):
-        file_list_item = self.file_list.currentItem()
-        sweep_name = file_list_item.text()
+        """
+        Starts loading the sweep selected in the FileList in the background.
+        The plots are updated in on_sweep_loaded when loading has finished.
+        Selecting another sweep before then cancels the load.
+        """
+        sweep_name = self.file_list.get_current_name()
+        if sweep_name is None:
+            return
         sweep_path = self.sweep_dict[sweep_name]['path']
-        self.sweep = Sweep(sweep_path)
-        self.sweep_path = sweep_path
-        self.sweep.set_pdata(self.pcols.name_func_dict)
+        self.stop_following()
+        # A real selection always takes precedence over prefetching.
+        self.prefetcher.cancel()
+        self.prefetcher.mark_used(sweep_path)
+        self.update_selection_step()
+        self.statusBar.showMessage('Loading...')
+        self.sweep_loader.load(sweep_path, self.pcols.name_func_dict,
+                               self.get_sel_col_names(), context=sweep_name)
+
+    def on_sweep_loaded(self, sweep, sweep_name):
+        self.sweep = sweep
+        self.sweep_path = sweep.path
+        self.stats_panel.set_sweep(sweep)
         for mpl_layout in self.mpl_layouts:
             title_wrapped = self.wrap_title(sweep_name, mpl_layout)
             mpl_layout.set_title(title_wrapped)
             mpl_layout.reset_and_plot(self.sweep)
         self.sweep_name = sweep_name
+        self.statusBar.showMessage('')
+        self.prefetch_neighbors()
+
+    def on_sweep_load_failed(self, error, sweep_name):
+        msg = 'Loading {} failed: {}'.format(sweep_name, error)
+        self.statusBar.showMessage(msg, 3000)
+        self.prefetch_neighbors()
+
+    def get_sel_col_names(self):
+        col_names = set()
+        for mpl_layout in self.mpl_layouts:
+            col_names.update(mpl_layout.plotcontrols.get_sel_cols())
+        return col_names
+
+    def update_selection_step(self):
+        row = self.file_list.currentRow()
+        if self.prev_row is not None and row != self.prev_row:
+            self.selection_step = 1 if row > self.prev_row else -1
+        self.prev_row = row
+
+    def prefetch_neighbors(self):
+        """
+        Prefetches the sweeps next to the current row in the FileList. Rows in
+        the direction the user is moving through the list are loaded first.
+        """
+        if self.prefetch_depth < 1:
+            return
+        row = self.file_list.currentRow()
+        step = self.selection_step
+        rows = [row + step*i for i in range(1, self.prefetch_depth + 1)]
+        rows += [row - step*i for i in range(1, self.prefetch_depth + 1)]
+        paths = []
+        for row in rows:
+            sweep_name = self.file_list.get_name(row)
+            if sweep_name is None:
+                continue
+            paths.append(self.sweep_dict[sweep_name]['path'])
+        self.prefetcher.prefetch(paths, self.pcols.name_func_dict,
+                                 self.get_sel_col_names())
 
     def init_statusbar(self):
         self.statusBar = QtWidgets.QStatusBar()
@@ -94,39 +220,274 @@ class FolderBrowser(QMainWindow):
             self.dock_widgets.append(dock_widget)
         self.set_active_layout(self.mpl_layouts[0])
 
-    def load_sweeps_in_dir(self):
+    def init_sweep_index(self):
+        index_path = self.index_path
+        if index_path is None and self.cache_dir is not None:
+            index_path = os.path.join(self.cache_dir, SweepIndex.db_name)
+        self.sweep_index = SweepIndex(self.dir_path, index_path,
+                                      index_values=self.index_values)
+
+    def load_sweeps_in_dir(self, rescan=True):
+        """
+        Sets sweep_dict from the SweepIndex. If rescan is True the data
+        directory is rescanned first, which only parses the sweep directories
+        that have changed since the last scan. Returns the number of sweeps.
+        """
+        if rescan:
+            entries = self.sweep_index.rescan()
+        else:
+            entries = self.sweep_index.get_entries()
         self.sweep_dict = {}
-        dir_walker = os.walk(self.dir_path, followlinks=False)
-        for sub_dir_path, _, fnames in dir_walker:
-            try:
-                meta = Sweep.load_dir(sub_dir_path, meta_only=True)
-            except FileNotFoundError:
-                continue
-            time_stamp = os.path.split(sub_dir_path)[-1]
-            sweep_name = time_stamp + ' ' + meta['name']
+        self.add_to_sweep_dict(entries.values())
+        return len(self.sweep_dict)
+
+    def add_to_sweep_dict(self, entries):
+        """
+        Adds SweepIndex entries to sweep_dict and returns their sweep names.
+        """
+        sweep_names = []
+        for entry in entries:
+            time_stamp = entry['time_stamp']
+            sweep_name = time_stamp + ' ' + entry['name']
             self.sweep_dict[sweep_name] = {}
-            self.sweep_dict[sweep_name]['path'] = sub_dir_path
+            self.sweep_dict[sweep_name]['path'] = entry['path']
             self.sweep_dict[sweep_name]['time_stamp'] = time_stamp
+            self.sweep_dict[sweep_name]['dimension'] = entry['dimension']
+            sweep_names.append(sweep_name)
+        return sweep_names
 
     def init_file_list(self):
         names = self.sweep_dict.keys()
         self.file_list = FileList(names)
         self.file_list.itemClicked.connect(self.set_new_sweep)
         self.file_list.itemActivated.connect(self.set_new_sweep)
+        self.filter_box = QtWidgets.QLineEdit()
+        self.filter_box.setPlaceholderText(
+            'Filter, e.g., gate dim=2 chan=backgate MC<0.05')
+        self.filter_box.setClearButtonEnabled(True)
+        self.filter_timer = QtCore.QTimer(self)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(200)
+        self.filter_timer.timeout.connect(self.apply_filter)
+        self.filter_box.textChanged.connect(self.filter_timer.start)
+        self.filter_box.returnPressed.connect(self.apply_filter)
+        browser_widget = QtWidgets.QWidget()
+        layout = QtWidgets.QVBoxLayout(browser_widget)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.filter_box)
+        layout.addWidget(self.file_list)
         dock_widget = QDockWidget('Browser', self)
-        dock_widget.setWidget(self.file_list)
+        dock_widget.setWidget(browser_widget)
         dock_widget.setAllowedAreas(QtCore.Qt.AllDockWidgetAreas)
         self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, dock_widget)
         self.dock_widgets.append(dock_widget)
 
+    def init_stats_panel(self):
+        """
+        Adds the StatsPanel in a hidden dock widget which is toggled with F8.
+        """
+        self.stats_panel = StatsPanel(self.mpl_layouts)
+        dock_widget = QDockWidget('Statistics', self)
+        dock_widget.setWidget(self.stats_panel)
+        dock_widget.setAllowedAreas(QtCore.Qt.AllDockWidgetAreas)
+        self.addDockWidget(QtCore.Qt.BottomDockWidgetArea, dock_widget)
+        dock_widget.hide()
+        self.stats_dock_widget = dock_widget
+
+    def toggle_stats_panel(self):
+        dock_widget = self.stats_dock_widget
+        dock_widget.setVisible(not dock_widget.isVisible())
+
+    def init_thumbnails(self):
+        self.thumbnails = None
+        if self.thumbnail_size is None:
+            return
+        self.thumbnails = ThumbnailProvider(self.thumbnail_size,
+                                            cache_dir=self.cache_dir,
+                                            parent=self)
+        self.thumbnails.ready.connect(self.file_list.update_name)
+        # Rows without a preview get a blank one so all rows have the same
+        # height.
+        self.blank_thumbnail = QtGui.QPixmap(*self.thumbnail_size)
+        self.blank_thumbnail.fill(QtCore.Qt.transparent)
+        self.file_list.set_decoration_func(self.get_thumbnail,
+                                           self.thumbnail_size)
+        # Previews are requested for the visible rows and the rows about to
+        # scroll into view when the list has settled.
+        self.thumbnail_timer = QtCore.QTimer(self)
+        self.thumbnail_timer.setSingleShot(True)
+        self.thumbnail_timer.setInterval(100)
+        self.thumbnail_timer.timeout.connect(self.request_thumbnails)
+        scroll_bar = self.file_list.verticalScrollBar()
+        scroll_bar.valueChanged.connect(self.thumbnail_timer.start)
+        list_model = self.file_list.list_model
+        list_model.modelReset.connect(self.thumbnail_timer.start)
+        list_model.rowsInserted.connect(self.thumbnail_timer.start)
+        self.thumbnail_timer.start()
+
+    def get_thumbnail(self, sweep_name):
+        sweep = self.sweep_dict.get(sweep_name)
+        if sweep is None:
+            return self.blank_thumbnail
+        pixmap = self.thumbnails.get(sweep_name, sweep['path'])
+        if pixmap is None:
+            return self.blank_thumbnail
+        return pixmap
+
+    def request_thumbnails(self):
+        items = []
+        for sweep_name in self.file_list.get_nearby_names():
+            sweep = self.sweep_dict.get(sweep_name)
+            if sweep is not None:
+                items.append((sweep_name, sweep['path']))
+        self.thumbnails.request(items)
+        # Rows drawn since the previous request may have been dropped from
+        # the queue. Redrawing requests them again.
+        self.file_list.viewport().update()
+
+    def apply_filter(self):
+        """
+        Shows only the sweeps matching the query in the filter box. See
+        SweepIndex.query for the syntax.
+        """
+        self.filter_timer.stop()
+        query_str = self.filter_box.text().strip()
+        if not query_str:
+            self.file_list.set_filter(None)
+            return
+        try:
+            paths = self.sweep_index.query(query_str)
+        except ValueError as error:
+            msg = 'Invalid filter: {}'.format(error)
+            self.statusBar.showMessage(msg, 3000)
+            return
+        sweep_names = [name for name, sweep in self.sweep_dict.items()
+                       if sweep['path'] in paths]
+        self.file_list.set_filter(sweep_names)
+        msg = '{} sweeps match the filter.'.format(len(sweep_names))
+        self.statusBar.showMessage(msg, 1000)
+
+    def init_sweep_scanner(self):
+        self.sweep_scanner = SweepScanner(self.sweep_index, parent=self)
+        self.sweep_scanner.found.connect(self.on_sweeps_found)
+        self.sweep_scanner.finished.connect(self.on_scan_finished)
+        self.sweep_scanner.failed.connect(self.on_scan_failed)
+        self.sweep_scanner.values_indexed.connect(self.on_values_indexed)
+        self.sweep_scanner.values_failed.connect(self.on_values_failed)
+
+    def init_dir_watcher(self):
+        self.dir_watcher = None
+        if self.watch_mode is None:
+            return
+        self.dir_watcher = DirWatcher(self.dir_path, mode=self.watch_mode,
+                                      poll_interval=self.poll_interval,
+                                      parent=self)
+        self.dir_watcher.dirs_changed.connect(self.sweep_scanner.scan)
+        sweep_paths = [d['path'] for d in self.sweep_dict.values()]
+        self.dir_watcher.set_sweep_paths(sweep_paths)
+
     def reload_file_list(self):
-        self.load_sweeps_in_dir()
-        names = self.sweep_dict.keys()
-        self.file_list.names = names
-        self.file_list.reload_items()
+        """
+        Rescans the data directory in the background. The FileList is updated
+        while scanning.
+        """
+        if self.sweep_scanner.scan():
+            self.statusBar.showMessage('Scanning for sweeps...')
+
+    def on_sweeps_found(self, entries):
+        sweep_names = self.add_to_sweep_dict(entries)
+        if self.thumbnails is not None:
+            # The sweeps may have changed.
+            for sweep_name in sweep_names:
+                self.thumbnails.remove(sweep_name)
+        self.file_list.add_names(sweep_names)
+        msg = 'Scanning for sweeps... {} found.'.format(len(self.sweep_dict))
+        self.statusBar.showMessage(msg)
+
+    def on_scan_finished(self, entries):
+        self.sweep_dict = {}
+        sweep_names = self.add_to_sweep_dict(entries.values())
+        removed = self.file_list.get_names().difference(sweep_names)
+        self.file_list.remove_names(removed)
+        self.file_list.add_names(sweep_names)
+        if self.filter_box.text().strip():
+            # Sweeps found by the scan are matched against the filter.
+            self.apply_filter()
+        if self.dir_watcher is not None:
+            self.dir_watcher.set_sweep_paths(entries.keys())
         msg = 'File list reloaded.'
         self.statusBar.showMessage(msg, 1000)
 
+    def on_values_indexed(self, n_indexed):
+        if self.filter_box.text().strip():
+            # Filters on instrument values may match more sweeps now.
+            self.apply_filter()
+
+    def on_values_failed(self, error):
+        msg = 'Indexing instrument values failed: {}'.format(error)
+        self.statusBar.showMessage(msg, 3000)
+
+    def on_scan_failed(self, error):
+        msg = 'Scanning for sweeps failed: {}'.format(error)
+        self.statusBar.showMessage(msg, 3000)
+
+    def init_sweep_loader(self):
+        self.sweep_loader = SweepLoader(cache_dir=self.cache_dir,
+                                        sweep_cache=self.sweep_cache,
+                                        parent=self,
+                                        pdata_max_bytes=self.pdata_max_bytes)
+        self.sweep_loader.loaded.connect(self.on_sweep_loaded)
+        self.sweep_loader.failed.connect(self.on_sweep_load_failed)
+        self.prefetcher = SweepPrefetcher(
+            self.sweep_cache, cache_dir=self.cache_dir,
+            max_threads=self.prefetch_threads,
+            max_bytes=self.prefetch_max_bytes, parent=self,
+            pdata_max_bytes=self.pdata_max_bytes)
+
+    def init_follow_timer(self):
+        self.follow_timer = QtCore.QTimer(self)
+        self.follow_timer.setInterval(self.follow_interval)
+        self.follow_timer.timeout.connect(self.follow_sweep)
+
+    def toggle_following(self):
+        if self.follow_timer.isActive():
+            self.stop_following()
+            self.statusBar.showMessage('Stopped following sweep.', 1000)
+            return
+        if self.sweep is None:
+            msg = 'No sweep selected. Select a sweep to follow it.'
+            self.statusBar.showMessage(msg, 3000)
+            return
+        self.follow_timer.start()
+        self.follow_sweep(redraw=True)
+
+    def stop_following(self):
+        self.follow_timer.stop()
+
+    def follow_sweep(self, redraw=False):
+        """
+        Appends new data to the current sweep and updates the plots if any
+        data was added or if redraw is True.
+        """
+        try:
+            n_new_rows = self.sweep.refresh()
+        except (OSError, ValueError, RuntimeError) as error:
+            self.stop_following()
+            msg = 'Following sweep failed: {}'.format(error)
+            self.statusBar.showMessage(msg, 3000)
+            return
+        msg = 'Following sweep ({} rows).'.format(self.sweep.n_rows)
+        self.statusBar.showMessage(msg)
+        if n_new_rows == 0 and not redraw:
+            return
+        for mpl_layout in self.mpl_layouts:
+            mpl_layout.update_sel_cols()
+
+    def closeEvent(self, event):
+        # Queued pseudocolumns and pyramids would delay the exit.
+        executors.shutdown()
+        super().closeEvent(event)
+
     def set_active_layout(self, layout):
         try:
             inactive_str = 'background-color: 10; border: none'
@@ -144,8 +505,14 @@ class FolderBrowser(QMainWindow):
         self.open_folder_hotkey.activated.connect(self.reload_file_list)
         self.open_folder_hotkey = QShortcut(QKeySequence('F6'), self)
         self.open_folder_hotkey.activated.connect(self.reload_pcols)
+        self.open_folder_hotkey = QShortcut(QKeySequence('F7'), self)
+        self.open_folder_hotkey.activated.connect(self.toggle_following)
+        self.stats_hotkey = QShortcut(QKeySequence('F8'), self)
+        self.stats_hotkey.activated.connect(self.toggle_stats_panel)
         self.copy_fig_hotkey = QShortcut(QKeySequence('Ctrl+c'), self)
         self.copy_fig_hotkey.activated.connect(self.copy_active_fig)
+        self.filter_hotkey = QShortcut(QKeySequence('Ctrl+f'), self)
+        self.filter_hotkey.activated.connect(self.filter_box.setFocus)
         self.open_folder_hotkey = QShortcut(QKeySequence('Ctrl+t'), self)
         self.open_folder_hotkey.activated.connect(self.show_text_for_copying)
         self.open_folder_hotkey = QShortcut(QKeySequence('Ctrl+w'), self)
@@ -196,12 +563,16 @@ class FolderBrowser(QMainWindow):
         spec = importlib.util.spec_from_file_location('', self.pcols_path)
         pcols = importlib.util.module_from_spec(spec)
         spec.loader.exec_module(pcols)
+        # The fingerprints must be taken while the file matches the module.
+        add_fingerprints(pcols.name_func_dict)
         self.pcols = pcols
 
     def reload_pcols(self):
         self.set_pcols()
-        self.sweep.set_pdata(self.pcols.name_func_dict)
         msg = 'pcols reloaded.'
+        if self.sweep is not None:
+            invalid = self.sweep.set_pdata(self.pcols.name_func_dict)
+            msg = 'pcols reloaded, {} invalidated.'.format(len(invalid))
         self.statusBar.showMessage(msg, 1000)
 
     def code_to_clipboard(self):
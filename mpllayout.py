@@ -1,5 +1,6 @@
 from PyQt5 import QtCore, QtWidgets
 from PyQt5.QtWidgets import QSizePolicy
+import time
 from plotcontrols import PlotControls
 from matplotlib.backends.backend_qt5 import NavigationToolbar2QT
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
@@ -24,19 +25,37 @@ class MplLayout(QtWidgets.QWidget):
     parent : QtWidgets.QMainWindow instance
         The parent FolderBrowser instance.
 
+    Attributes
+    ----------
+    timings : dictionary
+        Maps columns, data_handler, plot and draw to the time in seconds spent
+        on getting the columns (including calculating pseudocolumns), in the
+        DataHandler, on updating the plot and on drawing the canvas (which is
+        part of plot) the last time the plot was updated.
+
+    Signals
+    -------
+    plot_updated()
+        Emitted when the plot has been updated for new columns or a new sweep.
+
     The starting point for this class was the Matplotlib example file
     embedding_in_qt5.py
     from
     https://matplotlib.org/examples/user_interfaces/embedding_in_qt5.html
     """
+    plot_updated = QtCore.pyqtSignal()
+    # Emitted from a background thread.
+    pyramid_ready = QtCore.pyqtSignal()
+
     def __init__(self, statusBar=None, parent=None):
         super().__init__()
         self.statusBar = statusBar
         self.parent = parent
+        self.sweep = None
         self.init_fig_and_canvas()
         self.cmap_names = ['Reds', 'Blues_r', 'dark symmetric',
                            'light symmetric', 'inferno', 'viridis', 'afmhot']
-        self.plot_2D_types = ('Auto', 'imshow', 'pcolormesh')
+        self.plot_2D_types = ('Auto', 'imshow', 'pcolormesh', 'resampled')
         self.plotcontrols = PlotControls(self.cmap_names, self.plot_2D_types)
         self.set_callback_functions()
 
@@ -60,8 +79,28 @@ class MplLayout(QtWidgets.QWidget):
         self.scilimits = (-3,3)
         self.n_active_cols = None
         self.plot_2D_type = None
+        self.timings = {}
+        self.image = None
+        self.indicator = None
+        # 'resampled', 'level' or 'decimated' if the plot depends on the
+        # view, see update_view.
+        self.view_mode = None
+        self.lines = None
+        self.decimate = self.plotcontrols.get_decimate()
+        self.data_h = None
+        # Changes of the view (zoom, pan and resize) are handled once the
+        # user has stopped changing it.
+        self.view_timer = QtCore.QTimer()
+        self.view_timer.setSingleShot(True)
+        self.view_timer.setInterval(100)
+        self.view_timer.timeout.connect(self.update_view)
+        self.canvas.mpl_connect('resize_event', self.schedule_view_update)
+        self.pyramid_ready.connect(self.schedule_view_update)
 
     def reset_and_plot(self, sweep):
+        if self.sweep is not None and self.sweep is not sweep:
+            # The old sweep may be kept in the sweep cache.
+            self.sweep.pdata.pin(self, ())
         self.sweep = sweep
         raw_col_names = list(self.sweep.data.dtype.names)
         pcol_names = self.sweep.pdata.get_names()
@@ -84,6 +123,7 @@ class MplLayout(QtWidgets.QWidget):
             self.plotcontrols.set_text_on_box(2, self.none_str)
             self.update_sel_cols()
             return
+        self.timings = {}
         self.set_data_for_plot(new_col_names)
         tmp = (self.plot_dim, self.data_h.n_data_arrs)
         if tmp in ((1,2), (2,3)) and self.data_h.data_is_valid:
@@ -93,28 +133,45 @@ class MplLayout(QtWidgets.QWidget):
             self.update_plot()
         else:
             self.clear_axis(redraw=True)
+        self.plot_updated.emit()
 
     def set_data_for_plot(self, new_col_names):
+        t_start = time.perf_counter()
         new_plot_data = [None] * len(new_col_names)
+        lin_axes = [None] * len(new_col_names)
+        # The columns shown are never evicted. Independent pseudocolumns are
+        # calculated concurrently, and errors are reported below.
+        self.sweep.pdata.pin(self, new_col_names)
+        self.sweep.pdata.compute(new_col_names)
         for i, col_name in enumerate(new_col_names):
             sweep = self.sweep
             raw_data_col_names = sweep.data.dtype.names
             pdata_col_names = sweep.pdata.name_func_dict.keys()
             if col_name in raw_data_col_names:
                 new_plot_data[i] = sweep.data[col_name]
+                # The DataHandler only searches columns not described by the
+                # grid of the sweep for linearity.
+                lin_axes[i] = sweep.get_grid().get_axis(col_name)
             elif col_name in pdata_col_names:
                 try:
                     new_plot_data[i] = sweep.pdata[col_name]
                 except Exception as error:
-                    msg = 'Calculation of pseudocolumn failed'
-                    self.statusBar.showMessage(msg, 2000)
-        new_data_h = data_handler_factory(*new_plot_data)
+                    # The traceback is recorded in sweep.pdata.errors.
+                    msg = 'Calculation of pseudocolumn {} failed: {}'.format(
+                        col_name, error)
+                    self.statusBar.showMessage(msg, 5000)
+        t_data_handler = time.perf_counter()
+        self.timings['columns'] = t_data_handler - t_start
+        new_data_h = data_handler_factory(*new_plot_data, lin_axes=lin_axes)
+        self.timings['data_handler'] = time.perf_counter() - t_data_handler
         self.sel_col_names = new_col_names
         self.n_active_cols = len(new_col_names)
         ax = self.canvas.figure.axes[0]
         plot_dim = self.n_active_cols - 1
         self.plot_dim = plot_dim
         self.plot_h = plot_handler_factory(ax, new_data_h, plot_dim=plot_dim)
+        if self.data_h is not None:
+            self.data_h.stop_pyramid()
         self.data_h = new_data_h
 
     def set_labels(self):
@@ -160,13 +217,19 @@ class MplLayout(QtWidgets.QWidget):
             self.update_plot()
 
     def update_plot(self):
+        t_start = time.perf_counter()
         if self.plot_is_2D: self._update_2D_plot()
         else: self._update_1D_plot()
         self.update_is_scheduled = False
+        self.timings['plot'] = time.perf_counter() - t_start
 
     def _update_1D_plot(self):
         self.clear_axis(redraw=False)
-        self.plot_h.plot()
+        self.plot_h.decimate = self.decimate
+        self.lines = self.plot_h.plot(xlim=self.lims[0])
+        if self.plot_h.is_decimated():
+            self.view_mode = 'decimated'
+            self.set_indicator(self.plot_h.view_note)
         self.common_plot_update()
 
     def _update_2D_plot(self):
@@ -175,13 +238,29 @@ class MplLayout(QtWidgets.QWidget):
             self.clear_axis(redraw=True)
             return
         self.clear_axis(redraw=False)
-        self.image = self.plot_h.plot(plot_type=self.plot_2D_type)
+        if self.plot_2D_type == 'resampled':
+            self.view_mode = 'resampled'
+            self.image = self.plot_h.plot(plot_type=self.plot_2D_type,
+                                          xlim=self.lims[0],
+                                          ylim=self.lims[1])
+        elif self.plot_2D_type in (None, 'imshow') and \
+                self.data_h.start_pyramid(self.pyramid_ready.emit):
+            # Large data is drawn at the resolution of the canvas.
+            self.view_mode = 'level'
+            self.image = self.plot_h.plot_level(self.lims[0], self.lims[1])
+        else:
+            self.image = self.plot_h.plot(plot_type=self.plot_2D_type)
+        if self.view_mode is not None:
+            self.set_indicator(self.plot_h.view_note)
         self.cbar = fig.colorbar(mappable=self.image)
         self.cbar.formatter.set_powerlimits(self.scilimits)
         self.image.set_cmap(self.cmap)
         self.image.set_clim(self.lims[2])
         self.cbar.set_label(self.labels[2])
-        self.cbar.draw_all()
+        if hasattr(self.cbar, 'draw_all'):
+            # Newer versions of Matplotlib update the colorbar by themselves
+            # and have no draw_all.
+            self.cbar.draw_all()
         self.common_plot_update()
 
     def common_plot_update(self):
@@ -197,7 +276,49 @@ class MplLayout(QtWidgets.QWidget):
         ax.set_title(self.title, fontsize=11)
         ax.set_aspect(self.aspect)
         self.custom_tight_layout()
+        # cla removes the callbacks, so they are connected for every plot.
+        ax.callbacks.connect('xlim_changed', self.schedule_view_update)
+        ax.callbacks.connect('ylim_changed', self.schedule_view_update)
+        t_start = time.perf_counter()
         self.canvas.draw()
+        self.timings['draw'] = time.perf_counter() - t_start
+        # The size of the axes is only final after custom_tight_layout.
+        self.schedule_view_update()
+
+    def schedule_view_update(self, *args):
+        self.view_timer.start()
+
+    def update_view(self):
+        """
+        Adapts the plot to the current limits of the axes and size of the
+        canvas after zooming, panning or resizing.
+        """
+        ax = self.canvas.figure.axes[0]
+        xlim, ylim = ax.get_xlim(), ax.get_ylim()
+        if self.view_mode == 'resampled':
+            changed = self.plot_h.update_resampled(self.image, xlim, ylim)
+        elif self.view_mode == 'level':
+            changed = self.plot_h.update_level(self.image, xlim, ylim)
+        elif self.view_mode == 'decimated':
+            changed = self.plot_h.update_decimated(self.lines, xlim)
+        else:
+            return
+        if changed:
+            self.set_indicator(self.plot_h.view_note)
+            self.canvas.draw_idle()
+
+    def set_indicator(self, text):
+        """
+        Shows text in the lower right corner of the axes, e.g., to indicate
+        that the plot does not show the data points as they are.
+        """
+        if self.indicator is not None:
+            self.indicator.set_text(text)
+            return
+        ax = self.canvas.figure.axes[0]
+        self.indicator = ax.text(0.99, 0.01, text, transform=ax.transAxes,
+                                 ha='right', va='bottom', fontsize=8,
+                                 color='gray')
 
     def clear_axis(self, redraw=True):
         try:
@@ -206,6 +327,9 @@ class MplLayout(QtWidgets.QWidget):
             self.image = None
         except AttributeError:
             pass
+        self.indicator = None
+        self.view_mode = None
+        self.lines = None
         for ax in self.canvas.figure.axes:
             ax.cla()
             ax.relim()
@@ -235,6 +359,7 @@ class MplLayout(QtWidgets.QWidget):
         pt.cmap_sel.activated.connect(self.update_cmap)
         pt.plot_2D_type_sel.activated.connect(self.set_plot_2D_type)
         pt.aspect_box.editingFinished.connect(self.update_aspect)
+        pt.decimate_box.stateChanged.connect(self.set_decimate)
 
     def init_fig_and_canvas(self):
         fig = Figure(facecolor='white')
@@ -261,6 +386,13 @@ class MplLayout(QtWidgets.QWidget):
         if not self.update_is_scheduled:
             self.update_plot()
 
+    def set_decimate(self, state=None):
+        self.decimate = self.plotcontrols.get_decimate()
+        if self.sweep is None or self.plot_is_2D:
+            return
+        if not self.update_is_scheduled:
+            self.update_plot()
+
     def set_title(self, title):
         self.title = title
 
@@ -0,0 +1,119 @@
+import os
+import json
+import hashlib
+import numpy as np
+from columncache import ColumnCache
+
+
+class PcolCache(object):
+    """
+    Binary cache of the pseudocolumns calculated for a sweep.
+
+    Every pseudocolumn is stored as a .npy file together with a .json file
+    recording the signature of the sweep (see ColumnCache.get_signature), the
+    fingerprint of the function (see pseudodata.get_fingerprint), the keys of
+    data and pdata the function read, and the fingerprints of all the
+    pseudocolumns it depends on directly or indirectly. A cached pseudocolumn
+    is only used if all of these still match, so it becomes stale when the
+    sweep or any of the functions involved is changed in the pseudocolumn
+    file.
+
+    Parameters
+    ----------
+    sweep_path : str
+        Full path to a sweep directory.
+    cache_dir : str or None
+        See ColumnCache. The pseudocolumns are stored in the subdirectory
+        dir_name of the ColumnCache directory.
+    min_time : float
+        Only pseudocolumns which took at least min_time seconds to calculate
+        are written to the cache, since reading a cheap pseudocolumn from disk
+        can be slower than calculating it.
+    """
+    dir_name = 'pcols'
+    version = 1
+
+    def __init__(self, sweep_path, cache_dir=None, min_time=0.05):
+        self.sweep_path = sweep_path
+        self.min_time = min_time
+        cache_path = ColumnCache.get_cache_path(sweep_path, cache_dir)
+        self.path = os.path.join(cache_path, self.dir_name)
+
+    def read(self, key, signature, fingerprints):
+        """
+        Returns a tuple (pcol, deps, all_deps) with the cached pseudocolumn
+        key, a dictionary with the lists data and pdata of the keys it was
+        calculated from and a list of all pseudocolumns it depends on directly
+        or indirectly, or None if there is no valid entry. fingerprints maps
+        the names of the pseudocolumns to their current fingerprints.
+        """
+        if signature is None or key not in fingerprints:
+            return None
+        npy_path, json_path = self.get_paths(key)
+        try:
+            with open(json_path) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('version') != self.version or entry.get('key') != key:
+            return None
+        if entry.get('signature') != signature:
+            return None
+        if entry.get('fingerprint') != fingerprints[key]:
+            return None
+        for dep, fingerprint in entry['dep_fingerprints'].items():
+            if fingerprints.get(dep) != fingerprint:
+                return None
+        try:
+            pcol = np.load(npy_path, mmap_mode='c')
+        except (OSError, ValueError):
+            return None
+        return pcol, entry['deps'], list(entry['dep_fingerprints'])
+
+    def write(self, key, pcol, signature, fingerprint, deps,
+              dep_fingerprints):
+        """
+        Writes the pseudocolumn key to the cache. deps is a dictionary with
+        the sets data and pdata of the keys read by its function and
+        dep_fingerprints maps every pseudocolumn it depends on to its
+        fingerprint. Returns True if the pseudocolumn was written.
+        """
+        if signature is None or not self.is_cacheable(pcol):
+            return False
+        npy_path, json_path = self.get_paths(key)
+        entry = {
+            'version': self.version,
+            'key': key,
+            'signature': signature,
+            'fingerprint': fingerprint,
+            'deps': {'data': sorted(deps['data']),
+                     'pdata': sorted(deps['pdata'])},
+            'dep_fingerprints': dep_fingerprints,
+        }
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            # The entry is written last, so a reader never sees a valid entry
+            # pointing at a half-written array.
+            if os.path.exists(json_path):
+                os.remove(json_path)
+            tmp_path = npy_path + '.tmp.npy'
+            np.save(tmp_path, pcol)
+            os.replace(tmp_path, npy_path)
+            tmp_path = json_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, json_path)
+        except (OSError, TypeError, ValueError):
+            return False
+        return True
+
+    def get_paths(self, key):
+        # Names of pseudocolumns may contain characters like '/' so a hash of
+        # the name is used in the file names.
+        key_hash = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        base_path = os.path.join(self.path, key_hash)
+        return base_path + '.npy', base_path + '.json'
+
+    @staticmethod
+    def is_cacheable(pcol):
+        return isinstance(pcol, np.ndarray) and pcol.dtype.kind in 'biufc'
@@ -0,0 +1,196 @@
+import ast
+import numbers
+import numpy as np
+import executors
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+
+functions = {
+    'abs': np.abs,
+    'sign': np.sign,
+    'sqrt': np.sqrt,
+    'exp': np.exp,
+    'log': np.log,
+    'log10': np.log10,
+    'sin': np.sin,
+    'cos': np.cos,
+    'tan': np.tan,
+    'arcsin': np.arcsin,
+    'arccos': np.arccos,
+    'arctan': np.arctan,
+    'arctan2': np.arctan2,
+    'sinh': np.sinh,
+    'cosh': np.cosh,
+    'tanh': np.tanh,
+    'real': np.real,
+    'imag': np.imag,
+}
+# numexpr has no sign function.
+numexpr_functions = set(functions) - {'sign'}
+operators = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow, ast.Mod,
+             ast.USub, ast.UAdd)
+
+
+class Expression(object):
+    """
+    Pseudocolumn function defined by an arithmetic expression over columns,
+    pseudocolumns and constants, e.g.,
+    ```python
+    func = Expression('lockin_curr_left / lockin_bias_left / esquared_over_h',
+                      globals())
+    name_func_dict['conductance4_left'] = {'func': func, 'label': label}
+    ```
+    The expression is parsed once and may only contain numbers, names,
+    the operators + - * / ** % and the functions in functions. Names found in
+    namespace with a numerical value are constants, and all other names are
+    looked up in data and otherwise in pdata when the expression is
+    evaluated, so they must be valid Python identifiers.
+
+    Writing the expression as a Python function allocates a temporary array
+    of the full size for every operation. Instead, the expression is
+    evaluated with numexpr if it is installed, and otherwise in chunks of
+    rows on a thread pool, so only chunk-sized temporaries are allocated and
+    each chunk is written into a single preallocated output array.
+
+    Parameters
+    ----------
+    expr : str
+        The expression.
+    namespace : dictionary or None
+        Namespace in which constants are looked up, e.g., globals() of the
+        pseudocolumn file.
+    chunk_size : integer
+        Approximate number of elements evaluated at a time by NumPy.
+    use_numexpr : bool
+        If False NumPy is used even if numexpr is installed.
+
+    Attributes
+    ----------
+    names : list of str
+        Names of the columns and pseudocolumns used by the expression.
+    constants : dictionary
+        Values of the constants used by the expression.
+    """
+    def __init__(self, expr, namespace=None, chunk_size=2**16,
+                 use_numexpr=True):
+        if namespace is None:
+            namespace = {}
+        self.expr = expr
+        self.chunk_size = chunk_size
+        tree = ast.parse(expr.strip(), mode='eval')
+        used_names, used_functions = self.check_tree(tree)
+        self.constants = {}
+        self.names = []
+        for name in sorted(used_names):
+            value = namespace.get(name)
+            if isinstance(value, numbers.Number):
+                self.constants[name] = value
+            else:
+                self.names.append(name)
+        self.code = compile(tree, '<expression>', 'eval')
+        self.use_numexpr = (use_numexpr and numexpr is not None and
+                            used_functions <= numexpr_functions)
+
+    def __repr__(self):
+        # Used for the fingerprint of the pseudocolumn.
+        constants = sorted(self.constants.items())
+        return 'Expression({!r}, {!r})'.format(self.expr, constants)
+
+    def __call__(self, data, pdata, meta):
+        inputs = dict(self.constants)
+        for name in self.names:
+            inputs[name] = self.get_column(name, data, pdata)
+        if self.use_numexpr:
+            return numexpr.evaluate(self.expr, local_dict=inputs,
+                                    global_dict={})
+        return self.evaluate_chunked(inputs)
+
+    @staticmethod
+    def check_tree(tree):
+        """
+        Raises ValueError if tree contains anything but the allowed operators
+        and functions. Returns the sets of names and functions used.
+        """
+        names = set()
+        used_functions = set()
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Call):
+                is_allowed = (isinstance(node.func, ast.Name) and
+                              node.func.id in functions and
+                              not node.keywords)
+                if not is_allowed:
+                    raise ValueError('Only the functions {} can be called in '
+                                     'expressions.'.format(
+                                         ', '.join(sorted(functions))))
+                used_functions.add(node.func.id)
+            elif isinstance(node, ast.Name):
+                if node.id not in functions:
+                    names.add(node.id)
+            elif isinstance(node, ast.Constant):
+                if not isinstance(node.value, numbers.Number) or \
+                        isinstance(node.value, bool):
+                    raise ValueError('Only numbers are allowed as constants '
+                                     'in expressions.')
+            elif not isinstance(node, (ast.Expression, ast.BinOp,
+                                       ast.UnaryOp, ast.Load) + operators):
+                raise ValueError('{} is not allowed in expressions.'.format(
+                    type(node).__name__))
+        return names, used_functions
+
+    def get_column(self, name, data, pdata):
+        if name in data:
+            return np.asarray(data[name])
+        try:
+            return np.asarray(pdata[name])
+        except KeyError:
+            err_str = '{} in expression {} is neither a column nor a ' \
+                      'pseudocolumn.'
+            raise KeyError(err_str.format(name, self.expr))
+
+    def evaluate_chunked(self, inputs):
+        """
+        Evaluates the expression in chunks along the first axis, which keeps
+        views of the inputs, and writes the chunks into one output array.
+        """
+        arrays = [v for v in inputs.values() if np.ndim(v) > 0]
+        shape = np.broadcast_shapes(*[np.shape(a) for a in arrays])
+        if not shape:
+            return self.evaluate(inputs)
+        n_rows = shape[0]
+        row_size = int(np.prod(shape[1:]))
+        rows_per_chunk = max(1, self.chunk_size // max(row_size, 1))
+        starts = list(range(0, n_rows, rows_per_chunk))
+        def evaluate_chunk(start):
+            stop = start + rows_per_chunk
+            chunk_inputs = {}
+            for name, value in inputs.items():
+                if np.ndim(value) == len(shape) and value.shape[0] == n_rows:
+                    value = value[start:stop]
+                # Other inputs are broadcast along the first axis.
+                chunk_inputs[name] = value
+            return np.broadcast_to(self.evaluate(chunk_inputs),
+                                   (len(range(start, min(stop, n_rows))),) +
+                                   shape[1:])
+        # The dtype of the output is that of the first chunk.
+        first_chunk = evaluate_chunk(0)
+        out = np.empty(shape, dtype=first_chunk.dtype)
+        out[:len(first_chunk)] = first_chunk
+        del first_chunk
+        def write_chunk(start):
+            out[start:start + rows_per_chunk] = evaluate_chunk(start)
+        if executors.in_executor():
+            # Called by a task of the compute executor, e.g., a pseudocolumn
+            # calculated by PseudoData.compute, which must not wait for
+            # chunks queued behind it.
+            for start in starts[1:]:
+                write_chunk(start)
+        elif len(starts) > 1:
+            # NumPy releases the GIL, so the chunks run on several cores.
+            list(executors.get_executor().map(write_chunk, starts[1:]))
+        return out
+
+    def evaluate(self, inputs):
+        return eval(self.code, {'__builtins__': {}}, dict(functions, **inputs))
@@ -1,5 +1,6 @@
 import numpy as np
 from functools import partial
+from pcolexpr import Expression
 
 
 axis_dict = {0: 'sw', 1: 'step'}
@@ -139,15 +140,14 @@ for side in sides:
     name_func_dict[name] = {'func': func, 'label': label}
 
 
-def conductance4(data, pdata, meta, side):
-    current = pdata[underscore('lockin_curr', side)]
-    bias = pdata[underscore('lockin_bias', side)]
-    column = current / bias / esquared_over_h
-    return column
-
+# Pseudocolumns which are arithmetic expressions of other columns can be
+# defined with Expression, which evaluates them without full-size temporary
+# arrays.
 for side in sides:
-    name = underscore(conductance4.__name__, side)
-    func = partial(conductance4, side=side)
+    name = underscore('conductance4', side)
+    expr = '{} / {} / esquared_over_h'.format(underscore('lockin_curr', side),
+                                              underscore('lockin_bias', side))
+    func = Expression(expr, globals())
     label = (side + ' 4T dI/dV from AC (e^2/h)').lstrip(' ')
     name_func_dict[name] = {'func': func, 'label': label}
 
@@ -221,16 +221,12 @@ for side in sides:
     name_func_dict[name] = {'func': func, 'label': label}
 
 
-def logcond(data, pdata, meta, full_col_name):
-    arr = pdata[full_col_name]
-    return np.log10(np.abs(arr))
-
 for side in sides:
     for col_name in ('conductance2', 'conductance4', 'dc_conductance',
                      'dc_current2'):
         full_col_name = underscore(col_name, side)
         name = 'log_' + full_col_name
-        func = partial(logcond, full_col_name=full_col_name)
+        func = Expression('log10(abs({}))'.format(full_col_name))
         if col_name == 'dc_current2':
             label = 'log10(I) (log10(A))'
         else:
@@ -238,16 +234,13 @@ for side in sides:
         name_func_dict[name] = {'func': func, 'label': label}
 
 
-def rootcond(data, pdata, meta, full_col_name):
-    arr = pdata[full_col_name]
-    return np.sign(arr) * np.sqrt(np.abs(arr))
-
 for side in sides:
     for col_name in ('conductance2', 'conductance4', 'dc_conductance',
                      'dc_current2'):
         full_col_name = underscore(col_name, side)
         name = 'root_' + full_col_name
-        func = partial(rootcond, full_col_name=full_col_name)
+        expr = 'sign({0}) * sqrt(abs({0}))'.format(full_col_name)
+        func = Expression(expr)
         if col_name == 'dc_current2':
             label = 'sqrt(I) (sqrt(A))'
         else:
@@ -24,6 +24,7 @@ class PlotControls(QtWidgets.QWidget):
         self.init_plot_2D_type_sel()
         self.init_lim_boxes()
         self.init_aspect_box()
+        self.init_decimate_box()
         self.setLayout(self.layout)
 
     def reset_col_boxes(self, array_of_text_items):
@@ -106,6 +107,16 @@ class PlotControls(QtWidgets.QWidget):
         self.layout.addWidget(aspect_box)
         self.aspect_box = aspect_box
 
+    def init_decimate_box(self):
+        decimate_box = QtWidgets.QCheckBox('Decimate')
+        decimate_box.setChecked(True)
+        decimate_box.setToolTip('Plot long 1D traces with only the points '
+                                'visible at the resolution of the screen. '
+                                'Uncheck to plot every point, e.g., before '
+                                'saving the figure.')
+        self.layout.addWidget(decimate_box)
+        self.decimate_box = decimate_box
+
     def get_sel_cols(self):
         sel_texts = [box.currentText() for box in self.col_boxes]
         return sel_texts
@@ -124,6 +135,9 @@ class PlotControls(QtWidgets.QWidget):
         text = self.aspect_box.text()
         return self.parse_aspect(text)
 
+    def get_decimate(self):
+        return self.decimate_box.isChecked()
+
     def select_lowest_unoccupied(self, box):
         """
         Sets the text on box to the text with the lowest index in
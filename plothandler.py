@@ -1,4 +1,4 @@
-from numpy import nanmin, nanmax
+import numpy as np
 
 class PlotHandler(object):
     """
@@ -14,7 +14,12 @@ class PlotHandler(object):
 
     PlotHandler respects the imshow_eligible attribute from the DataHandler
     class. It will try to do the plot using the faster imshow. It falls back on
-    pcolormesh if the data is not imshow_eligible.
+    pcolormesh if the data is not imshow_eligible. Data which is not
+    imshow_eligible can also be resampled to a regular raster and plotted with
+    imshow (plot_type 'resampled'). Large data which is imshow_eligible can be
+    plotted at the resolution of the canvas (see plot_level). Similarly, long
+    1D traces can be decimated to the points which determine how they look on
+    the canvas (see Plot1DHandler).
 
     Parameters
     ----------
@@ -29,19 +34,73 @@ class PlotHandler(object):
     def __init__(self, ax, data_handler):
         self.ax = ax
         self.data_handler = data_handler
+        # Describes how the plot differs from the data, or is ''.
+        self.view_note = ''
+
+    def get_pixel_shape(self):
+        bbox = self.ax.get_window_extent()
+        return (max(1, int(bbox.height)), max(1, int(bbox.width)))
 
 
 class Plot1DHandler(PlotHandler):
-    def __init__(self, ax, data_handler):
+    """
+    If decimate is True, lines with more than decimation_min_points points
+    and sorted x are reduced to the points which determine how they look at
+    the width of the axes in pixels (see DataHandler.get_decimated), which
+    keeps spikes. Use update_decimated after changing the x limits. With
+    decimate False, e.g., for export, every point is plotted.
+    """
+    def __init__(self, ax, data_handler, decimate=False):
         super().__init__(ax, data_handler)
+        self.decimate = decimate
+        self.decimation_min_points = 10**5
+        # (xlim, n_bins) of the decimated lines.
+        self.decimated_view = None
 
     def plot(self, **kwargs):
         return self.plot_1D(**kwargs)
 
-    def plot_1D(self, plot_type=None, **kwargs):
-        tdata = self.data_handler.tdata
+    def plot_1D(self, plot_type=None, xlim=None, **kwargs):
+        """
+        Returns the list of lines. If the lines are decimated, only the part
+        between xlim, by default the extent of the data, is plotted.
+        """
+        data_h = self.data_handler
         ax = self.ax
-        ax.plot(tdata[0], tdata[1], **kwargs)
+        if self.is_decimated():
+            if xlim is None:
+                xlim = data_h.get_extent_of_data_dim(0)
+            x, y = self.get_decimated(xlim)
+        else:
+            x, y = data_h.get_plot_data(0), data_h.get_plot_data(1)
+        return ax.plot(x, y, **kwargs)
+
+    def is_decimated(self):
+        data_h = self.data_handler
+        return (self.decimate and data_h.data_dim == 1 and
+                data_h.data_is_valid and
+                data_h.tdata[0].size > self.decimation_min_points and
+                data_h.get_x_order() != 0)
+
+    def get_decimated(self, xlim):
+        n_bins = self.get_pixel_shape()[1]
+        self.decimated_view = (tuple(xlim), n_bins)
+        x, y = self.data_handler.get_decimated(xlim, n_bins)
+        self.view_note = '{} of {} points'.format(
+            len(x), self.data_handler.tdata[0].size)
+        return x, y
+
+    def update_decimated(self, lines, xlim):
+        """
+        Replaces the points of lines, made by plot_1D, with the ones
+        determining how the part between xlim looks. Returns True if the
+        points were changed.
+        """
+        n_bins = self.get_pixel_shape()[1]
+        if self.decimated_view == (tuple(xlim), n_bins):
+            return False
+        lines[0].set_data(*self.get_decimated(xlim))
+        return True
 
 
 class Plot2DHandler(PlotHandler):
@@ -49,13 +108,14 @@ class Plot2DHandler(PlotHandler):
         super().__init__(ax, data_handler)
         self.set_plot_type(plot_type)
         self.def_cmap_str = 'viridis'
+        self.level_statistic = 'mean'
 
     def set_plot_type(self, plot_type):
-        assert plot_type in (None, 'imshow', 'pcolormesh')
+        assert plot_type in (None, 'imshow', 'pcolormesh', 'resampled')
         if not self.data_handler.data_is_valid:
             plot_type = None
         elif plot_type is not None:
-            assert plot_type in ('imshow', 'pcolormesh')
+            assert plot_type in ('imshow', 'pcolormesh', 'resampled')
         elif self.data_handler.imshow_eligible:
             plot_type = 'imshow'
         else:
@@ -76,13 +136,23 @@ class Plot2DHandler(PlotHandler):
             return self.plot_imshow(**kwargs)
         elif plot_type == 'pcolormesh':
             return self.plot_pcolormesh(**kwargs)
+        elif plot_type == 'resampled':
+            return self.plot_resampled(**kwargs)
 
-    def plot_imshow(self, cmap=None, **kwargs):
+    def plot_imshow(self, cmap=None, z=None, extent=None, **kwargs):
+        """
+        Plots z with imshow. By default z and the extent are taken from the
+        DataHandler, which must be imshow_eligible.
+        """
         if cmap is None:
             cmap = self.def_cmap_str
         ax = self.ax
-        x, y, z = self.data_handler.tdata
-        extent = [x[0,0], x[-1,-1], y[0,0], y[-1,-1]]
+        if z is None:
+            x, y, _ = self.data_handler.tdata
+            # z is a view of the data, which Matplotlib copies when it is
+            # drawn.
+            z = self.data_handler.get_plot_data(2)
+            extent = [x[0,0], x[-1,-1], y[0,0], y[-1,-1]]
         imshow_kwargs = {
             'origin': 'lower',
             'interpolation': 'none',
@@ -94,11 +164,80 @@ class Plot2DHandler(PlotHandler):
         image = ax.imshow(z, **imshow_kwargs)
         return image
 
+    def plot_resampled(self, xlim=None, ylim=None, shape=None, **kwargs):
+        """
+        Resamples the data to a regular raster of shape (rows, cols) covering
+        xlim and ylim (see DataHandler.get_resampled) and plots it with
+        plot_imshow. By default the raster covers the data and has the size
+        of the axes in pixels. Returns the image.
+        """
+        data_h = self.data_handler
+        if xlim is None:
+            xlim = data_h.get_extent_of_data_dim(0)
+        if ylim is None:
+            ylim = data_h.get_extent_of_data_dim(1)
+        if shape is None:
+            shape = self.get_pixel_shape()
+        z, extent = data_h.get_resampled(xlim, ylim, shape)
+        self.view_note = 'resampled to {1}x{0}'.format(*z.shape)
+        return self.plot_imshow(z=z, extent=extent, **kwargs)
+
+    def update_resampled(self, image, xlim, ylim, shape=None):
+        """
+        Replaces the raster of image, made by plot_resampled, with one
+        covering xlim and ylim. Returns True if the raster was changed.
+        """
+        if shape is None:
+            shape = self.get_pixel_shape()
+        z, extent = self.data_handler.get_resampled(xlim, ylim, shape)
+        self.view_note = 'resampled to {1}x{0}'.format(*z.shape)
+        return self.update_image(image, z, extent)
+
+    def plot_level(self, xlim, ylim, shape=None, **kwargs):
+        """
+        Plots the level of the ImagePyramid of the DataHandler which matches
+        xlim, ylim and the size of the axes in pixels with plot_imshow (see
+        DataHandler.start_pyramid). Returns the image.
+        """
+        z, extent = self.get_level(xlim, ylim, shape)
+        return self.plot_imshow(z=z, extent=extent, **kwargs)
+
+    def update_level(self, image, xlim, ylim, shape=None):
+        """
+        Replaces the values of image, made by plot_level, with the level
+        matching xlim and ylim. Returns True if the values were changed.
+        """
+        z, extent = self.get_level(xlim, ylim, shape)
+        return self.update_image(image, z, extent)
+
+    def get_level(self, xlim, ylim, shape):
+        if shape is None:
+            shape = self.get_pixel_shape()
+        z, extent, factor = self.data_handler.get_level(
+            xlim, ylim, shape, self.level_statistic)
+        if factor > 1:
+            self.view_note = '{} of {}x{} points'.format(
+                self.level_statistic, factor, factor)
+        else:
+            self.view_note = ''
+        return z, extent
+
+    @staticmethod
+    def update_image(image, z, extent):
+        if np.array_equal(image.get_extent(), extent) and \
+                image.get_array().shape == z.shape:
+            return False
+        image.set_data(z)
+        image.set_extent(extent)
+        return True
+
     def plot_pcolormesh(self, cmap=None, **kwargs):
         if cmap is None:
             cmap = self.def_cmap_str
         ax = self.ax
-        x, y, z = self.data_handler.tdata
+        # pcolormesh does not accept masked coordinates.
+        x, y, _ = self.data_handler.tdata
+        z = self.data_handler.get_plot_data(2)
         plot_obj = ax.pcolormesh(x, y, z, cmap=cmap, **kwargs)
         return plot_obj
 
@@ -1,21 +1,585 @@
+import time
+import types
+import traceback
+import hashlib
+import inspect
+import linecache
+import threading
+from functools import partial
+from concurrent.futures import Future
+import executors
+
+
 class PseudoData(dict):
-    def __init__(self, name_func_dict, sweep):
+    """
+    Calculates and stores pseudocolumns on demand.
+
+    While a pseudocolumn is calculated the keys of data and pdata read by its
+    function are recorded, which gives the dependency graph of the calculated
+    pseudocolumns (see get_graph). When the functions are replaced with
+    update_functions only the pseudocolumns whose function has changed, and
+    the pseudocolumns depending on them, are removed.
+
+    If a PcolCache is given, pseudocolumns are read from it when they are
+    valid, and pseudocolumns which are slow to calculate are written to it.
+    Only functions with a fingerprint (see add_fingerprints) are cached.
+
+    Pseudocolumns may be requested from several threads, and compute
+    calculates several pseudocolumns concurrently. Each pseudocolumn is
+    calculated by one thread, and other threads requesting it wait for that
+    thread, while pseudocolumns which do not depend on it are calculated
+    meanwhile.
+
+    If max_bytes is given, pseudocolumns are evicted from memory when their
+    total size exceeds it (see evict). Evicted pseudocolumns keep their
+    dependencies and statistics and are calculated again, or read from the
+    cache, when they are requested. Pseudocolumns shown in an MplLayout are
+    pinned with pin and never evicted.
+
+    Parameters
+    ----------
+    name_func_dict : dictionary
+        Maps the name of a pseudocolumn to a dictionary with the keys func and
+        label. See add_fingerprints for the key fingerprint.
+    sweep : Sweep instance
+        Sweep whose data and meta are passed to the functions.
+    cache : PcolCache instance or None
+        On-disk cache for the pseudocolumns of sweep.
+    max_bytes : integer or None
+        Memory budget in bytes for the pseudocolumns. If None pseudocolumns
+        are never evicted.
+
+    Attributes
+    ----------
+    deps : dictionary
+        Maps the name of every calculated pseudocolumn to a dictionary with
+        the sets data and pdata of the keys read by its function.
+    times : dictionary
+        Maps the name of every calculated pseudocolumn to a tuple (self_time,
+        total_time) in seconds, where self_time excludes the time spent
+        calculating the pseudocolumns it depends on. For pseudocolumns read
+        from the cache it is the time it took to read them.
+    from_cache : dictionary
+        Maps the names of the pseudocolumns which were read from the cache to
+        the sets of pseudocolumns they depend on directly or indirectly, since
+        the pseudocolumns in between may not have been calculated.
+    errors : dictionary
+        Maps the names of the pseudocolumns whose calculation failed to the
+        traceback of the exception. A failed pseudocolumn is calculated again
+        the next time it is requested.
+    hits : dictionary
+        Maps the names of the pseudocolumns to the number of times they were
+        requested after they had been calculated.
+    pinned : dictionary
+        Maps an owner, e.g., an MplLayout, to the set of pseudocolumns it has
+        pinned.
+    evictions : dictionary
+        Maps the names of the evicted pseudocolumns to the number of times
+        they were evicted. See also get_memory_stats.
+    """
+    def __init__(self, name_func_dict, sweep, cache=None, max_bytes=None):
         super(PseudoData, self).__init__()
         self.name_func_dict = name_func_dict
         self.sweep = sweep
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.deps = {}
+        self.times = {}
+        self.from_cache = {}
+        self.errors = {}
+        self.hits = {}
+        self.pinned = {}
+        self.evictions = {}
+        self.evicted_bytes = 0
+        # Guards the dictionaries above and the bookkeeping below.
+        self.lock = threading.RLock()
+        # Maps the keys being calculated to a Future with the result and the
+        # thread calculating them.
+        self.futures = {}
+        self.owners = {}
+        # Maps threads waiting for another thread to the key they wait for.
+        self.waiting = {}
+        # Incremented by update_functions so calculations started before are
+        # not stored.
+        self.generation = 0
+        self.local = threading.local()
 
     def __getitem__(self, key):
-        if key in self.keys():
-            return dict.__getitem__(self, key)
-        elif key in self.name_func_dict:
-            func = self.name_func_dict[key]['func']
-            pcol = func(self.sweep.data, self.sweep.pdata, self.sweep.meta)
-            self.__setitem__(key, pcol)
-            return pcol
+        eval_stack = self.get_eval_stack()
+        if eval_stack and (key in self or self.has_func(key)):
+            eval_stack[-1]['pdata'].add(key)
+        thread_id = threading.get_ident()
+        with self.lock:
+            if key in self.keys():
+                self.hits[key] = self.hits.get(key, 0) + 1
+                return dict.__getitem__(self, key)
+            elif not self.has_func(key):
+                return dict.__getitem__(self, key)
+            future = self.futures.get(key)
+            is_owner = future is None
+            if is_owner:
+                future = Future()
+                self.futures[key] = future
+                self.owners[key] = thread_id
+                generation = self.generation
+            else:
+                self.check_wait(key)
+                self.waiting[thread_id] = key
+        if not is_owner:
+            # Another thread is calculating key. Wait for its result rather
+            # than calculating it twice.
+            try:
+                return future.result()
+            finally:
+                with self.lock:
+                    self.waiting.pop(thread_id, None)
+        try:
+            pcol = self.evaluate(key, generation)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
         else:
-            return dict.__getitem__(self, key)
+            future.set_result(pcol)
+            return pcol
+        finally:
+            with self.lock:
+                del self.futures[key]
+                del self.owners[key]
+
+    def get_eval_stack(self):
+        """
+        Returns the stack of pseudocolumns being calculated by the current
+        thread.
+        """
+        eval_stack = getattr(self.local, 'eval_stack', None)
+        if eval_stack is None:
+            eval_stack = self.local.eval_stack = []
+        return eval_stack
+
+    def check_wait(self, key):
+        """
+        Raises ValueError if waiting for the thread calculating key would
+        deadlock since that thread is, directly or through other threads,
+        waiting for the current thread. Must be called with lock held.
+        """
+        thread_id = threading.get_ident()
+        owner = self.owners[key]
+        while owner is not None:
+            if owner == thread_id:
+                keys_in_progress = [f['key'] for f in self.get_eval_stack()]
+                if key in keys_in_progress:
+                    i = keys_in_progress.index(key)
+                    cycle = keys_in_progress[i:] + [key]
+                else:
+                    cycle = [key, '...', key]
+                raise ValueError('Circular dependency between pseudocolumns: '
+                                 '{}'.format(' -> '.join(cycle)))
+            waited_key = self.waiting.get(owner)
+            owner = self.owners.get(waited_key)
+
+    def compute(self, keys):
+        """
+        Calculates the pseudocolumns keys which are not already calculated
+        concurrently on the shared compute executor (see executors) and waits
+        for them.
+        Since NumPy releases the GIL, independent pseudocolumns, e.g., the
+        chains for each side in pcols.py, are calculated on several cores.
+        Dependencies shared by several keys are calculated once. Returns a
+        dictionary mapping the keys whose calculation failed to the exception.
+        """
+        futures = {}
+        for key in keys:
+            if key not in futures and self.has_func(key) and key not in self:
+                futures[key] = executors.get_executor().submit(
+                    self.__getitem__, key)
+        errors = {}
+        for key, future in futures.items():
+            try:
+                future.result()
+            except Exception as error:
+                errors[key] = error
+        return errors
+
+    def evaluate(self, key, generation=None):
+        """
+        Calculates the pseudocolumn key, or reads it from the cache, and
+        records its dependencies and the time it took. If the calculation
+        fails the traceback is recorded in errors before the exception is
+        raised. Should only be called through __getitem__, which ensures that
+        key is calculated by one thread at a time.
+        """
+        if generation is None:
+            generation = self.generation
+        if self.cache is not None:
+            pcol = self.read_cached(key, generation)
+            if pcol is not None:
+                return pcol
+        func = self.name_func_dict[key]['func']
+        eval_stack = self.get_eval_stack()
+        frame = {'key': key, 'data': set(), 'pdata': set(), 'child_time': 0}
+        data = RecordingData(self.sweep.data, frame['data'])
+        eval_stack.append(frame)
+        t_start = time.perf_counter()
+        try:
+            pcol = func(data, self, self.sweep.meta)
+        except Exception:
+            with self.lock:
+                if generation == self.generation:
+                    self.errors[key] = traceback.format_exc()
+            raise
+        finally:
+            eval_stack.pop()
+            total_time = time.perf_counter() - t_start
+            if eval_stack:
+                eval_stack[-1]['child_time'] += total_time
+            with self.lock:
+                if generation == self.generation:
+                    self.deps[key] = {'data': frame['data'],
+                                      'pdata': frame['pdata']}
+                    self.times[key] = (total_time - frame['child_time'],
+                                       total_time)
+        with self.lock:
+            if generation != self.generation:
+                # The functions were replaced during the calculation.
+                return pcol
+            self.errors.pop(key, None)
+            self.__setitem__(key, pcol)
+            self.evict(keep=[key])
+        if self.cache is not None and total_time >= self.cache.min_time:
+            self.write_cached(key, pcol)
+        return pcol
+
+    def read_cached(self, key, generation):
+        t_start = time.perf_counter()
+        cached = self.cache.read(key, self.sweep.signature,
+                                 self.get_fingerprints())
+        if cached is None:
+            return None
+        pcol, deps, all_deps = cached
+        load_time = time.perf_counter() - t_start
+        eval_stack = self.get_eval_stack()
+        if eval_stack:
+            eval_stack[-1]['child_time'] += load_time
+        with self.lock:
+            if generation != self.generation:
+                return pcol
+            self.deps[key] = {'data': set(deps['data']),
+                              'pdata': set(deps['pdata'])}
+            self.times[key] = (load_time, load_time)
+            self.from_cache[key] = set(all_deps)
+            self.__setitem__(key, pcol)
+            self.evict(keep=[key])
+        return pcol
+
+    def write_cached(self, key, pcol):
+        fingerprints = self.get_fingerprints()
+        dep_fingerprints = {}
+        for dep in self.get_dependencies(key):
+            if dep not in fingerprints:
+                # Pseudocolumns without a fingerprint cannot be validated.
+                return
+            dep_fingerprints[dep] = fingerprints[dep]
+        if key not in fingerprints:
+            return
+        self.cache.write(key, pcol, self.sweep.signature, fingerprints[key],
+                         self.deps[key], dep_fingerprints)
+
+    def get_fingerprints(self):
+        return {key: entry['fingerprint']
+                for key, entry in self.name_func_dict.items()
+                if 'fingerprint' in entry}
+
+    def has_func(self, key):
+        return 'func' in self.name_func_dict.get(key, {})
 
     def get_names(self):
         names = [k for k, v in self.name_func_dict.items() if 'func' in v]
         names.sort()
         return names
+
+    def get_nbytes(self):
+        return sum(getattr(v, 'nbytes', 0) for v in list(self.values()))
+
+    def pin(self, owner, keys):
+        """
+        Replaces the pseudocolumns pinned by owner with keys, such that they
+        are not evicted. Pass an empty list to unpin them.
+        """
+        with self.lock:
+            if keys:
+                self.pinned[owner] = set(keys)
+            else:
+                self.pinned.pop(owner, None)
+            self.evict()
+
+    def evict(self, keep=()):
+        """
+        Evicts pseudocolumns until their total size is within max_bytes and
+        returns their names. The pseudocolumns which are cheapest to
+        calculate again per byte freed are evicted first, where the cost is
+        the total time it took to calculate or read it (see times). Pinned
+        pseudocolumns and the pseudocolumns in keep are never evicted, so the
+        total size may still exceed max_bytes.
+        """
+        if self.max_bytes is None:
+            return []
+        with self.lock:
+            nbytes = self.get_nbytes()
+            if nbytes <= self.max_bytes:
+                return []
+            protected = set(keep).union(*self.pinned.values())
+            candidates = []
+            for key, value in self.items():
+                if key in protected:
+                    continue
+                size = getattr(value, 'nbytes', 0)
+                total_time = self.times.get(key, (0, 0))[1]
+                candidates.append((total_time / max(size, 1), key, size))
+            candidates.sort()
+            evicted = []
+            for _, key, size in candidates:
+                if nbytes <= self.max_bytes:
+                    break
+                dict.__delitem__(self, key)
+                nbytes -= size
+                self.evicted_bytes += size
+                self.evictions[key] = self.evictions.get(key, 0) + 1
+                evicted.append(key)
+            return evicted
+
+    def get_memory_stats(self):
+        """
+        Returns a dictionary with the resident size of the pseudocolumns
+        (nbytes), max_bytes, the number of resident and pinned pseudocolumns,
+        and the number of evictions and bytes evicted so far.
+        """
+        with self.lock:
+            pinned = set().union(*self.pinned.values())
+            stats = {
+                'nbytes': self.get_nbytes(),
+                'max_bytes': self.max_bytes,
+                'n_resident': len(self),
+                'n_pinned': len(pinned & set(self.keys())),
+                'evictions': sum(self.evictions.values()),
+                'evicted_bytes': self.evicted_bytes,
+            }
+        return stats
+
+    def get_graph(self):
+        """
+        Returns a dictionary mapping the name of every calculated or failed
+        pseudocolumn to a dictionary with the sorted lists data and pdata of
+        its direct dependencies, its self_time and total_time in seconds, its
+        size in bytes (nbytes, 0 if it has been evicted), the number of hits
+        and evictions, whether it was read from the cache (from_cache) and
+        the traceback if it failed (error).
+        """
+        graph = {}
+        with self.lock:
+            items = [(key, deps, self.times[key], dict.get(self, key))
+                     for key, deps in self.deps.items()]
+        for key, deps, (self_time, total_time), value in items:
+            graph[key] = {
+                'data': sorted(deps['data']),
+                'pdata': sorted(deps['pdata']),
+                'self_time': self_time,
+                'total_time': total_time,
+                'nbytes': getattr(value, 'nbytes', 0),
+                'hits': self.hits.get(key, 0),
+                'evictions': self.evictions.get(key, 0),
+                'from_cache': key in self.from_cache,
+                'error': self.errors.get(key),
+            }
+        return graph
+
+    def format_graph(self, key, indent=0):
+        """
+        Returns the dependency tree of the pseudocolumn key as text with the
+        time spent in each pseudocolumn, e.g., for finding out why it is
+        slow.
+        """
+        if key not in self.deps:
+            return '{}{} (not calculated)'.format(' ' * indent, key)
+        self_time, total_time = self.times[key]
+        line = '{}{}: {:.3g} s total, {:.3g} s self, data: {}'.format(
+            ' ' * indent, key, total_time, self_time,
+            ', '.join(sorted(self.deps[key]['data'])) or '-')
+        if key in self.from_cache:
+            line += ' (from cache)'
+        if key in self.errors:
+            line += ' (failed)'
+        lines = [line]
+        for dep in sorted(self.deps[key]['pdata']):
+            lines.append(self.format_graph(dep, indent + 4))
+        return '\n'.join(lines)
+
+    def get_dependencies(self, key):
+        """
+        Returns the set of pseudocolumns which the pseudocolumn key depends on
+        directly or indirectly.
+        """
+        dependencies = set()
+        todo = [key]
+        while todo:
+            deps = self.deps.get(todo.pop(), {'pdata': ()})
+            for dep in deps['pdata']:
+                if dep not in dependencies:
+                    dependencies.add(dep)
+                    todo.append(dep)
+        return dependencies
+
+    def get_dependents(self, keys):
+        """
+        Returns the set of calculated pseudocolumns which depend directly or
+        indirectly on any of the pseudocolumns in keys.
+        """
+        dependents = set()
+        todo = list(keys)
+        while todo:
+            key = todo.pop()
+            for name, deps in self.deps.items():
+                if name in dependents:
+                    continue
+                indirect_deps = self.from_cache.get(name, ())
+                if key in deps['pdata'] or key in indirect_deps:
+                    dependents.add(name)
+                    todo.append(name)
+        return dependents
+
+    def update_functions(self, name_func_dict):
+        """
+        Replaces name_func_dict and removes the pseudocolumns whose function
+        has changed or been removed, together with their dependents. The
+        functions are compared by their fingerprints (see get_fingerprint).
+        Returns the set of removed pseudocolumns. Results of calculations in
+        progress in other threads are not stored.
+        """
+        with self.lock:
+            self.generation += 1
+            old_dict = self.name_func_dict
+            changed = set()
+            for key in set(self.keys()) | set(self.deps):
+                if self.get_entry_fingerprint(old_dict, key) != \
+                        self.get_entry_fingerprint(name_func_dict, key):
+                    changed.add(key)
+            invalid = changed | self.get_dependents(changed)
+            for key in invalid:
+                self.pop(key, None)
+                self.deps.pop(key, None)
+                self.times.pop(key, None)
+                self.from_cache.pop(key, None)
+                self.errors.pop(key, None)
+                self.hits.pop(key, None)
+                self.evictions.pop(key, None)
+            self.name_func_dict = name_func_dict
+        return invalid
+
+    @staticmethod
+    def get_entry_fingerprint(name_func_dict, key):
+        entry = name_func_dict.get(key, {})
+        if 'func' not in entry:
+            return None
+        if 'fingerprint' in entry:
+            return entry['fingerprint']
+        return get_fingerprint(entry['func'])
+
+
+class RecordingData(object):
+    """
+    Wraps the data of a sweep and records the names of the columns read
+    through it in the set names. All other attributes are taken from data.
+    """
+    def __init__(self, data, names):
+        self._data = data
+        self._names = names
+
+    def __getitem__(self, name):
+        self._names.add(name)
+        return self._data[name]
+
+    def __contains__(self, name):
+        return name in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __getattr__(self, attr):
+        return getattr(self._data, attr)
+
+
+def add_fingerprints(name_func_dict):
+    """
+    Stores the fingerprint of every function in name_func_dict under the key
+    fingerprint. Must be called right after the module defining the functions
+    has been loaded, since the fingerprint is based on the source file.
+    """
+    for entry in name_func_dict.values():
+        if 'func' in entry:
+            entry['fingerprint'] = get_fingerprint(entry['func'])
+
+
+def get_fingerprint(func):
+    """
+    Returns a hash of the source code of func, the arguments bound by
+    functools.partial, and the source code of the functions and the values of
+    the simple constants it refers to in its module, such that the
+    fingerprint changes when anything the result of func depends on changes in
+    the source file.
+    """
+    sha = hashlib.sha1()
+    update_fingerprint(sha, func, set())
+    return sha.hexdigest()
+
+
+simple_types = (int, float, complex, str, bytes, bool, type(None), tuple,
+                list, dict, set, frozenset)
+
+
+def update_fingerprint(sha, func, seen):
+    if isinstance(func, partial):
+        update_fingerprint(sha, func.func, seen)
+        keywords = sorted(func.keywords.items())
+        sha.update(repr((func.args, keywords)).encode('utf-8'))
+        return
+    code = getattr(func, '__code__', None)
+    if code is None:
+        sha.update(repr(func).encode('utf-8'))
+        return
+    if code in seen:
+        return
+    seen.add(code)
+    try:
+        # The module may have been reloaded since the source was cached.
+        linecache.checkcache(code.co_filename)
+        source = inspect.getsource(func)
+    except (OSError, TypeError):
+        source = None
+    if source is not None:
+        sha.update(source.encode('utf-8'))
+    else:
+        sha.update(code.co_code)
+        sha.update(repr(code.co_consts).encode('utf-8'))
+    module_globals = getattr(func, '__globals__', {})
+    for name in sorted(get_global_names(code)):
+        if name not in module_globals:
+            continue
+        value = module_globals[name]
+        if isinstance(value, types.FunctionType):
+            if value.__globals__ is module_globals:
+                update_fingerprint(sha, value, seen)
+        elif isinstance(value, partial):
+            update_fingerprint(sha, value, seen)
+        elif isinstance(value, simple_types):
+            sha.update('{}={!r}'.format(name, value).encode('utf-8'))
+
+
+def get_global_names(code):
+    """
+    Returns the names used in code and in the functions, lambdas and
+    comprehensions nested in it.
+    """
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names.update(get_global_names(const))
+    return names
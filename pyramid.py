@@ -0,0 +1,155 @@
+import math
+import numpy as np
+
+
+class ImagePyramid(object):
+    """
+    Multi-resolution version of a regular 2D image, such that only about as
+    many values as the canvas has pixels need to be drawn, whatever the size
+    of the image.
+
+    Level 0 is the image itself. Every following level halves the number of
+    rows and columns of the previous one by taking the minimum, mean and
+    maximum of blocks of 2x2 values, ignoring NaN. Blocks with only NaN are
+    NaN. The levels are made by build, which is meant to run in the
+    background (see DataHandler.start_pyramid), and get_level uses the levels
+    made so far.
+
+    Parameters
+    ----------
+    z : numpy array
+        Two-dimensional image with values for evenly spaced x along axis 1
+        and evenly spaced y along axis 0. It is not copied.
+    extent : list
+        [left, right, bottom, top] as given to imshow with origin 'lower'.
+    min_size : integer
+        Levels are added until both dimensions are at most min_size.
+
+    Attributes
+    ----------
+    levels : list
+        Contains a dictionary with the keys min, mean, max and factor for
+        every level. factor is the number of rows and columns of z
+        represented by a value of the level.
+    """
+    statistics = ('min', 'mean', 'max')
+
+    def __init__(self, z, extent, min_size=256):
+        self.z = z
+        self.extent = [float(lim) for lim in extent]
+        self.min_size = min_size
+        self.levels = [{'min': z, 'mean': z, 'max': z, 'factor': 1}]
+        self.cancelled = False
+
+    def build(self):
+        """
+        Adds the levels one by one, from the finest to the coarsest.
+        """
+        level = self.levels[0]
+        z = np.ma.filled(np.ma.asarray(level['mean'], dtype=float), np.nan)
+        # The number of finite values of each block is at most factor**2, so
+        # the counts take a byte per value at first.
+        counts = np.isfinite(z).view(np.uint8)
+        stats = {'min': z, 'mean': z, 'max': z}
+        while max(stats['mean'].shape) > self.min_size:
+            if self.cancelled:
+                return
+            factor = self.levels[-1]['factor']
+            stats, counts = decimate(stats, counts, factor**2)
+            level = dict(stats, factor=factor * 2)
+            self.levels.append(level)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def get_pixel_size(self):
+        """
+        Returns the width and height in plot coordinates of a value in z.
+        """
+        left, right, bottom, top = self.extent
+        rows, cols = np.shape(self.z)
+        return (right - left) / cols, (top - bottom) / rows
+
+    def get_level_index(self, xlim, ylim, shape):
+        """
+        Returns the index of the coarsest level made so far which still has
+        at least one value per pixel of a canvas of shape (rows, cols)
+        showing xlim and ylim.
+        """
+        width, height = self.get_pixel_size()
+        rows, cols = shape
+        per_pixel = min(abs(xlim[1] - xlim[0]) / abs(width) / max(cols, 1),
+                        abs(ylim[1] - ylim[0]) / abs(height) / max(rows, 1))
+        if not per_pixel >= 2:
+            return 0
+        index = int(math.floor(math.log2(per_pixel)))
+        return min(index, len(self.levels) - 1)
+
+    def get_level(self, xlim, ylim, shape, statistic='mean'):
+        """
+        Returns the part of the level chosen by get_level_index which covers
+        xlim and ylim with a margin of half a view on each side, so panning
+        shows data until the level is updated, together with its extent and
+        factor. The part is a view of the level.
+        """
+        assert statistic in self.statistics
+        level = self.levels[self.get_level_index(xlim, ylim, shape)]
+        arr = level[statistic]
+        factor = level['factor']
+        width, height = self.get_pixel_size()
+        left, _, bottom, _ = self.extent
+        col_slice, x_ends = get_crop(xlim, left, width * factor, arr.shape[1])
+        row_slice, y_ends = get_crop(ylim, bottom, height * factor,
+                                     arr.shape[0])
+        extent = [x_ends[0], x_ends[1], y_ends[0], y_ends[1]]
+        return arr[row_slice, col_slice], extent, factor
+
+
+def get_crop(lim, start, step, n):
+    """
+    Returns the slice of the n values, starting at start and step apart,
+    which covers lim with a margin of half its width on each side, and the
+    edges of the slice.
+    """
+    lo, hi = sorted(((lim[0] - start) / step, (lim[1] - start) / step))
+    margin = (hi - lo) / 2
+    i0 = int(np.clip(math.floor(lo - margin), 0, n))
+    i1 = int(np.clip(math.ceil(hi + margin), 0, n))
+    if i1 <= i0:
+        # The view is outside the data, but the image must not be empty.
+        i0, i1 = 0, n
+    return slice(i0, i1), (start + i0 * step, start + i1 * step)
+
+
+def decimate(stats, counts, max_count=1):
+    """
+    Halves the number of rows and columns of the arrays in stats, which are
+    the min, mean and max of blocks with counts finite values each, at most
+    max_count. The new counts have the smallest unsigned integer type which
+    holds 4*max_count.
+    """
+    blocks = {name: to_blocks(arr) for name, arr in stats.items()}
+    count_blocks = to_blocks(counts, fill=0)
+    new_counts = count_blocks.sum(axis=(1, 3),
+                                  dtype=np.min_scalar_type(4 * max_count))
+    # fmin and fmax ignore NaN.
+    new_stats = {
+        'min': np.fmin.reduce(np.fmin.reduce(blocks['min'], axis=3), axis=1),
+        'max': np.fmax.reduce(np.fmax.reduce(blocks['max'], axis=3), axis=1),
+    }
+    weighted = np.where(count_blocks > 0, blocks['mean'] * count_blocks, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        new_stats['mean'] = weighted.sum(axis=(1, 3)) / new_counts
+    return new_stats, new_counts
+
+
+def to_blocks(arr, fill=np.nan):
+    """
+    Pads arr to an even number of rows and columns and returns a view of
+    shape (rows/2, 2, cols/2, 2).
+    """
+    rows, cols = arr.shape
+    pad = ((0, rows % 2), (0, cols % 2))
+    if rows % 2 or cols % 2:
+        arr = np.pad(arr, pad, constant_values=fill)
+    return arr.reshape(arr.shape[0] // 2, 2, arr.shape[1] // 2, 2)
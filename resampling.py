@@ -0,0 +1,159 @@
+import numpy as np
+
+
+def resample_to_raster(x, y, z, xlim, ylim, shape, profiles=None):
+    """
+    Resamples z, given at the points (x, y) of a possibly non-uniform grid, to
+    a regular raster of shape (rows, cols) covering xlim and ylim, such that
+    it can be plotted with imshow with extent xlim + ylim and origin 'lower'.
+    Pixels without data are NaN.
+
+    If x and y each vary along one axis of the grid (apart from jitter
+    smaller than half a step), every pixel takes the value of the grid cell
+    containing its center, which looks like pcolormesh at the resolution of
+    the raster. Otherwise the points are binned and averaged per pixel,
+    where the raster is made coarser if there are fewer points than pixels.
+    profiles is the result of get_axis_profiles, which is calculated if it
+    is None, or False if it is known to be None. Returns the raster and the
+    extent.
+    """
+    z = np.ma.filled(np.ma.asarray(z, dtype=float), np.nan)
+    extent = [xlim[0], xlim[1], ylim[0], ylim[1]]
+    if profiles is None:
+        profiles = get_axis_profiles(x, y)
+    if profiles:
+        return resample_cells(z, profiles, xlim, ylim, shape), extent
+    return bin_points(x, y, z, xlim, ylim, shape), extent
+
+
+def get_pixel_centers(lim, n):
+    return lim[0] + (np.arange(n) + 0.5) * (lim[1] - lim[0]) / n
+
+
+def get_axis_profiles(x, y):
+    """
+    Returns (axis_x, x_profile, axis_y, y_profile) if x varies along axis_x
+    and y along the other axis with monotonic profiles, or None. The profiles
+    are the means along the other axis.
+    """
+    if x.ndim != 2 or x.shape != y.shape:
+        return None
+    for axis_x in (0, 1):
+        axis_y = 1 - axis_x
+        x_profile = get_profile(x, axis_x)
+        y_profile = get_profile(y, axis_y)
+        if x_profile is not None and y_profile is not None:
+            return axis_x, x_profile, axis_y, y_profile
+    return None
+
+
+def get_profile(arr, axis):
+    """
+    Returns the mean of arr along the axis other than axis if the result is
+    strictly monotonic and arr deviates from it by less than half a step,
+    otherwise None.
+    """
+    with np.errstate(invalid='ignore'):
+        profile = np.nanmean(arr, axis=1 - axis)
+    if len(profile) < 2 or not np.isfinite(profile).all():
+        return None
+    steps = np.diff(profile)
+    if not ((steps > 0).all() or (steps < 0).all()):
+        return None
+    deviation = np.nanmax(np.abs(arr - np.expand_dims(profile, 1 - axis)))
+    if not deviation < np.min(np.abs(steps)) / 2:
+        return None
+    return profile
+
+
+def get_cell_indices(profile, centers):
+    """
+    Returns the index of the cell in profile containing each of centers, or
+    -1 for centers outside profile. Cell edges are halfway between points.
+    """
+    order = np.argsort(profile)
+    values = profile[order]
+    half_steps = np.diff(values) / 2
+    edges = np.concatenate([[values[0] - half_steps[0]],
+                            values[:-1] + half_steps,
+                            [values[-1] + half_steps[-1]]])
+    idx = np.searchsorted(edges, centers) - 1
+    outside = (idx < 0) | (idx >= len(values))
+    idx = order[np.clip(idx, 0, len(values) - 1)]
+    idx[outside] = -1
+    return idx
+
+
+def resample_cells(z, profiles, xlim, ylim, shape):
+    axis_x, x_profile, axis_y, y_profile = profiles
+    rows, cols = shape
+    ix = get_cell_indices(x_profile, get_pixel_centers(xlim, cols))
+    iy = get_cell_indices(y_profile, get_pixel_centers(ylim, rows))
+    if axis_x == 1:
+        raster = z[iy[:, np.newaxis], ix[np.newaxis, :]]
+    else:
+        raster = z[ix[np.newaxis, :], iy[:, np.newaxis]]
+    raster[iy < 0, :] = np.nan
+    raster[:, ix < 0] = np.nan
+    return raster
+
+
+def bin_points(x, y, z, xlim, ylim, shape):
+    x, y, z = np.ravel(x), np.ravel(y), np.ravel(z)
+    with np.errstate(invalid='ignore'):
+        cols_f = (x - xlim[0]) / (xlim[1] - xlim[0])
+        rows_f = (y - ylim[0]) / (ylim[1] - ylim[0])
+        in_view = ((cols_f >= 0) & (cols_f < 1) & (rows_f >= 0) &
+                   (rows_f < 1) & np.isfinite(z))
+    rows, cols = shape
+    n_in_view = np.count_nonzero(in_view)
+    # With fewer points than pixels most pixels would be empty, so the raster
+    # is made coarser with the same aspect ratio.
+    scale = min(1, np.sqrt(n_in_view / max(rows * cols, 1)))
+    rows, cols = max(1, int(rows * scale)), max(1, int(cols * scale))
+    pixel = ((rows_f[in_view] * rows).astype(int) * cols +
+             (cols_f[in_view] * cols).astype(int))
+    sums = np.bincount(pixel, weights=z[in_view], minlength=rows * cols)
+    counts = np.bincount(pixel, minlength=rows * cols)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        raster = sums / counts
+    return raster.reshape(rows, cols)
+
+
+def get_line_indices(x, y, xlim, n_bins):
+    """
+    Returns the indices of the points of a line with non-decreasing x which
+    determine how the part of it between xlim looks when drawn n_bins pixels
+    wide. These are the first, last, lowest and highest points in each pixel
+    (M4 aggregation), so spikes are kept exactly, and the nearest point
+    outside xlim on each side, so the line reaches the edges. If there are
+    only a few points per pixel, a slice of the points between xlim is
+    returned instead.
+    """
+    lo, hi = sorted(xlim)
+    i0 = max(np.searchsorted(x, lo, 'left') - 1, 0)
+    i1 = min(np.searchsorted(x, hi, 'right') + 1, len(x))
+    if i1 - i0 <= 4 * n_bins:
+        return slice(i0, i1)
+    x, y = x[i0:i1], np.ma.filled(np.ma.asarray(y[i0:i1], float), np.nan)
+    edges = np.linspace(lo, hi, n_bins + 1)
+    starts = np.searchsorted(x, edges[:-1], 'left')
+    ends = np.searchsorted(x, edges[1:], 'left')
+    ends[-1] = np.searchsorted(x, hi, 'right')
+    non_empty = ends > starts
+    starts, ends = starts[non_empty], ends[non_empty]
+    first = starts[0]
+    # Consecutive non-empty pixels are contiguous in the line.
+    y = y[first:ends[-1]]
+    bins = np.repeat(np.arange(len(starts)), ends - starts)
+    extremes = []
+    for reduce in (np.fmin.reduceat, np.fmax.reduceat):
+        values = reduce(y, starts - first)
+        # The first point in each pixel with the extreme value. Pixels with
+        # only NaN have none, but their first and last points are NaN and
+        # leave a gap in the line.
+        pos = np.flatnonzero(y == values[bins])
+        _, idx = np.unique(bins[pos], return_index=True)
+        extremes.append(pos[idx] + first)
+    idx = np.concatenate([[0, len(x) - 1], starts, ends - 1] + extremes)
+    return np.unique(idx) + i0
@@ -0,0 +1,162 @@
+import json
+from PyQt5 import QtCore, QtWidgets
+
+
+class StatsPanel(QtWidgets.QWidget):
+    """
+    Shows how the time was spent on the current sweep: loading it, calculating
+    each pseudocolumn, the DataHandler and drawing in each MplLayout.
+
+    The table has a row for every pseudocolumn calculated for the sweep,
+    including the ones only calculated as dependencies of others, with its
+    total and self time (see PseudoData.get_graph), size, number of hits and
+    evictions, whether it was read from the PcolCache, and the error if it
+    failed. The summary shows the resident size of the pseudocolumns and how
+    much has been evicted to stay within the memory budget. The
+    traceback of a failed pseudocolumn is shown as the tooltip of its error,
+    and the dependencies of a pseudocolumn are shown as the tooltip of its
+    name. The statistics can be exported as JSON with get_report.
+
+    Parameters
+    ----------
+    mpl_layouts : list of MplLayout instances
+        Layouts whose timings are shown.
+    parent : QtWidgets.QWidget instance
+        Parent of the panel.
+    """
+    headers = ('Pseudocolumn', 'Total (ms)', 'Self (ms)', 'Size (MB)', 'Hits',
+               'Evictions', 'Source', 'Error')
+
+    def __init__(self, mpl_layouts, parent=None):
+        super().__init__(parent)
+        self.mpl_layouts = mpl_layouts
+        self.sweep = None
+        self.summary_label = QtWidgets.QLabel()
+        self.summary_label.setTextInteractionFlags(
+            QtCore.Qt.TextSelectableByMouse)
+        self.table = QtWidgets.QTableWidget(0, len(self.headers))
+        self.table.setHorizontalHeaderLabels(self.headers)
+        self.table.setEditTriggers(QtWidgets.QAbstractItemView.NoEditTriggers)
+        self.table.verticalHeader().setVisible(False)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        refresh_button = QtWidgets.QPushButton('Refresh')
+        refresh_button.clicked.connect(self.refresh)
+        export_button = QtWidgets.QPushButton('Export JSON...')
+        export_button.clicked.connect(self.export_json)
+        button_layout = QtWidgets.QHBoxLayout()
+        button_layout.addWidget(self.summary_label, 1)
+        button_layout.addWidget(refresh_button)
+        button_layout.addWidget(export_button)
+        layout = QtWidgets.QVBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(button_layout)
+        layout.addWidget(self.table)
+        for mpl_layout in mpl_layouts:
+            mpl_layout.plot_updated.connect(self.refresh)
+
+    def set_sweep(self, sweep):
+        self.sweep = sweep
+        self.refresh()
+
+    def refresh(self):
+        if not self.isVisible():
+            # The statistics are collected anyway and shown when the panel is
+            # shown.
+            return
+        report = self.get_report()
+        self.summary_label.setText(self.get_summary(report))
+        self.table.setSortingEnabled(False)
+        self.table.setRowCount(len(report['pcols']))
+        for row, (name, stats) in enumerate(sorted(report['pcols'].items())):
+            deps = ', '.join(stats['data'] + stats['pdata']) or '-'
+            error = stats['error'] or ''
+            items = [
+                self.make_item(name, 'depends on: {}'.format(deps)),
+                self.make_item(1e3 * stats['total_time']),
+                self.make_item(1e3 * stats['self_time']),
+                self.make_item(stats['nbytes'] / 1024**2),
+                self.make_item(stats['hits']),
+                self.make_item(stats['evictions']),
+                self.make_item('cache' if stats['from_cache'] else 'calc.'),
+                self.make_item(error.strip().split('\n')[-1], error),
+            ]
+            for col, item in enumerate(items):
+                self.table.setItem(row, col, item)
+        self.table.setSortingEnabled(True)
+        self.table.sortItems(1, QtCore.Qt.DescendingOrder)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+
+    @staticmethod
+    def make_item(value, tooltip=None):
+        item = QtWidgets.QTableWidgetItem()
+        if isinstance(value, float):
+            # Numbers are stored as numbers so they are sorted numerically.
+            item.setData(QtCore.Qt.DisplayRole, round(value, 3))
+        else:
+            item.setData(QtCore.Qt.DisplayRole, value)
+        if tooltip:
+            item.setToolTip(tooltip)
+        return item
+
+    def get_report(self):
+        """
+        Returns a dictionary with the path and load time of the current sweep,
+        the timings and columns of each MplLayout, the statistics of each
+        pseudocolumn (see PseudoData.get_graph) and the memory used by the
+        pseudocolumns (see PseudoData.get_memory_stats).
+        """
+        report = {'sweep': None, 'load_time': None, 'layouts': [],
+                  'pcols': {}, 'memory': None}
+        for mpl_layout in self.mpl_layouts:
+            report['layouts'].append({
+                'columns': list(mpl_layout.sel_col_names),
+                'timings': dict(mpl_layout.timings),
+            })
+        if self.sweep is None:
+            return report
+        report['sweep'] = self.sweep.path
+        report['load_time'] = getattr(self.sweep, 'load_time', None)
+        if hasattr(self.sweep, 'pdata'):
+            report['pcols'] = self.sweep.pdata.get_graph()
+            report['memory'] = self.sweep.pdata.get_memory_stats()
+        return report
+
+    @staticmethod
+    def get_summary(report):
+        if report['sweep'] is None:
+            return 'No sweep selected.'
+        parts = []
+        if report['load_time'] is not None:
+            parts.append('load {:.0f} ms'.format(1e3 * report['load_time']))
+        for i, layout in enumerate(report['layouts']):
+            timings = ', '.join('{} {:.0f} ms'.format(name, 1e3 * t)
+                                for name, t in layout['timings'].items())
+            if timings:
+                parts.append('plot {}: {}'.format(i, timings))
+        memory = report.get('memory')
+        if memory is not None:
+            part = 'pcols {:.1f} MB'.format(memory['nbytes'] / 1024**2)
+            if memory['max_bytes'] is not None:
+                part += ' of {:.0f} MB'.format(memory['max_bytes'] / 1024**2)
+            if memory['evictions']:
+                part += ', {} evicted ({:.1f} MB)'.format(
+                    memory['evictions'], memory['evicted_bytes'] / 1024**2)
+            parts.append(part)
+        return '; '.join(parts)
+
+    def export_json(self, path=None):
+        """
+        Writes get_report to path as JSON. If path is None the user is asked
+        for a file name.
+        """
+        if not path:
+            path, _ = QtWidgets.QFileDialog.getSaveFileName(
+                self, 'Export statistics', 'pcol_stats.json',
+                'JSON files (*.json)')
+            if not path:
+                return
+        with open(path, 'w') as f:
+            json.dump(self.get_report(), f, indent=2)
@@ -1,7 +1,13 @@
 import numpy as np
 import json
 import os
+import time
 from pseudodata import PseudoData
+from columncache import ColumnCache
+from pcolcache import PcolCache
+from sweepgrid import SweepGrid
+from columnstore import ColumnStore
+from datparser import parse_dat_file, to_structured
 
 
 class Sweep(object):
@@ -13,21 +19,48 @@ class Sweep(object):
     path : str
         Full path to a directory containing at least a data.dat and a meta.json
         file.
+    use_cache : bool
+        If True data is loaded from a binary ColumnCache when it is up to date,
+        and the cache is (re)written after the text file has been parsed.
+        Pseudocolumns are cached in a PcolCache as well.
+    cache_dir : str or None
+        Directory for the ColumnCache and PcolCache. If None the caches are
+        stored next to the data in the sweep directory.
+    pdata_max_bytes : integer or None
+        Memory budget in bytes for the pseudocolumns of the sweep. See
+        PseudoData.
 
     Attributes
     ----------
-    data : numpy structured array
+    data : ColumnStore
         Contains the data from data.dat with names given by the columns key in
-        meta.json.
+        meta.json. The columns are indexed like a numpy structured array, i.e.,
+        data[name], but they are only loaded when they are indexed.
     meta : dictionary
         Contains meta.json as a dictionary.
+    signature : list
+        Size and modification time of data.dat and meta.json when the sweep was
+        loaded. See ColumnCache.get_signature.
+    load_time : float
+        Time in seconds it took to load the sweep.
+    grid : SweepGrid instance or None
+        Grid of the sweep for the last shape of data. See get_grid.
 
     Notes
     -----
     This class currently supports loading data with a dimension of 1 or 2.
     """
-    def __init__(self, path):
+    def __init__(self, path, use_cache=True, cache_dir=None,
+                 pdata_max_bytes=None):
+        t_start = time.perf_counter()
         self.path = path
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir
+        self.pdata_max_bytes = pdata_max_bytes
+        self.sweep_length = None
+        self.follow_buffer = None
+        self.dat_offset = None
+        self.grid = None
         self.load()
         self.dimension = self.get_dimension(self.meta)
         if self.dimension == 2:
@@ -35,25 +68,192 @@ class Sweep(object):
         elif self.dimension > 2:
             err_str = 'Data dimensions higher than 2 are not supported.'
             raise RuntimeError(err_str)
+        self.load_time = time.perf_counter() - t_start
 
     def load(self):
-        (self.data, self.meta) = self.load_dir(self.path)
+        # The signature is taken before loading so a sweep which is modified
+        # while it is loaded is considered stale.
+        self.signature = ColumnCache.get_signature(self.path)
+        (data, self.meta) = self.load_dir(
+            self.path, use_cache=self.use_cache, cache_dir=self.cache_dir)
+        if not isinstance(data, ColumnStore):
+            data = ColumnStore.from_array(data)
+        self.data = data
+        self.n_rows = len(data)
 
     def get2d(self):
         data_1D = self.data
-        c1, c2 = data_1D.dtype.names[:2]
-        reshaped_data = self.reshape2d(data_1D[c1], data_1D)
-        self.data = reshaped_data
+        c1 = data_1D.dtype.names[0]
+        column1 = data_1D.load_1d(c1)
+        sweep_length = self.get_sweep_length(column1)
+        number_of_sweeps = len(column1) // sweep_length
+        shape = (sweep_length, number_of_sweeps)
+        def transform(column):
+            return self.reshape2d(column1, column, sweep_length)
+        self.data = data_1D.reshaped(transform, shape)
+        self.sweep_length = sweep_length
+
+    def refresh(self):
+        """
+        Reads the lines appended to data.dat since the sweep was loaded or last
+        refreshed and updates data. Returns the number of new rows.
+
+        Only complete lines are read. The first call parses the whole file to
+        find the offset of the last complete line. Subsequent calls only parse
+        the new bytes and append them to a buffer which grows geometrically, so
+        the cost of a refresh scales with the amount of new data. For 2D data a
+        partially completed trace is padded with NaN instead of being dropped
+        as in get2d.
+        """
+        dat_path = os.path.join(self.path, 'data.dat')
+        n_cols = len(self.meta['columns'])
+        n_old_rows = self.n_rows
+        is_first_refresh = self.follow_buffer is None
+        if not is_first_refresh and os.path.getsize(dat_path) < self.dat_offset:
+            # data.dat has been truncated or rewritten. Start over.
+            is_first_refresh = True
+        if is_first_refresh:
+            self.follow_buffer = np.full((0, n_cols), np.nan)
+            self.n_rows = 0
+            self.dat_offset = 0
+            self.sweep_length = None
+        values, self.dat_offset = parse_dat_file(
+            dat_path, n_cols, offset=self.dat_offset, complete_lines_only=True)
+        self.append_rows(values)
+        n_new_rows = self.n_rows - n_old_rows
+        if n_new_rows == 0 and not is_first_refresh:
+            return 0
+        self.set_data_from_follow_buffer()
+        if hasattr(self, 'name_func_dict'):
+            self.set_pdata(self.name_func_dict)
+        return n_new_rows
+
+    def append_rows(self, values):
+        n_rows = self.n_rows + len(values)
+        self.reserve_follow_rows(n_rows)
+        self.follow_buffer[self.n_rows:n_rows] = values
+        self.n_rows = n_rows
+
+    def reserve_follow_rows(self, n_rows):
+        """
+        Makes sure that follow_buffer has room for n_rows rows. Unused rows are
+        filled with NaN.
+        """
+        capacity = len(self.follow_buffer)
+        if n_rows <= capacity:
+            return
+        new_capacity = max(n_rows, 2 * capacity, 1024)
+        n_cols = self.follow_buffer.shape[1]
+        new_buffer = np.full((new_capacity, n_cols), np.nan)
+        new_buffer[:self.n_rows] = self.follow_buffer[:self.n_rows]
+        self.follow_buffer = new_buffer
+
+    def set_data_from_follow_buffer(self):
+        names = [c['name'] for c in self.meta['columns']]
+        dtype = [(name, float) for name in names]
+        if self.dimension == 1:
+            data = to_structured(self.follow_buffer[:self.n_rows], dtype)
+            self.data = ColumnStore.from_array(data)
+            return
+        sweep_length = self.get_follow_sweep_length()
+        number_of_sweeps = -(-self.n_rows // sweep_length)
+        n_padded_rows = number_of_sweeps * sweep_length
+        self.reserve_follow_rows(n_padded_rows)
+        self.pad_partial_trace(n_padded_rows, sweep_length)
+        data = to_structured(self.follow_buffer[:n_padded_rows], dtype)
+        shape = (sweep_length, number_of_sweeps)
+        def transform(column):
+            return column.reshape(number_of_sweeps, sweep_length).transpose()
+        self.data = ColumnStore.from_array(data).reshaped(transform, shape)
+
+    def get_follow_sweep_length(self):
+        if self.sweep_length is not None:
+            return self.sweep_length
+        try:
+            self.sweep_length = self.get_sweep_length(
+                self.follow_buffer[:self.n_rows, 0])
+        except (RuntimeError, IndexError):
+            # We are still in the first trace so the trace length must be taken
+            # from the number of points of the innermost job which adds a
+            # dimension, whatever jobs are wrapped around it.
+            job = SweepGrid.get_jobs(self.meta['job'])[-1]
+            sweep_length = job.get('points', job.get('repeats'))
+            if sweep_length is None:
+                # Jobs like Forever have no length, so the rows so far are
+                # shown as a single trace until the first trace is complete.
+                sweep_length = max(self.n_rows, 1)
+            return sweep_length
+        return self.sweep_length
+
+    def pad_partial_trace(self, n_padded_rows, sweep_length):
+        """
+        Fills the rows of the partially completed trace which have not been
+        written yet. The first column (the stepped channel) is padded with its
+        current value and the second column (the swept channel) with the values
+        from the first trace so the grid remains regular. All other columns
+        are NaN.
+        """
+        buf = self.follow_buffer
+        start = self.n_rows
+        if start == n_padded_rows:
+            return
+        buf[start:n_padded_rows] = np.nan
+        if start == 0 or buf.shape[1] < 2:
+            return
+        buf[start:n_padded_rows, 0] = buf[start-1, 0]
+        first_trace_start = start % sweep_length
+        if start >= sweep_length:
+            buf[start:n_padded_rows, 1] = buf[first_trace_start:sweep_length, 1]
+
+    def get_nbytes(self):
+        """
+        Returns the number of bytes of data and pseudocolumns held in memory.
+        """
+        nbytes = self.data.get_nbytes()
+        if self.follow_buffer is not None:
+            nbytes = self.follow_buffer.nbytes
+        if hasattr(self, 'pdata'):
+            nbytes += self.pdata.get_nbytes()
+        return nbytes
 
     def set_pdata(self, name_func_dict=None):
         """
         Sets a dictionary which maps a name to a function and a label to use for
         calculating pseudocolumns.
+
+        If name_func_dict replaces another dictionary, e.g., because the
+        pseudocolumn file has been reloaded, only the pseudocolumns whose
+        function has changed and their dependents are calculated again (see
+        PseudoData.update_functions), and their names are returned. Setting
+        the same dictionary again clears all pseudocolumns. If use_cache is
+        True, pseudocolumns are also cached on disk (see PcolCache).
         """
         if name_func_dict is None:
             return
-        self.pdata = PseudoData(name_func_dict, self)
+        old_dict = getattr(self, 'name_func_dict', None)
         self.name_func_dict = name_func_dict
+        if old_dict is not None and old_dict is not name_func_dict:
+            return self.pdata.update_functions(name_func_dict)
+        cache = None
+        if self.use_cache and self.follow_buffer is None:
+            # A followed sweep has more rows than its signature describes.
+            cache = PcolCache(self.path, self.cache_dir)
+        self.pdata = PseudoData(name_func_dict, self, cache,
+                                self.pdata_max_bytes)
+
+    def get_grid(self):
+        """
+        Returns the SweepGrid describing which columns are swept linearly
+        along which axis. The grid is derived from meta.json and verified
+        against the recorded columns once for every shape of data, e.g., when
+        a followed sweep grows.
+        """
+        shape = tuple(int(n) for n in self.data.shape)
+        if self.grid is None or self.grid.shape != shape:
+            grid = SweepGrid(self.meta, shape)
+            grid.verify(self.data)
+            self.grid = grid
+        return self.grid
 
     def get_label(self, col_name):
         try:
@@ -72,17 +272,37 @@ class Sweep(object):
             raise ValueError('{} not found in data or pdata'.format(col_name))
 
     @classmethod
-    def load_dir(cls, path, meta_only=False, use_pandas=None):
+    def load_dir(cls, path, meta_only=False, use_pandas=None, use_cache=True,
+                 cache_dir=None):
+        """
+        Loads data and meta from the sweep directory path. If use_cache is True
+        the data is read from an up-to-date ColumnCache if possible. Otherwise
+        the data is parsed from data.dat and written to the cache.
+        """
         with open(os.path.join(path, 'meta.json')) as f:
             meta = json.load(f)
         if meta_only:
             return meta
         columns = meta['columns']
+        if use_cache:
+            cache = ColumnCache(path, cache_dir)
+            data = cache.read(columns)
+            if data is not None:
+                return (data, meta)
+            # The signature must be taken before parsing such that the cache is
+            # not written if data.dat changes while we read it.
+            signature = cache.get_signature(path)
+        data = cls.load_dat(path, columns, use_pandas)
+        if use_cache:
+            cache.write(data, signature)
+        return (data, meta)
+
+    @classmethod
+    def load_dat(cls, path, columns, use_pandas=None):
         dat_path = os.path.join(path, 'data.dat')
         if use_pandas is not False:
             try:
-                data = cls.load_dir_pandas(dat_path, columns)
-                return (data, meta)
+                return cls.load_dir_pandas(dat_path, columns)
             except ImportError as err:
                 # If the user has specifically requested to load data with
                 # pandas with use_pandas=True we show the ImportError.
@@ -90,39 +310,31 @@ class Sweep(object):
                 # pandas.
                 if use_pandas:
                     raise err
-        data = cls.load_dir_no_pandas(dat_path, columns)
-        return (data, meta)
+        return cls.load_dir_no_pandas(dat_path, columns)
 
     @staticmethod
     def load_dir_pandas(dat_path, columns):
         import pandas
         names = [c['name'] for c in columns]
         dtype = {c['name']: float for c in columns}
+        # float_precision='round_trip' gives correctly rounded floats such that
+        # the result is identical to load_dir_no_pandas.
         p_data = pandas.read_csv(dat_path, sep='\t', names=names, dtype=dtype,
-                                 header=None, index_col=False)
+                                 header=None, index_col=False,
+                                 float_precision='round_trip')
         data = p_data.to_records(index=False)
         return data
 
     @staticmethod
     def load_dir_no_pandas(dat_path, columns):
         dtype = [(c['name'], float) for c in columns]
-        with open(dat_path) as f:
-            def content():
-                for line in f:
-                    if line.strip():
-                        yield tuple(float(x) for x in line.split())
-            data = np.fromiter(content(), dtype=dtype)
-        return data
+        values, _ = parse_dat_file(dat_path, len(columns))
+        return to_structured(values, dtype)
 
     @staticmethod
-    def reshape2d(column1, column2):
-        different_from_first = (column1 != column1[0]).nonzero()[0]
-        if len(different_from_first) == 0:
-            raise RuntimeError('every value in column1 is identical')
-        else:
-            sweep_length = different_from_first[0]
-        if sweep_length == 1:
-            raise RuntimeError('the first two value in column 1 are unequal')
+    def reshape2d(column1, column2, sweep_length=None):
+        if sweep_length is None:
+            sweep_length = Sweep.get_sweep_length(column1)
         number_of_sweeps = len(column1) // sweep_length
         number_of_good_points = number_of_sweeps * sweep_length
         reshaped = np.reshape(
@@ -131,6 +343,17 @@ class Sweep(object):
         ).transpose()
         return reshaped
 
+    @staticmethod
+    def get_sweep_length(column1):
+        different_from_first = (column1 != column1[0]).nonzero()[0]
+        if len(different_from_first) == 0:
+            raise RuntimeError('every value in column1 is identical')
+        else:
+            sweep_length = different_from_first[0]
+        if sweep_length == 1:
+            raise RuntimeError('the first two value in column 1 are unequal')
+        return sweep_length
+
     @staticmethod
     def get_dimension(meta):
         dimension = 0
@@ -0,0 +1,99 @@
+import threading
+from collections import OrderedDict
+from columncache import ColumnCache
+
+
+class SweepCache(object):
+    """
+    In-memory least recently used cache of loaded Sweep instances.
+
+    Sweeps are keyed by their path and are only returned if the signature of
+    data.dat and meta.json is the same as when the sweep was loaded. Cached
+    sweeps keep their pdata, so pseudocolumns which have already been
+    calculated are not calculated again. When the total resident size of the
+    cached sweeps exceeds max_bytes the least recently used sweeps are evicted.
+    The cache is thread-safe.
+
+    Parameters
+    ----------
+    max_bytes : integer
+        Memory budget in bytes. The most recently used sweep is always kept
+        even if it alone exceeds the budget.
+
+    Attributes
+    ----------
+    hits, misses, evictions : integer
+        Counters for sizing the cache. See also get_stats.
+    """
+    def __init__(self, max_bytes=1024**3):
+        self.max_bytes = max_bytes
+        self.sweeps = OrderedDict()
+        self.lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, path):
+        """
+        Returns the cached sweep for path or None if it is not cached or if
+        data.dat or meta.json has changed since it was loaded.
+        """
+        with self.lock:
+            sweep = self.sweeps.get(path)
+            if sweep is None:
+                self.misses += 1
+                return None
+            if sweep.signature != ColumnCache.get_signature(path):
+                del self.sweeps[path]
+                self.misses += 1
+                return None
+            self.sweeps.move_to_end(path)
+            self.hits += 1
+            # Pseudocolumns may have been calculated since the last call.
+            self.evict()
+            return sweep
+
+    def put(self, sweep):
+        with self.lock:
+            self.sweeps[sweep.path] = sweep
+            self.sweeps.move_to_end(sweep.path)
+            self.evict()
+
+    def evict(self):
+        """
+        Evicts least recently used sweeps until the cache is within budget.
+        """
+        with self.lock:
+            while len(self.sweeps) > 1 and self.get_nbytes() > self.max_bytes:
+                self.sweeps.popitem(last=False)
+                self.evictions += 1
+
+    def remove(self, path):
+        with self.lock:
+            self.sweeps.pop(path, None)
+
+    def clear(self):
+        with self.lock:
+            self.sweeps.clear()
+
+    def __contains__(self, path):
+        return path in self.sweeps
+
+    def __len__(self):
+        return len(self.sweeps)
+
+    def get_nbytes(self):
+        with self.lock:
+            return sum(sweep.get_nbytes() for sweep in self.sweeps.values())
+
+    def get_stats(self):
+        with self.lock:
+            stats = {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'n_sweeps': len(self.sweeps),
+                'nbytes': self.get_nbytes(),
+                'max_bytes': self.max_bytes,
+            }
+        return stats
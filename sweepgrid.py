@@ -0,0 +1,120 @@
+import numpy as np
+
+
+class SweepGrid(object):
+    """
+    Describes the regular grid of a sweep as given by the job tree in
+    meta.json, i.e., which channels are swept linearly along which axis of the
+    data, such that DataHandler does not have to search the columns for it.
+
+    The outermost job varies along the last axis of the data and the innermost
+    job along the first axis (see Sweep.get2d). Sweep jobs describe the
+    channel chan, and Line jobs describe every channel in chans. Values are
+    expected at from + i*(to - from)/(points - 1), also if the sweep is
+    incomplete. The description is only used for channels which pass verify.
+
+    Parameters
+    ----------
+    meta : dictionary
+        Contents of meta.json.
+    shape : tuple of integers
+        Shape of the recorded columns.
+
+    Attributes
+    ----------
+    channels : dictionary
+        Maps the name of every linearly swept channel to a dictionary with the
+        keys axis, start and step.
+    """
+    job_types = ('Sweep', 'sweep', 'Repeat', 'Forever', 'Line', 'Timed')
+
+    def __init__(self, meta, shape):
+        self.shape = tuple(int(n) for n in shape)
+        self.channels = {}
+        jobs = self.get_jobs(meta.get('job', {}))
+        if len(jobs) != len(self.shape):
+            return
+        for dim, job in enumerate(jobs):
+            axis = len(self.shape) - 1 - dim
+            self.add_job(job, axis)
+
+    @classmethod
+    def get_jobs(cls, job):
+        """
+        Returns the jobs which add a dimension to the sweep from the
+        outermost to the innermost (see Sweep.get_dimension).
+        """
+        jobs = []
+        while isinstance(job, dict):
+            if job.get('type') in cls.job_types:
+                jobs.append(job)
+            job = job.get('job')
+        return jobs
+
+    def add_job(self, job, axis):
+        if 'chans' in job:
+            chans, starts, stops = job['chans'], job['from'], job['to']
+        elif 'chan' in job:
+            chans, starts, stops = [job['chan']], [job['from']], [job['to']]
+        else:
+            return
+        points = job.get('points', job.get('repeats'))
+        try:
+            if len(chans) != len(starts) or len(chans) != len(stops) or \
+                    points < 2:
+                return
+        except TypeError:
+            return
+        for chan, start, stop in zip(chans, starts, stops):
+            step = (stop - start) / (points - 1)
+            if step == 0:
+                # 'Linear' also implies 'not constant' (see
+                # DataHandler.is_linear).
+                continue
+            self.channels[chan] = {'axis': axis, 'start': start, 'step': step}
+
+    def get_axis(self, name):
+        """
+        Returns the axis along which the column name varies linearly, or None
+        if name is not described by the grid.
+        """
+        channel = self.channels.get(name)
+        if channel is None:
+            return None
+        return channel['axis']
+
+    def get_expected(self, name, index):
+        channel = self.channels[name]
+        return channel['start'] + index * channel['step']
+
+    def verify(self, data, rtol=1e-6):
+        """
+        Removes the channels whose recorded column in data differs from the
+        grid. Only the corners and the middle of each column are compared, so
+        the check is cheap, but it catches a channel which was not actually
+        swept as described, e.g., because the sweep was aborted or the
+        instrument clipped the values.
+        """
+        for name in list(self.channels):
+            if name not in data or not self.is_recorded(data[name], name,
+                                                       rtol):
+                del self.channels[name]
+
+    def is_recorded(self, column, name, rtol):
+        column = np.asarray(column)
+        if column.shape != self.shape:
+            return False
+        channel = self.channels[name]
+        axis = channel['axis']
+        n = self.shape[axis]
+        atol = rtol * abs(channel['step']) * max(n - 1, 1)
+        # The column must also be constant along the other axis.
+        others = (0, -1) if column.ndim == 2 else (0,)
+        for i in sorted({0, n // 2, n - 1}):
+            expected = self.get_expected(name, i)
+            for j in others:
+                idx = [j] * column.ndim
+                idx[axis] = i
+                if not abs(column[tuple(idx)] - expected) <= atol:
+                    return False
+        return True
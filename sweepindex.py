@@ -0,0 +1,441 @@
+import os
+import re
+import shlex
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from sweep import Sweep
+from columncache import ColumnCache
+from sweepscanner import read_meta_fields, scan_sweep_dirs
+
+
+class SweepIndex(object):
+    """
+    Persistent index of the sweeps in a data directory.
+
+    The index is stored in an SQLite database and records the path, time stamp,
+    name, dimension and the signatures of meta.json and data.dat for every
+    sweep, together with the modification time of the sweep directory. When
+    the data directory is rescanned only directories whose modification time
+    has changed are parsed again, so a rescan of an unchanged tree requires
+    one stat per directory and no reads of meta.json. Only the end of
+    meta.json is read for new and changed directories (see
+    sweepscanner.read_meta_fields), which matters on slow network drives.
+
+    For filtering the sweeps with query, every level of the job tree (type,
+    channel, from, to and points) is indexed as well. The instrument values
+    stored in the register of meta.json (current_values, cached_values,
+    temperatures and the field of magnets) require reading all of meta.json,
+    so they are indexed in a separate pass, index_pending_values, which is
+    run after the rescan. Instrument values are indexed by
+    instrument/channel, by channel and by the registered names of the
+    channels, e.g., triton/MC and MC.
+
+    Parameters
+    ----------
+    dir_path : str
+        Data directory containing sweep directories at any depth.
+    db_path : str or None
+        Path to the SQLite database file. A single database can hold the index
+        of multiple data directories. If None the database is stored in
+        default_dir.
+    max_workers : integer
+        Maximum number of meta.json files read concurrently during a rescan.
+    index_values : boolean
+        If False index_pending_values does nothing, so the instrument values
+        are never indexed.
+    """
+    default_dir = os.path.join(os.path.expanduser('~'), '.folderbrowser')
+    db_name = 'sweepindex.sqlite'
+    version = 3
+    fields = ('path', 'time_stamp', 'name', 'dimension', 'dir_mtime',
+              'meta_size', 'meta_mtime', 'data_size', 'data_mtime')
+
+    job_fields = {'type': 'type', 'chan': 'chan', 'from': 'from_value',
+                  'to': 'to_value', 'points': 'points'}
+    query_re = re.compile(r'^([\w/.\-]+)(<=|>=|!=|=|<|>)(.+)$')
+
+    def __init__(self, dir_path, db_path=None, max_workers=8,
+                 index_values=True):
+        self.dir_path = os.path.normpath(os.path.abspath(dir_path))
+        if db_path is None:
+            db_path = os.path.join(self.default_dir, self.db_name)
+        self.db_path = db_path
+        self.max_workers = max_workers
+        self.index_values = index_values
+        db_dir = os.path.dirname(db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        self.init_db()
+
+    def connect(self):
+        # A new connection is made for every operation so the index can be
+        # used from any thread.
+        return sqlite3.connect(self.db_path, timeout=30)
+
+    def init_db(self):
+        with self.connect() as con:
+            version = con.execute('PRAGMA user_version').fetchone()[0]
+            if version != self.version:
+                for table in ('sweeps', 'jobs', 'sweep_values'):
+                    con.execute('DROP TABLE IF EXISTS {}'.format(table))
+                con.execute('PRAGMA user_version = {:d}'.format(self.version))
+            con.execute(
+                'CREATE TABLE IF NOT EXISTS sweeps ('
+                'path TEXT PRIMARY KEY, root TEXT, time_stamp TEXT, '
+                'name TEXT, dimension INTEGER, dir_mtime INTEGER, '
+                'meta_size INTEGER, meta_mtime INTEGER, '
+                'data_size INTEGER, data_mtime INTEGER, '
+                'values_mtime INTEGER)')
+            con.execute('CREATE INDEX IF NOT EXISTS sweeps_root '
+                        'ON sweeps (root)')
+            con.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'path TEXT, level INTEGER, type TEXT, chan TEXT, '
+                'from_value REAL, to_value REAL, points INTEGER)')
+            con.execute('CREATE INDEX IF NOT EXISTS jobs_path '
+                        'ON jobs (path)')
+            con.execute('CREATE INDEX IF NOT EXISTS jobs_chan '
+                        'ON jobs (chan)')
+            con.execute(
+                'CREATE TABLE IF NOT EXISTS sweep_values ('
+                'path TEXT, key TEXT, channel TEXT, value REAL)')
+            con.execute('CREATE INDEX IF NOT EXISTS sweep_values_path '
+                        'ON sweep_values (path)')
+            con.execute('CREATE INDEX IF NOT EXISTS sweep_values_channel '
+                        'ON sweep_values (channel, value)')
+            con.execute('CREATE INDEX IF NOT EXISTS sweep_values_key '
+                        'ON sweep_values (key, value)')
+
+    def get_entries(self):
+        """
+        Returns a dictionary mapping the path of every indexed sweep in
+        dir_path to a dictionary with the fields of the index.
+        """
+        query = 'SELECT {} FROM sweeps WHERE root = ?'.format(
+            ', '.join(self.fields))
+        with self.connect() as con:
+            rows = con.execute(query, (self.dir_path,)).fetchall()
+        return {row[0]: dict(zip(self.fields, row)) for row in rows}
+
+    def rescan(self, callback=None, sub_dir=None):
+        """
+        Scans dir_path and updates the index. Directories whose modification
+        time is unchanged are not parsed again, and new or changed directories
+        are parsed on a pool of max_workers threads. If callback is given it
+        is called with every new or changed entry as soon as it has been
+        parsed, from the thread calling rescan. If sub_dir is given only the
+        part of the tree below sub_dir is scanned. Returns the updated entries
+        of the whole index (see get_entries).
+        """
+        entries = self.get_entries()
+        if sub_dir is None:
+            sub_dir = self.dir_path
+        sub_dir = os.path.normpath(os.path.abspath(sub_dir))
+        old_entries = {path: entry for path, entry in entries.items()
+                       if self.is_in_dir(path, sub_dir)}
+        known_mtimes = {path: entry['dir_mtime']
+                        for path, entry in old_entries.items()}
+        new_entries = {}
+        changed = []
+        scan = scan_sweep_dirs(sub_dir, self.make_entry, known_mtimes,
+                               self.max_workers)
+        for sub_dir_path, dir_mtime, entry in scan:
+            if entry is None:
+                # Either unchanged or meta.json could not be parsed.
+                entry = old_entries.get(sub_dir_path)
+                if entry is None or entry['dir_mtime'] != dir_mtime:
+                    continue
+            else:
+                changed.append(entry)
+                if callback is not None:
+                    callback(entry)
+                # The jobs and instrument values are only kept in the database.
+                entry = {field: entry[field] for field in self.fields}
+            new_entries[sub_dir_path] = entry
+        removed = [path for path in old_entries if path not in new_entries]
+        self.update(changed, removed)
+        for path in removed:
+            del entries[path]
+        entries.update(new_entries)
+        return entries
+
+    @staticmethod
+    def is_in_dir(path, dir_path):
+        return path == dir_path or path.startswith(dir_path + os.sep)
+
+    def index_pending_values(self, callback=None, is_stopped=None):
+        """
+        Reads all of meta.json for the sweeps whose instrument values have
+        not been indexed since meta.json last changed, and indexes their
+        values. The files are read on a pool of max_workers threads. If
+        callback is given it is called with the number of sweeps indexed so
+        far after every sweep. If is_stopped is given it is called between
+        sweeps, and the pass stops when it returns True; the remaining sweeps
+        are indexed by the next pass. Returns the number of sweeps indexed.
+        """
+        if not self.index_values:
+            return 0
+        query = ('SELECT path, meta_mtime FROM sweeps WHERE root = ? AND '
+                 '(values_mtime IS NULL OR values_mtime != meta_mtime)')
+        with self.connect() as con:
+            pending = con.execute(query, (self.dir_path,)).fetchall()
+        n_indexed = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.read_values, path, meta_mtime)
+                       for path, meta_mtime in pending]
+            for future, (path, meta_mtime) in zip(futures, pending):
+                if is_stopped is not None and is_stopped():
+                    for other in futures:
+                        other.cancel()
+                    break
+                values = future.result()
+                if values is None:
+                    continue
+                self.update_values(path, meta_mtime, values)
+                n_indexed += 1
+                if callback is not None:
+                    callback(n_indexed)
+        return n_indexed
+
+    @classmethod
+    def read_values(cls, sweep_path, meta_mtime):
+        """
+        Returns the value rows (see get_value_rows) of the sweep or None if
+        meta.json cannot be read or has changed since it was indexed.
+        """
+        try:
+            if os.stat(os.path.join(sweep_path,
+                                    'meta.json')).st_mtime_ns != meta_mtime:
+                return None
+            meta = Sweep.load_dir(sweep_path, meta_only=True)
+            return cls.get_value_rows(meta)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+
+    def update_values(self, path, meta_mtime, values):
+        insert_value = 'INSERT INTO sweep_values VALUES (?, ?, ?, ?)'
+        with self.connect() as con:
+            # The sweep may have been rescanned meanwhile.
+            cursor = con.execute(
+                'UPDATE sweeps SET values_mtime = ? '
+                'WHERE path = ? AND meta_mtime = ?',
+                (meta_mtime, path, meta_mtime))
+            if cursor.rowcount == 0:
+                return
+            con.execute('DELETE FROM sweep_values WHERE path = ?', (path,))
+            con.executemany(insert_value, [[path] + list(row)
+                                           for row in values])
+
+    def update(self, changed, removed):
+        """
+        Writes the entries in changed to the index and deletes the paths in
+        removed. The instrument values of the entries in changed are deleted
+        and indexed again by index_pending_values.
+        """
+        insert = 'INSERT OR REPLACE INTO sweeps (root, {}) VALUES ({})'.format(
+            ', '.join(self.fields), ', '.join('?' * (len(self.fields) + 1)))
+        insert_job = 'INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)'
+        with self.connect() as con:
+            for entry in changed:
+                path = entry['path']
+                values = [entry[field] for field in self.fields]
+                con.execute(insert, [self.dir_path] + values)
+                self.delete_details(con, path)
+                con.executemany(insert_job, [[path] + list(row)
+                                             for row in entry['jobs']])
+            for path in removed:
+                con.execute('DELETE FROM sweeps WHERE path = ?', (path,))
+                self.delete_details(con, path)
+
+    @staticmethod
+    def delete_details(con, path):
+        con.execute('DELETE FROM jobs WHERE path = ?', (path,))
+        con.execute('DELETE FROM sweep_values WHERE path = ?', (path,))
+
+    def clear(self):
+        with self.connect() as con:
+            for table in ('jobs', 'sweep_values'):
+                con.execute(
+                    'DELETE FROM {} WHERE path IN '
+                    '(SELECT path FROM sweeps WHERE root = ?)'.format(table),
+                    (self.dir_path,))
+            con.execute('DELETE FROM sweeps WHERE root = ?', (self.dir_path,))
+
+    def query(self, query_str):
+        """
+        Returns the set of paths of the sweeps matching query_str. No files
+        are read.
+
+        query_str consists of terms separated by whitespace, all of which must
+        match. A term is either a word contained in the sweep name or a
+        comparison field<op>value with op one of =, !=, <, <=, > and >=.
+        Fields are
+            name            sweep name contains value (= only)
+            dim             dimension of the sweep
+            type, chan      type and channel of any level of the job tree
+            from, to, points
+                            of any level of the job tree
+            anything else   instrument value, e.g., MC<0.05 or dac/CH11>-1
+        Instrument values only match sweeps indexed by index_pending_values.
+        Terms may be quoted, e.g., "name=gate sweep". Raises ValueError if
+        query_str is invalid.
+        """
+        conditions = ['root = ?']
+        params = [self.dir_path]
+        for term in shlex.split(query_str):
+            condition, term_params = self.parse_term(term)
+            conditions.append(condition)
+            params.extend(term_params)
+        sql = 'SELECT path FROM sweeps WHERE ' + ' AND '.join(conditions)
+        with self.connect() as con:
+            rows = con.execute(sql, params).fetchall()
+        return {row[0] for row in rows}
+
+    def parse_term(self, term):
+        """
+        Returns an SQL condition on the sweeps table and its parameters for a
+        single query term.
+        """
+        match = self.query_re.match(term)
+        if match is None:
+            return self.get_name_condition(term)
+        field, op, value = match.groups()
+        if field == 'name':
+            if op != '=':
+                raise ValueError('Only = is supported for name.')
+            return self.get_name_condition(value)
+        if field in ('type', 'chan'):
+            if op not in ('=', '!='):
+                raise ValueError(
+                    'Only = and != are supported for {}.'.format(field))
+            condition = 'path IN (SELECT path FROM jobs WHERE {} {} ?)'
+            return condition.format(field, op), [value]
+        try:
+            value = float(value)
+        except ValueError:
+            raise ValueError('{} must be compared to a number.'.format(field))
+        if field in ('dim', 'dimension'):
+            return 'dimension {} ?'.format(op), [value]
+        if field in self.job_fields:
+            condition = 'path IN (SELECT path FROM jobs WHERE {} {} ?)'
+            return condition.format(self.job_fields[field], op), [value]
+        column = 'key' if '/' in field else 'channel'
+        condition = ('path IN (SELECT path FROM sweep_values '
+                     'WHERE {} = ? AND value {} ?)')
+        return condition.format(column, op), [field, value]
+
+    @staticmethod
+    def get_name_condition(word):
+        word = word.replace('\\', '\\\\').replace('%', '\\%')
+        word = word.replace('_', '\\_')
+        return "name LIKE ? ESCAPE '\\'", ['%' + word + '%']
+
+    @classmethod
+    def make_entry(cls, sweep_path, dir_mtime):
+        """
+        Reads name and job from the end of meta.json in sweep_path and returns
+        an index entry or None if meta.json cannot be read.
+        """
+        # The signature is taken before parsing so a change during parsing
+        # makes the entry stale.
+        signature = ColumnCache.get_signature(sweep_path)
+        try:
+            meta = read_meta_fields(sweep_path, ('name', 'job'))
+            dimension = Sweep.get_dimension(meta)
+            name = meta['name']
+            jobs = cls.get_job_rows(meta)
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return None
+        if signature is None:
+            # data.dat does not exist (yet).
+            try:
+                meta_st = os.stat(os.path.join(sweep_path, 'meta.json'))
+            except OSError:
+                return None
+            signature = [[None, None], [meta_st.st_size, meta_st.st_mtime_ns]]
+        (data_size, data_mtime), (meta_size, meta_mtime) = signature
+        entry = {
+            'path': sweep_path,
+            'time_stamp': os.path.split(sweep_path)[-1],
+            'name': name,
+            'dimension': dimension,
+            'dir_mtime': dir_mtime,
+            'meta_size': meta_size,
+            'meta_mtime': meta_mtime,
+            'data_size': data_size,
+            'data_mtime': data_mtime,
+            'jobs': jobs,
+        }
+        return entry
+
+    @staticmethod
+    def get_job_rows(meta):
+        """
+        Returns a list with a row (level, type, chan, from, to, points) for
+        every level of the job tree in meta. Jobs sweeping several channels
+        along a line give a row per channel.
+        """
+        rows = []
+        job = meta['job']
+        level = 0
+        while isinstance(job, dict):
+            if 'chans' in job:
+                chans = job['chans']
+                from_values = job.get('from', [None] * len(chans))
+                to_values = job.get('to', [None] * len(chans))
+            else:
+                chans = [job.get('chan')]
+                from_values = [job.get('from')]
+                to_values = [job.get('to')]
+            for chan, from_value, to_value in zip(chans, from_values,
+                                                  to_values):
+                rows.append((level, job.get('type'), chan, from_value,
+                             to_value, job.get('points')))
+            job = job.get('job')
+            level += 1
+        return rows
+
+    @classmethod
+    def get_value_rows(cls, meta):
+        """
+        Returns a list of rows (key, channel, value) with the numerical
+        instrument values in the register of meta, where key is
+        instrument/channel.
+        """
+        register = meta.get('register', {})
+        values = {}
+        for instrument in register.get('instruments', []):
+            ins_name = instrument.get('name')
+            for value_name in ('current_values', 'cached_values',
+                               'temperatures', 'field'):
+                ins_values = instrument.get(value_name)
+                if isinstance(ins_values, list):
+                    # Combined instruments list the cached values in the
+                    # order of their channels.
+                    ins_values = dict(zip(instrument.get('channels', []),
+                                          ins_values))
+                if not isinstance(ins_values, dict):
+                    continue
+                for channel, value in ins_values.items():
+                    value = cls.to_number(value)
+                    if value is not None:
+                        key = '{}/{}'.format(ins_name, channel)
+                        values[key] = (channel, value)
+        rows = [(key, channel, value)
+                for key, (channel, value) in values.items()]
+        # Registered channel names, e.g., MC for triton/MC.
+        for channel in register.get('channels', []):
+            key = channel.get('default_name') or channel.get('base_channel')
+            name = channel.get('name')
+            if key in values and name is not None and \
+                    name != values[key][0]:
+                rows.append((key, name, values[key][1]))
+        return rows
+
+    @staticmethod
+    def to_number(value):
+        if isinstance(value, list) and len(value) == 1:
+            value = value[0]
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        return value
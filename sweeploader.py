@@ -0,0 +1,520 @@
+import time
+import threading
+from PyQt5 import QtCore
+from sweep import Sweep
+
+
+class SweepLoader(QtCore.QObject):
+    """
+    Loads sweeps on a background thread pool and delivers them to the GUI
+    thread through the signals loaded and failed.
+
+    Only the most recent request is delivered. Starting a new request cancels
+    the previous one: if it has not started it is removed from the queue, if it
+    is running it stops at the next checkpoint, and if it has already finished
+    its result is dropped.
+
+    A request is handled in two steps. SweepLoadTask loads the sweep, or takes
+    it from sweep_cache, on the thread pool. Then the pseudocolumn functions
+    are set in the GUI thread, since the sweep may be the one which is
+    plotted, and PcolComputeTask calculates the requested pseudocolumns on the
+    thread pool before the sweep is delivered.
+
+    Parameters
+    ----------
+    cache_dir : str or None
+        Passed on to Sweep.
+    sweep_cache : SweepCache instance or None
+        If given, sweeps are taken from sweep_cache when possible and loaded
+        sweeps are added to it.
+    parent : QtCore.QObject instance
+        Parent of the loader.
+    pdata_max_bytes : integer or None
+        Passed on to Sweep.
+
+    Signals
+    -------
+    loaded(sweep, context)
+        Emitted with the loaded Sweep instance and the context given to load.
+    failed(error, context)
+        Emitted with the exception raised while loading.
+    """
+    loaded = QtCore.pyqtSignal(object, object)
+    failed = QtCore.pyqtSignal(object, object)
+
+    def __init__(self, cache_dir=None, sweep_cache=None, parent=None,
+                 pdata_max_bytes=None):
+        super().__init__(parent)
+        self.cache_dir = cache_dir
+        self.pdata_max_bytes = pdata_max_bytes
+        self.sweep_cache = sweep_cache
+        self.request_id = 0
+        # Of the most recent request.
+        self.name_func_dict = None
+        self.col_names = ()
+        self.thread_pool = QtCore.QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(2)
+        self.signals = LoadTaskSignals(self)
+        self.signals.finished.connect(self.on_task_finished)
+        self.signals.computed.connect(self.on_task_computed)
+        self.signals.failed.connect(self.on_task_failed)
+
+    def load(self, path, name_func_dict, col_names=(), context=None):
+        """
+        Starts loading the sweep at path in the background. The columns and
+        pseudocolumns in col_names are calculated in the background as well,
+        such that they are ready when the sweep is plotted.
+        """
+        self.cancel()
+        self.name_func_dict = name_func_dict
+        self.col_names = col_names
+        sweep = self.get_cached_sweep(path)
+        if sweep is not None:
+            self.set_pdata(sweep)
+            self.loaded.emit(sweep, context)
+            return
+        task = SweepLoadTask(self, self.request_id, path, context)
+        self.thread_pool.start(task)
+
+    def get_cached_sweep(self, path):
+        if self.sweep_cache is None:
+            return None
+        return self.sweep_cache.get(path)
+
+    def set_pdata(self, sweep):
+        """
+        Sets the pseudocolumn functions of the most recent request on sweep.
+        Must be called in the GUI thread.
+        """
+        # If the pseudocolumn file has been reloaded since the sweep was
+        # loaded, only the changed pseudocolumns are dropped.
+        if getattr(sweep, 'name_func_dict', None) is not self.name_func_dict:
+            sweep.set_pdata(self.name_func_dict)
+
+    def cancel(self):
+        self.request_id += 1
+        self.thread_pool.clear()
+
+    def is_cancelled(self, request_id):
+        return request_id != self.request_id
+
+    def on_task_finished(self, request_id, sweep, context):
+        self.set_pdata(sweep)
+        if self.sweep_cache is not None:
+            # The sweep is cached even if the request is cancelled since the
+            # user is likely to come back to it.
+            self.sweep_cache.put(sweep)
+        if self.is_cancelled(request_id):
+            return
+        task = PcolComputeTask(self, request_id, sweep, self.col_names,
+                               context)
+        self.thread_pool.start(task)
+
+    def on_task_computed(self, request_id, sweep, context):
+        if self.is_cancelled(request_id):
+            return
+        self.loaded.emit(sweep, context)
+
+    def on_task_failed(self, request_id, error, context):
+        if self.is_cancelled(request_id):
+            return
+        self.failed.emit(error, context)
+
+
+class LoadTaskSignals(QtCore.QObject):
+    """
+    QRunnable is not a QObject, so the tasks of SweepLoader and
+    SweepPrefetcher emit their signals through an instance of this class. The
+    instance lives in the GUI thread, so the connected slots are called in
+    the GUI thread.
+    """
+    finished = QtCore.pyqtSignal(int, object, object)
+    computed = QtCore.pyqtSignal(int, object, object)
+    failed = QtCore.pyqtSignal(int, object, object)
+
+
+class SweepLoadTask(QtCore.QRunnable):
+    def __init__(self, loader, request_id, path, context):
+        super().__init__()
+        self.loader = loader
+        self.request_id = request_id
+        self.path = path
+        self.context = context
+        self.signals = loader.signals
+
+    def run(self):
+        try:
+            sweep = self.load()
+        except Exception as error:
+            self.signals.failed.emit(self.request_id, error, self.context)
+            return
+        if sweep is not None:
+            self.signals.finished.emit(self.request_id, sweep, self.context)
+
+    def load(self):
+        """
+        Returns the loaded sweep or None if the request was cancelled before
+        loading started. The pseudocolumn functions are set later, in the GUI
+        thread (see SweepLoader.on_task_finished).
+        """
+        if self.is_cancelled():
+            return None
+        # The sweep may have been prefetched since the request was made.
+        sweep = self.loader.get_cached_sweep(self.path)
+        if sweep is not None:
+            return sweep
+        return Sweep(self.path, cache_dir=self.loader.cache_dir,
+                     pdata_max_bytes=self.loader.pdata_max_bytes)
+
+    def is_cancelled(self):
+        return self.loader.is_cancelled(self.request_id)
+
+
+class PcolComputeTask(QtCore.QRunnable):
+    """
+    Calculates the pseudocolumns in col_names of a sweep whose pseudocolumn
+    functions have been set, and emits computed unless the request has been
+    cancelled.
+    """
+    def __init__(self, loader, request_id, sweep, col_names, context):
+        super().__init__()
+        self.loader = loader
+        self.request_id = request_id
+        self.sweep = sweep
+        self.col_names = col_names
+        self.context = context
+        self.signals = loader.signals
+
+    def run(self):
+        if self.is_cancelled():
+            return
+        try:
+            # The pseudocolumns are calculated concurrently. Failing
+            # pseudocolumns are reported when they are plotted.
+            self.sweep.pdata.compute(self.col_names)
+        except Exception as error:
+            self.signals.failed.emit(self.request_id, error, self.context)
+            return
+        if self.is_cancelled():
+            return
+        self.signals.computed.emit(self.request_id, self.sweep, self.context)
+
+    def is_cancelled(self):
+        return self.loader.is_cancelled(self.request_id)
+
+
+class SweepPrefetcher(QtCore.QObject):
+    """
+    Speculatively loads the sweeps the user is likely to select next into a
+    SweepCache on low-priority background threads.
+
+    A call to prefetch replaces all queued requests, and cancel should be
+    called as soon as the user makes a real selection so prefetching never
+    competes with it. Sweeps being loaded when cancel is called are still
+    added to the cache, but their pseudocolumns are not calculated.
+
+    PrefetchTask loads a sweep on the thread pool. Its pseudocolumn functions
+    are set and it is added to the cache in the GUI thread, like in
+    SweepLoader, and then PcolPrefetchTask calculates the pseudocolumns one
+    at a time on the thread pool.
+
+    Parameters
+    ----------
+    sweep_cache : SweepCache instance
+        Cache which prefetched sweeps are added to.
+    cache_dir : str or None
+        Passed on to Sweep.
+    max_threads : integer
+        Maximum number of sweeps loaded concurrently. This limits the I/O load
+        on, e.g., a network drive.
+    max_bytes : integer or None
+        Ceiling on the memory occupied by prefetched sweeps which have not yet
+        been selected by the user. If None the budget of sweep_cache is used.
+    parent : QtCore.QObject instance
+        Parent of the prefetcher.
+    pdata_max_bytes : integer or None
+        Passed on to Sweep.
+    """
+    def __init__(self, sweep_cache, cache_dir=None, max_threads=1,
+                 max_bytes=None, parent=None, pdata_max_bytes=None):
+        super().__init__(parent)
+        self.sweep_cache = sweep_cache
+        self.cache_dir = cache_dir
+        self.pdata_max_bytes = pdata_max_bytes
+        if max_bytes is None:
+            max_bytes = sweep_cache.max_bytes
+        self.max_bytes = max_bytes
+        self.generation = 0
+        # Of the most recent call to prefetch.
+        self.name_func_dict = None
+        self.col_names = ()
+        self.lock = threading.Lock()
+        self.in_progress = set()
+        # Maps path to size in bytes for prefetched sweeps not yet used.
+        self.unused = {}
+        self.thread_pool = QtCore.QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(max_threads)
+        self.signals = LoadTaskSignals(self)
+        self.signals.finished.connect(self.on_task_finished)
+        self.signals.failed.connect(self.on_task_failed)
+
+    def prefetch(self, paths, name_func_dict, col_names=()):
+        """
+        Queues paths for prefetching. The first path in paths is loaded first.
+        """
+        self.cancel()
+        self.name_func_dict = name_func_dict
+        self.col_names = col_names
+        for i, path in enumerate(paths):
+            if path in self.sweep_cache or path in self.in_progress:
+                continue
+            task = PrefetchTask(self, self.generation, path)
+            self.thread_pool.start(task, -i)
+
+    def cancel(self):
+        self.generation += 1
+        self.thread_pool.clear()
+
+    def is_cancelled(self, generation):
+        return generation != self.generation
+
+    def mark_used(self, path):
+        """
+        Must be called when the user selects path such that the sweep no
+        longer counts toward the prefetch ceiling.
+        """
+        with self.lock:
+            self.unused.pop(path, None)
+
+    def get_unused_nbytes(self):
+        with self.lock:
+            return sum(nbytes for path, nbytes in self.unused.items()
+                       if path in self.sweep_cache)
+
+    def has_room(self, nbytes=0):
+        return self.get_unused_nbytes() + nbytes <= self.max_bytes
+
+    def start_task(self, path):
+        """
+        Returns False if path is already being prefetched.
+        """
+        with self.lock:
+            if path in self.in_progress:
+                return False
+            self.in_progress.add(path)
+            return True
+
+    def finish_task(self, path, sweep=None):
+        """
+        Adds sweep to the cache if there is room for it. Returns True if it
+        was added.
+        """
+        with self.lock:
+            self.in_progress.discard(path)
+            if sweep is None:
+                return False
+        nbytes = sweep.get_nbytes()
+        if not self.has_room(nbytes):
+            return False
+        with self.lock:
+            self.unused[path] = nbytes
+        self.sweep_cache.put(sweep)
+        return True
+
+    def on_task_finished(self, generation, sweep, path):
+        sweep.set_pdata(self.name_func_dict)
+        if not self.finish_task(path, sweep):
+            return
+        if self.is_cancelled(generation) or not self.col_names:
+            return
+        task = PcolPrefetchTask(self, generation, sweep, self.col_names)
+        self.thread_pool.start(task)
+
+    def on_task_failed(self, generation, error, path):
+        # Errors are reported if the user selects the sweep.
+        self.finish_task(path)
+
+
+class PrefetchTask(QtCore.QRunnable):
+    def __init__(self, prefetcher, generation, path):
+        super().__init__()
+        self.prefetcher = prefetcher
+        self.generation = generation
+        self.path = path
+        self.signals = prefetcher.signals
+
+    def run(self):
+        prefetcher = self.prefetcher
+        if self.is_cancelled() or not prefetcher.has_room():
+            return
+        if not prefetcher.start_task(self.path):
+            return
+        QtCore.QThread.currentThread().setPriority(
+            QtCore.QThread.LowestPriority)
+        try:
+            sweep = Sweep(self.path, cache_dir=prefetcher.cache_dir,
+                          pdata_max_bytes=prefetcher.pdata_max_bytes)
+        except Exception as error:
+            self.signals.failed.emit(self.generation, error, self.path)
+            return
+        # The pseudocolumn functions are set in the GUI thread.
+        self.signals.finished.emit(self.generation, sweep, self.path)
+
+    def is_cancelled(self):
+        return self.prefetcher.is_cancelled(self.generation)
+
+
+class PcolPrefetchTask(QtCore.QRunnable):
+    def __init__(self, prefetcher, generation, sweep, col_names):
+        super().__init__()
+        self.prefetcher = prefetcher
+        self.generation = generation
+        self.sweep = sweep
+        self.col_names = col_names
+
+    def run(self):
+        QtCore.QThread.currentThread().setPriority(
+            QtCore.QThread.LowestPriority)
+        # The pseudocolumns are calculated one at a time on this
+        # low-priority thread rather than with PseudoData.compute, which
+        # would compete with the sweep selected by the user.
+        for col_name in self.col_names:
+            if self.is_cancelled():
+                break
+            try:
+                self.sweep.get_data(col_name)
+            except Exception:
+                pass
+
+    def is_cancelled(self):
+        return self.prefetcher.is_cancelled(self.generation)
+
+
+class SweepScanner(QtCore.QObject):
+    """
+    Rescans the data directory of a SweepIndex on a background thread and
+    streams the sweeps found to the GUI thread.
+
+    After each scan the instrument values of new and changed sweeps are
+    indexed on the same thread (see SweepIndex.index_pending_values). A new
+    scan stops this pass, which continues after the new scan.
+
+    Parameters
+    ----------
+    sweep_index : SweepIndex instance
+        Index to rescan.
+    batch_interval : float
+        Minimum time in seconds between two emissions of found, such that the
+        GUI is not updated for every single sweep.
+    parent : QtCore.QObject instance
+        Parent of the scanner.
+
+    Signals
+    -------
+    found(entries)
+        Emitted with a list of new or changed index entries while scanning.
+    finished(entries)
+        Emitted with all entries of the index (see SweepIndex.get_entries)
+        when the scan has finished.
+    failed(error)
+        Emitted with the exception raised while scanning.
+    values_indexed(n)
+        Emitted with the number of sweeps whose instrument values have been
+        indexed after a scan, if any.
+    values_failed(error)
+        Emitted with the exception raised while indexing instrument values.
+        The scan itself has finished in that case.
+    """
+    found = QtCore.pyqtSignal(object)
+    finished = QtCore.pyqtSignal(object)
+    failed = QtCore.pyqtSignal(object)
+    values_indexed = QtCore.pyqtSignal(int)
+    values_failed = QtCore.pyqtSignal(object)
+
+    def __init__(self, sweep_index, batch_interval=0.2, parent=None):
+        super().__init__(parent)
+        self.sweep_index = sweep_index
+        self.batch_interval = batch_interval
+        self.is_scanning = False
+        # Scans requested while scanning. None in pending_dirs means the whole
+        # tree.
+        self.pending_dirs = set()
+        # Set when a scan is started, to stop indexing values.
+        self.stop_values = threading.Event()
+        self.thread_pool = QtCore.QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(1)
+        self.finished.connect(self.on_scan_done)
+        self.failed.connect(self.on_scan_done)
+
+    def scan(self, sub_dirs=None):
+        """
+        Starts a rescan of the directories in sub_dirs, or of the whole tree if
+        sub_dirs is None. If a scan is already running the rescan is started
+        when it has finished. Returns False in that case.
+        """
+        if self.is_scanning:
+            if sub_dirs is None:
+                self.pending_dirs.add(None)
+            else:
+                self.pending_dirs.update(sub_dirs)
+            return False
+        self.is_scanning = True
+        self.stop_values.set()
+        self.thread_pool.start(SweepScanTask(self, sub_dirs))
+        return True
+
+    def on_scan_done(self, result):
+        self.is_scanning = False
+        if not self.pending_dirs:
+            return
+        sub_dirs = self.pending_dirs
+        self.pending_dirs = set()
+        if None in sub_dirs:
+            sub_dirs = None
+        self.scan(sub_dirs)
+
+
+class SweepScanTask(QtCore.QRunnable):
+    def __init__(self, scanner, sub_dirs=None):
+        super().__init__()
+        self.scanner = scanner
+        self.sub_dirs = sub_dirs
+        self.batch = []
+        self.last_emit = time.monotonic()
+
+    def run(self):
+        sweep_index = self.scanner.sweep_index
+        self.scanner.stop_values.clear()
+        try:
+            if self.sub_dirs is None:
+                entries = sweep_index.rescan(self.add_entry)
+            else:
+                # Without any sub_dirs the indexed sweeps are reported as
+                # they are.
+                entries = sweep_index.get_entries()
+                for sub_dir in self.sub_dirs:
+                    entries = sweep_index.rescan(self.add_entry, sub_dir)
+        except Exception as error:
+            self.scanner.failed.emit(error)
+            return
+        self.emit_batch()
+        self.scanner.finished.emit(entries)
+        try:
+            n_indexed = sweep_index.index_pending_values(
+                is_stopped=self.scanner.stop_values.is_set)
+        except Exception as error:
+            self.scanner.values_failed.emit(error)
+            return
+        if n_indexed:
+            self.scanner.values_indexed.emit(n_indexed)
+
+    def add_entry(self, entry):
+        self.batch.append(entry)
+        if time.monotonic() - self.last_emit > self.scanner.batch_interval:
+            self.emit_batch()
+
+    def emit_batch(self):
+        if self.batch:
+            self.scanner.found.emit(self.batch)
+        self.batch = []
+        self.last_emit = time.monotonic()
@@ -0,0 +1,175 @@
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from columncache import ColumnCache
+
+
+structural_re = re.compile(r'[{}\[\]",:]')
+tail_size = 8 * 1024
+
+
+def read_meta_fields(sweep_path, keys):
+    """
+    Returns a dictionary with the top-level keys in keys from meta.json in
+    sweep_path.
+
+    matlab-qd writes the large instrument register at the beginning of
+    meta.json and the short entries such as name, timestamp and job at the
+    end. Instead of parsing the whole file this function reads the tail of the
+    file, finds the top-level members by scanning backward from the closing
+    brace and decodes only the requested values. If the keys are not found in
+    the tail a larger tail is read, and in the worst case the whole file is
+    parsed. Keys which are not in meta.json are absent from the result.
+    """
+    keys = set(keys)
+    meta_path = os.path.join(sweep_path, 'meta.json')
+    with open(meta_path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        n_bytes = tail_size
+        while True:
+            n_bytes = min(n_bytes, size)
+            f.seek(size - n_bytes)
+            tail = f.read(n_bytes)
+            try:
+                fields = find_members_in_tail(tail.decode('utf-8'), keys)
+            except (UnicodeDecodeError, ValueError):
+                # The tail may start inside a multi-byte character or the
+                # file may not be formatted as expected.
+                fields = None
+            if fields is not None and keys.issubset(fields):
+                return fields
+            if n_bytes == size:
+                break
+            n_bytes *= 4
+    with open(meta_path) as f:
+        meta = json.load(f)
+    return {key: meta[key] for key in keys if key in meta}
+
+
+def find_members_in_tail(text, keys):
+    """
+    Decodes the members of the top-level JSON object whose keys are in keys
+    and whose values are completely contained in text, where text is the end
+    of the JSON document. Scanning stops when all keys are found.
+    """
+    text = text.rstrip()
+    if not text.endswith('}'):
+        raise ValueError('text does not end with a JSON object')
+    positions = [m.start() for m in structural_re.finditer(text)]
+    fields = {}
+    depth = 0
+    value_end = len(text) - 1
+    i = len(positions) - 1
+    while i >= 0:
+        pos = positions[i]
+        char = text[pos]
+        if char == '"':
+            # Outside strings the first quote found scanning backward always
+            # closes a string. Skip to the quote which opens it.
+            i -= 1
+            while i >= 0:
+                p = positions[i]
+                if text[p] == '"' and not is_escaped(text, p):
+                    break
+                i -= 1
+            if i < 0:
+                break
+            string_start = positions[i]
+            if depth == 1 and text[pos+1:].lstrip().startswith(':'):
+                key = json.loads(text[string_start:pos+1])
+                if key in keys:
+                    colon = text.index(':', pos)
+                    fields[key] = json.loads(text[colon+1:value_end])
+                    if len(fields) == len(keys):
+                        return fields
+        elif char in '}]':
+            depth += 1
+        elif char in '{[':
+            depth -= 1
+            if depth == 0:
+                # Reached the opening brace of the top-level object.
+                return fields
+        elif char == ',' and depth == 1:
+            value_end = pos
+        i -= 1
+    return fields
+
+
+def is_escaped(text, pos):
+    n_backslashes = 0
+    while pos > 0 and text[pos-1] == '\\':
+        n_backslashes += 1
+        pos -= 1
+    return n_backslashes % 2 == 1
+
+
+def iter_sweep_dirs(dir_path, known_mtimes=None):
+    """
+    Yields (path, dir_mtime, is_known) for every sweep directory, i.e., every
+    directory containing meta.json, below dir_path.
+
+    The tree is enumerated with os.scandir so every directory is listed once
+    and the file type and stat results of the directory entries are reused. A
+    directory in known_mtimes (a dictionary mapping path to modification time)
+    whose modification time is unchanged is yielded with is_known set to True
+    without being listed, which saves a round trip per sweep on network
+    drives. Such directories are not searched for sweeps inside them.
+    """
+    if known_mtimes is None:
+        known_mtimes = {}
+    stack = [(dir_path, None)]
+    while stack:
+        path, dir_mtime = stack.pop()
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            continue
+        if any(entry.name == 'meta.json' for entry in entries):
+            if dir_mtime is None:
+                dir_mtime = os.stat(path).st_mtime_ns
+            yield path, dir_mtime, False
+        for entry in entries:
+            if entry.name == ColumnCache.dir_name:
+                continue
+            try:
+                if not entry.is_dir(follow_symlinks=False):
+                    continue
+                sub_dir_mtime = entry.stat(follow_symlinks=False).st_mtime_ns
+            except OSError:
+                continue
+            if known_mtimes.get(entry.path) == sub_dir_mtime:
+                yield entry.path, sub_dir_mtime, True
+            else:
+                stack.append((entry.path, sub_dir_mtime))
+
+
+def scan_sweep_dirs(dir_path, make_entry, known_mtimes=None, max_workers=8):
+    """
+    Yields (path, dir_mtime, entry) for every sweep directory below dir_path.
+
+    For directories which are not known (see iter_sweep_dirs) make_entry is
+    called with the arguments path and dir_mtime on a thread pool of
+    max_workers threads, since on network drives each read of meta.json
+    costs a round trip. Known directories are yielded with entry None.
+    Results are yielded as soon as they are ready, not in any particular
+    order.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for path, dir_mtime, is_known in iter_sweep_dirs(dir_path,
+                                                         known_mtimes):
+            if is_known:
+                yield path, dir_mtime, None
+                continue
+            future = executor.submit(make_entry, path, dir_mtime)
+            futures[future] = (path, dir_mtime)
+            # Yield results while enumeration continues.
+            done = [f for f in futures if f.done()]
+            for future in done:
+                path, dir_mtime = futures.pop(future)
+                yield path, dir_mtime, future.result()
+        for future in as_completed(futures):
+            path, dir_mtime = futures[future]
+            yield path, dir_mtime, future.result()
@@ -0,0 +1,86 @@
+import sys
+sys.path.append('..')
+import os
+import shutil
+import tempfile
+import textwrap
+import unittest
+import numpy as np
+from batch import run_batch
+
+
+pcols_source = textwrap.dedent('''
+    def doubled(data, pdata, meta):
+        return 2 * data[data.dtype.names[0]]
+
+    name_func_dict = {'doubled': {'func': doubled, 'label': 'doubled'}}
+''')
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.tmp_dir, 'data')
+        for sweep_dir in ('2016-09-01#006', '2016-09-01#008', '2016-09-19#015'):
+            shutil.copytree(os.path.join('../data', sweep_dir),
+                            os.path.join(self.data_dir, sweep_dir),
+                            ignore=shutil.ignore_patterns('.fbcache'))
+        self.pcols_path = os.path.join(self.tmp_dir, 'test_pcols.py')
+        with open(self.pcols_path, 'w') as f:
+            f.write(pcols_source)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_reduction_and_errors(self):
+        progress = []
+        out_path = os.path.join(self.tmp_dir, 'results.npz')
+        results = run_batch(self.data_dir, self.pcols_path, ['doubled'],
+                            out_path=out_path, reduction='min', max_workers=2,
+                            progress=lambda *args: progress.append(args[:2]))
+        self.assertEqual(sorted(progress), [(1, 3), (2, 3), (3, 3)])
+        # 2016-09-19#015 has no data.dat.
+        errors = [bool(result['error']) for result in results]
+        self.assertEqual(errors, [False, False, True])
+        self.assertEqual(results[0]['values']['doubled'], -22)
+        table = np.load(out_path)
+        self.assertEqual(list(table['time_stamp']),
+                         ['2016-09-01#006', '2016-09-01#008', '2016-09-19#015'])
+        self.assertTrue(np.isnan(table['doubled'][2]))
+
+    def test_columns_at_value(self):
+        out_path = os.path.join(self.tmp_dir, 'results.csv')
+        results = run_batch(self.data_dir, self.pcols_path, ['doubled'],
+                            out_path=out_path, reduction='at:backgate=-10',
+                            max_workers=1)
+        self.assertAlmostEqual(results[0]['values']['doubled'], -20)
+        with open(out_path) as f:
+            self.assertEqual(len(f.readlines()), 4)
+
+    def test_data_directories_are_not_written(self):
+        run_batch(self.data_dir, self.pcols_path, ['doubled'],
+                  reduction='min', max_workers=1)
+        for sweep_dir in os.listdir(self.data_dir):
+            self.assertNotIn('.fbcache', os.listdir(
+                os.path.join(self.data_dir, sweep_dir)))
+
+    def test_interrupted_batch_writes_results_so_far(self):
+        def progress(n_done, n_total, result):
+            if n_done == 2:
+                raise KeyboardInterrupt
+        out_path = os.path.join(self.tmp_dir, 'results.csv')
+        with self.assertRaises(KeyboardInterrupt):
+            run_batch(self.data_dir, self.pcols_path, ['doubled'],
+                      out_path=out_path, reduction='min', max_workers=1,
+                      progress=progress)
+        with open(out_path) as f:
+            self.assertEqual(len(f.readlines()), 3)
+
+    def test_whole_columns_require_npz(self):
+        with self.assertRaises(ValueError):
+            run_batch(self.data_dir, self.pcols_path, ['doubled'],
+                      out_path=os.path.join(self.tmp_dir, 'results.csv'))
+
+
+if __name__=='__main__':
+    unittest.main()
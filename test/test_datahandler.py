@@ -1,6 +1,7 @@
 import sys
 sys.path.append('..')
 import unittest
+import numpy as np
 from datahandler import data_handler_factory
 from sweep import Sweep
 
@@ -34,5 +35,55 @@ class DataHandlerTestCase(unittest.TestCase):
             self.assertTrue(elems_are_equal.all())
 
 
+class TransformTestCase(unittest.TestCase):
+    def setUp(self):
+        self.x = np.repeat(np.linspace(5, -5, 11)[:, np.newaxis], 4, axis=1)
+        self.y = np.repeat(np.linspace(0, 3, 4)[np.newaxis, :], 11, axis=0)
+        self.z = np.arange(44.0).reshape(11, 4)
+        self.z[0, 0] = 1e30
+
+    def test_tdata_are_views(self):
+        data_h = data_handler_factory(self.x, self.y, self.z)
+        self.assertTrue(data_h.imshow_eligible)
+        for arr, tarr in zip(data_h.data, data_h.tdata):
+            self.assertTrue(np.shares_memory(arr, tarr))
+        # x is reversed to be increasing, and z with it.
+        self.assertEqual(data_h.tdata[0][0, 0], -5)
+        self.assertEqual(data_h.tdata[2][0, 0], self.z[-1, 0])
+
+    def test_clipping_is_lazy(self):
+        data_h = data_handler_factory(self.x, self.y, self.z)
+        self.assertEqual(self.z[0, 0], 1e30)
+        self.assertEqual(data_h.get_extent_of_data_dim(2), [1, 43])
+        z = data_h.get_plot_data(2)
+        self.assertEqual(z.count(), self.z.size - 1)
+        self.assertIs(data_h.get_plot_data(0), data_h.tdata[0])
+
+    def test_1D_data_is_reversed_together(self):
+        data_h = data_handler_factory(self.x[:, 0], self.z[:, 1])
+        self.assertEqual(list(data_h.tdata[0]), list(self.x[::-1, 0]))
+        self.assertEqual(list(data_h.tdata[1]), list(self.z[::-1, 1]))
+
+    def test_decreasing_x_is_plotted_increasing(self):
+        x = self.x[:, 0]
+        y = self.z[:, 1]
+        data_h = data_handler_factory(x, y)
+        plot_x, plot_y = data_h.get_plot_data(0), data_h.get_plot_data(1)
+        self.assertTrue(np.all(np.diff(plot_x) > 0))
+        self.assertEqual(sorted(zip(plot_x, plot_y)), sorted(zip(x, y)))
+        self.assertEqual(data_h.get_x_order(), 1)
+        x_dec, y_dec = data_h.get_decimated([-5, 5], 100)
+        np.testing.assert_array_equal(x_dec, x[::-1])
+        np.testing.assert_array_equal(y_dec, y[::-1])
+
+    def test_nonlinear_decreasing_x_is_not_reversed(self):
+        x = np.array([5.0, 4.0, 1.0, 0.5, 0.0])
+        y = np.arange(5.0)
+        data_h = data_handler_factory(x, y)
+        self.assertFalse(data_h.data_is_linear[0])
+        np.testing.assert_array_equal(data_h.tdata[0], x)
+        np.testing.assert_array_equal(data_h.tdata[1], y)
+
+
 if __name__=='__main__':
     unittest.main()
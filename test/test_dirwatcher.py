@@ -0,0 +1,105 @@
+import sys
+sys.path.append('..')
+import os
+import time
+import shutil
+import tempfile
+import unittest
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+from PyQt5 import QtCore
+from dirwatcher import DirWatcher, is_in_dir
+
+
+app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+
+def wait_for(condition, timeout=10):
+    t_start = time.monotonic()
+    while not condition() and time.monotonic() - t_start < timeout:
+        app.processEvents()
+        time.sleep(0.01)
+    return condition()
+
+
+def process_events(duration):
+    wait_for(lambda: False, duration)
+
+
+class DirWatcherTestCase(unittest.TestCase):
+    poll_interval = 50
+    delay = 300
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sub_dir = os.path.join(self.tmp_dir, 'sub')
+        sweep_path = os.path.join(self.sub_dir, '2016-09-01#006')
+        shutil.copytree('../data/2016-09-01#006', sweep_path)
+        self.watcher = DirWatcher(self.tmp_dir, mode='poll',
+                                  poll_interval=self.poll_interval,
+                                  delay=self.delay)
+        self.watcher.set_sweep_paths([sweep_path])
+        self.emitted = []
+        self.watcher.dirs_changed.connect(self.emitted.append)
+
+    def tearDown(self):
+        self.watcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def make_sweep(self, name):
+        path = os.path.join(self.sub_dir, name)
+        os.makedirs(path)
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            f.write('{}')
+        return path
+
+    def test_new_sweep_is_reported(self):
+        self.assertIn(self.sub_dir, self.watcher.get_watched_dirs())
+        new_path = self.make_sweep('2016-09-01#100')
+        self.assertTrue(wait_for(lambda: self.emitted))
+        self.assertEqual(self.emitted, [[self.sub_dir]])
+        # The new directory is watched until it is known as a sweep.
+        self.assertIn(new_path, self.watcher.get_watched_dirs())
+        self.watcher.set_sweep_paths(
+            list(self.watcher.sweep_paths) + [new_path])
+        self.assertNotIn(new_path, self.watcher.get_watched_dirs())
+
+    def test_burst_is_debounced(self):
+        # Every change is seen by a poll, but they are closer together than
+        # delay.
+        for i in range(5):
+            self.make_sweep('2016-09-01#10{}'.format(i))
+            process_events(2 * self.poll_interval / 1000)
+        self.assertEqual(self.emitted, [])
+        process_events(3 * self.delay / 1000)
+        self.assertEqual(self.emitted, [[self.sub_dir]])
+
+    def test_meta_json_in_new_directory_is_reported(self):
+        new_path = os.path.join(self.sub_dir, '2016-09-01#100')
+        os.makedirs(new_path)
+        self.assertTrue(wait_for(lambda: self.emitted))
+        # The rescan finds no sweep yet, so the directory stays watched.
+        self.watcher.set_sweep_paths(self.watcher.sweep_paths)
+        self.assertIn(new_path, self.watcher.get_watched_dirs())
+        self.emitted.clear()
+        with open(os.path.join(new_path, 'meta.json'), 'w') as f:
+            f.write('{}')
+        self.assertTrue(wait_for(lambda: self.emitted))
+        self.assertEqual(self.emitted, [[new_path]])
+
+    def test_sibling_directory_is_not_watched(self):
+        sibling_dir = self.tmp_dir + '2'
+        sweep_path = os.path.join(sibling_dir, '2016-09-01#006')
+        self.watcher.set_sweep_paths(
+            list(self.watcher.sweep_paths) + [sweep_path])
+        self.assertNotIn(sibling_dir, self.watcher.get_watched_dirs())
+
+    def test_is_in_dir(self):
+        self.assertTrue(is_in_dir('/data', '/data'))
+        self.assertTrue(is_in_dir('/data/sub/', '/data'))
+        self.assertTrue(is_in_dir('/data/sub', '/'))
+        self.assertFalse(is_in_dir('/data2', '/data'))
+        self.assertFalse(is_in_dir('/data', '/data/sub'))
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import sys
+sys.path.append('..')
+import unittest
+from PyQt5 import QtCore
+from filelistwidget import FileListModel
+
+
+class FileListModelTestCase(unittest.TestCase):
+    def setUp(self):
+        names = ['2016-09-01#{:03d} sweep'.format(i) for i in range(25)]
+        self.model = FileListModel(names, fetch_size=10)
+
+    def get_names(self):
+        return [self.model.get_name(i) for i in range(self.model.rowCount())]
+
+    def test_descending_order(self):
+        names = self.get_names()
+        self.assertEqual(names, sorted(names, reverse=True))
+        self.assertEqual(names[0], '2016-09-01#024 sweep')
+
+    def test_fetch_more(self):
+        self.assertEqual(self.model.rowCount(), 10)
+        while self.model.canFetchMore():
+            self.model.fetchMore()
+        self.assertEqual(self.model.rowCount(), 25)
+
+    def test_add_and_remove(self):
+        self.model.add_names(['2016-09-02#000 new', '2016-09-01#024 sweep'])
+        self.assertEqual(self.model.rowCount(), 11)
+        self.assertEqual(self.model.get_name(0), '2016-09-02#000 new')
+        # Rows which have not been fetched do not change rowCount.
+        self.model.add_names(['2016-08-01#000 old'])
+        self.model.remove_names(['2016-09-01#000 sweep', 'missing'])
+        self.assertEqual(self.model.rowCount(), 11)
+        self.model.remove_names(['2016-09-02#000 new'])
+        self.assertEqual(self.model.rowCount(), 10)
+        self.assertEqual(len(self.model.keys), 25)
+        self.assertEqual(self.model.keys[0], '2016-08-01#000 old')
+
+    def test_add_many_names(self):
+        new_names = ['2016-08-01#{:03d} old'.format(i) for i in range(30)]
+        new_names += ['2016-09-01#{:03d}b new'.format(i)
+                      for i in range(0, 25, 2)]
+        new_names += ['2016-09-02#{:03d} new'.format(i) for i in range(15)]
+        expected = sorted(set(self.model.keys + new_names), reverse=True)
+        n_rows = self.model.rowCount()
+        self.model.add_names(new_names)
+        self.assertEqual(self.model.keys, sorted(expected))
+        self.assertEqual(self.get_names(), expected[:self.model.rowCount()])
+        # All new names above the last fetched row are shown.
+        self.assertEqual(self.model.rowCount(), n_rows + 15 + 5)
+        while self.model.canFetchMore():
+            self.model.fetchMore()
+        self.assertEqual(self.get_names(), expected)
+
+    def test_selection_survives_add_names(self):
+        selection = QtCore.QItemSelectionModel(self.model)
+        name = self.model.get_name(3)
+        selection.setCurrentIndex(self.model.index(3),
+                                  QtCore.QItemSelectionModel.SelectCurrent)
+        new_names = ['2016-09-02#{:03d} new'.format(i) for i in range(50)]
+        new_names += ['2016-09-01#{:03d}b new'.format(i) for i in range(25)]
+        self.model.add_names(new_names)
+        current = selection.currentIndex()
+        self.assertTrue(current.isValid())
+        self.assertEqual(self.model.get_name(current.row()), name)
+        self.assertEqual([self.model.get_name(index.row())
+                          for index in selection.selectedIndexes()], [name])
+
+
+if __name__=='__main__':
+    unittest.main()
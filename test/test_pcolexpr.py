@@ -0,0 +1,72 @@
+import sys
+sys.path.append('..')
+import os
+import unittest
+import numpy as np
+from pcolexpr import Expression
+from pseudodata import PseudoData
+import executors
+
+
+class FakeSweep(object):
+    def __init__(self, data):
+        self.data = data
+        self.meta = {}
+
+
+class ExpressionTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.data = {'curr': rng.rand(1000, 7) - 0.5,
+                     'bias': rng.rand(1000, 7) + 1}
+
+    def test_chunked_evaluation(self):
+        expr = Expression('sign(curr) * sqrt(abs(curr)) / bias / scale',
+                          {'scale': 2.0, 'unused': 3}, chunk_size=100,
+                          use_numexpr=False)
+        self.assertEqual(expr.names, ['bias', 'curr'])
+        self.assertEqual(expr.constants, {'scale': 2.0})
+        curr = self.data['curr']
+        bias = self.data['bias']
+        expected = np.sign(curr) * np.sqrt(np.abs(curr)) / bias / 2
+        self.assertTrue(np.allclose(expr(self.data, {}, {}), expected))
+
+    def test_chunks_of_task_on_shared_executor(self):
+        # A pseudocolumn calculated on the compute executor must not wait for
+        # its chunks, which would be queued behind it.
+        executors.set_max_workers('compute', 1)
+        try:
+            expr = Expression('curr / bias', chunk_size=100,
+                              use_numexpr=False)
+            future = executors.get_executor().submit(expr, self.data, {}, {})
+            result = future.result(timeout=10)
+        finally:
+            executors.set_max_workers('compute', os.cpu_count())
+        self.assertTrue(np.allclose(result,
+                                    self.data['curr'] / self.data['bias']))
+
+    def test_invalid_expressions(self):
+        for expr_str in ('curr.T', 'open("x")', '"text"', 'curr[0]',
+                         'curr if bias else 0'):
+            with self.assertRaises(ValueError):
+                Expression(expr_str)
+
+    def test_pseudocolumns(self):
+        name_func_dict = {
+            'conductance': {'func': Expression('curr / bias')},
+            'log_conductance': {'func': Expression('log10(abs(conductance))')},
+            'a': {'func': Expression('b + 1')},
+            'b': {'func': Expression('a + 1')},
+        }
+        pdata = PseudoData(name_func_dict, FakeSweep(self.data))
+        expected = np.log10(np.abs(self.data['curr'] / self.data['bias']))
+        self.assertTrue(np.allclose(pdata['log_conductance'], expected))
+        self.assertEqual(pdata.deps['conductance']['data'], {'curr', 'bias'})
+        self.assertEqual(pdata.deps['log_conductance']['pdata'],
+                         {'conductance'})
+        with self.assertRaises(ValueError):
+            pdata['a']
+
+
+if __name__=='__main__':
+    unittest.main()
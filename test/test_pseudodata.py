@@ -0,0 +1,284 @@
+import sys
+sys.path.append('..')
+import os
+import shutil
+import tempfile
+import threading
+import time
+import collections
+import textwrap
+import unittest
+import importlib.util
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from sweep import Sweep
+from pseudodata import add_fingerprints
+from pcolcache import PcolCache
+
+
+pcols_template = textwrap.dedent('''
+    scale = {scale}
+
+    def double(x):
+        return 2 * x
+
+    def current(data, pdata, meta):
+        return data['lockin_curr'] * scale
+
+    def conductance(data, pdata, meta):
+        return {conductance_expr}
+
+    def log_conductance(data, pdata, meta):
+        return pdata['conductance'] + 1
+
+    def voltage(data, pdata, meta):
+        return double(data['dac'])
+
+    name_func_dict = {{
+        'current': {{'func': current, 'label': 'I'}},
+        'conductance': {{'func': conductance, 'label': 'G'}},
+        'log_conductance': {{'func': log_conductance, 'label': 'log G'}},
+        'voltage': {{'func': voltage, 'label': 'V'}},
+    }}
+''')
+
+
+def load_sweep(path, use_cache=False):
+    sweep = Sweep(path, use_cache=False)
+    data_names = sweep.data.dtype.names
+    sweep.data = {'lockin_curr': sweep.data[data_names[1]],
+                  'dac': sweep.data[data_names[0]]}
+    sweep.use_cache = use_cache
+    return sweep
+
+
+def load_pcols(path, scale=1, conductance_expr="pdata['current'] / 0.1"):
+    with open(path, 'w') as f:
+        f.write(pcols_template.format(scale=scale,
+                                      conductance_expr=conductance_expr))
+    spec = importlib.util.spec_from_file_location('', path)
+    pcols = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(pcols)
+    add_fingerprints(pcols.name_func_dict)
+    return pcols.name_func_dict
+
+
+all_names = ['conductance', 'current', 'log_conductance', 'voltage']
+
+
+class PseudoDataTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.pcols_path = os.path.join(self.tmp_dir, 'test_pcols.py')
+        self.sweep = load_sweep('../data/2016-09-01#006')
+        self.sweep.set_pdata(load_pcols(self.pcols_path))
+        for name in all_names:
+            self.sweep.pdata[name]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_graph(self):
+        graph = self.sweep.pdata.get_graph()
+        self.assertEqual(graph['current']['data'], ['lockin_curr'])
+        self.assertEqual(graph['conductance']['pdata'], ['current'])
+        self.assertEqual(graph['log_conductance']['pdata'], ['conductance'])
+        self.assertEqual(graph['log_conductance']['data'], [])
+        times = graph['log_conductance']
+        self.assertGreaterEqual(times['total_time'], times['self_time'])
+        text = self.sweep.pdata.format_graph('log_conductance')
+        self.assertIn('        current', text)
+
+    def test_unchanged_functions_are_kept(self):
+        invalid = self.sweep.set_pdata(load_pcols(self.pcols_path))
+        self.assertEqual(invalid, set())
+        self.assertEqual(sorted(self.sweep.pdata), all_names)
+
+    def test_changed_function_and_dependents_are_invalidated(self):
+        name_func_dict = load_pcols(
+            self.pcols_path, conductance_expr="pdata['current'] / 0.2")
+        invalid = self.sweep.set_pdata(name_func_dict)
+        self.assertEqual(invalid, {'conductance', 'log_conductance'})
+        self.assertEqual(sorted(self.sweep.pdata), ['current', 'voltage'])
+        current = self.sweep.pdata['current']
+        log_conductance = self.sweep.pdata['log_conductance']
+        self.assertTrue(np.allclose((log_conductance - 1) * 0.2, current))
+
+    def test_changed_constant_is_detected(self):
+        invalid = self.sweep.set_pdata(load_pcols(self.pcols_path, scale=2))
+        self.assertEqual(invalid, {'current', 'conductance',
+                                   'log_conductance'})
+
+    def test_errors_and_hits(self):
+        name_func_dict = dict(self.sweep.name_func_dict)
+        name_func_dict['broken'] = {'func': lambda data, pdata, meta: 1 / 0}
+        self.sweep.set_pdata(name_func_dict)
+        with self.assertRaises(ZeroDivisionError):
+            self.sweep.pdata['broken']
+        self.sweep.pdata['current']
+        graph = self.sweep.pdata.get_graph()
+        self.assertIn('ZeroDivisionError', graph['broken']['error'])
+        self.assertIsNone(graph['current']['error'])
+        # current was read once by conductance and once above.
+        self.assertEqual(graph['current']['hits'], 2)
+        self.assertEqual(graph['current']['nbytes'],
+                         self.sweep.pdata['current'].nbytes)
+
+    def test_refresh_clears_all(self):
+        self.sweep.set_pdata(self.sweep.name_func_dict)
+        self.assertEqual(len(self.sweep.pdata), 0)
+
+
+class PcolCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.pcols_path = os.path.join(self.tmp_dir, 'test_pcols.py')
+        self.sweep_path = os.path.join(self.tmp_dir, '2016-09-01#006')
+        shutil.copytree('../data/2016-09-01#006', self.sweep_path)
+        self.sweep = self.open_sweep()
+        for name in all_names:
+            self.sweep.pdata[name]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def open_sweep(self, **kwargs):
+        sweep = load_sweep(self.sweep_path, use_cache=True)
+        sweep.set_pdata(load_pcols(self.pcols_path, **kwargs))
+        self.assertIsInstance(sweep.pdata.cache, PcolCache)
+        sweep.pdata.cache.min_time = 0
+        return sweep
+
+    def test_reopened_sweep_reads_cache(self):
+        sweep = self.open_sweep()
+        log_conductance = sweep.pdata['log_conductance']
+        self.assertEqual(list(sweep.pdata.from_cache), ['log_conductance'])
+        self.assertTrue(np.array_equal(log_conductance,
+                                       self.sweep.pdata['log_conductance']))
+        self.assertEqual(sweep.pdata.get_dependents(['current']),
+                         {'log_conductance'})
+
+    def test_changed_function_invalidates_cache(self):
+        sweep = self.open_sweep(conductance_expr="pdata['current'] / 0.2")
+        sweep.pdata['log_conductance']
+        self.assertEqual(list(sweep.pdata.from_cache), ['current'])
+
+    def test_changed_data_invalidates_cache(self):
+        with open(os.path.join(self.sweep_path, 'data.dat'), 'a') as f:
+            f.write('\n')
+        sweep = self.open_sweep()
+        sweep.pdata['log_conductance']
+        self.assertEqual(sweep.pdata.from_cache, {})
+
+
+class ConcurrencyTestCase(unittest.TestCase):
+    def setUp(self):
+        self.calls = collections.Counter()
+        self.slow_started = threading.Event()
+        self.release_slow = threading.Event()
+        def base(data, pdata, meta):
+            self.calls['base'] += 1
+            time.sleep(0.05)
+            return data['lockin_curr'] * 2
+        def side(data, pdata, meta, sign):
+            self.calls['side'] += 1
+            return sign * pdata['base']
+        def slow(data, pdata, meta):
+            self.slow_started.set()
+            self.release_slow.wait(5)
+            return data['dac']
+        def fast(data, pdata, meta):
+            return data['dac'] + 1
+        name_func_dict = {
+            'base': {'func': base},
+            'left': {'func': partial(side, sign=-1)},
+            'right': {'func': partial(side, sign=1)},
+            'slow': {'func': slow},
+            'fast': {'func': fast},
+        }
+        self.sweep = load_sweep('../data/2016-09-01#006')
+        self.sweep.set_pdata(name_func_dict)
+
+    def tearDown(self):
+        self.release_slow.set()
+
+    def test_shared_dependency_is_calculated_once(self):
+        pdata = self.sweep.pdata
+        errors = pdata.compute(['left', 'right', 'dac', 'left'])
+        self.assertEqual(errors, {})
+        self.assertEqual(self.calls, {'base': 1, 'side': 2})
+        self.assertTrue(np.array_equal(pdata['left'], -pdata['right']))
+        self.assertEqual(pdata.get_graph()['left']['pdata'], ['base'])
+
+    def test_racing_requests_wait_for_the_same_calculation(self):
+        pdata = self.sweep.pdata
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            results = list(executor.map(pdata.__getitem__, ['base'] * 4))
+        self.assertEqual(self.calls['base'], 1)
+        for result in results:
+            self.assertIs(result, results[0])
+
+    def test_unrelated_pcol_is_not_blocked(self):
+        pdata = self.sweep.pdata
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(pdata.__getitem__, 'slow')
+            self.assertTrue(self.slow_started.wait(5))
+            pdata['fast']
+            self.assertFalse(future.done())
+            self.release_slow.set()
+            future.result()
+        self.assertIn('slow', pdata)
+
+
+class EvictionTestCase(unittest.TestCase):
+    def setUp(self):
+        def make_func(delay, offset):
+            def func(data, pdata, meta):
+                time.sleep(delay)
+                return data['dac'] + offset
+            return func
+        name_func_dict = {
+            'cheap': {'func': make_func(0, 1)},
+            'expensive': {'func': make_func(0.02, 2)},
+            'shown': {'func': make_func(0, 3)},
+            'new': {'func': make_func(0, 4)},
+        }
+        self.sweep = load_sweep('../data/2016-09-01#006')
+        self.col_nbytes = self.sweep.data['dac'].nbytes
+        self.sweep.pdata_max_bytes = 3 * self.col_nbytes
+        self.sweep.set_pdata(name_func_dict)
+
+    def test_cheap_columns_are_evicted_first(self):
+        pdata = self.sweep.pdata
+        pdata.pin(self, ['shown'])
+        pdata.compute(['shown', 'expensive', 'cheap'])
+        self.assertEqual(len(pdata), 3)
+        pdata['new']
+        self.assertEqual(set(pdata), {'shown', 'expensive', 'new'})
+        stats = pdata.get_memory_stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['evicted_bytes'], self.col_nbytes)
+        self.assertEqual(stats['nbytes'], 3 * self.col_nbytes)
+        graph = pdata.get_graph()
+        self.assertEqual(graph['cheap']['evictions'], 1)
+        self.assertEqual(graph['cheap']['nbytes'], 0)
+        # Evicted columns are calculated again.
+        self.assertTrue(np.array_equal(pdata['cheap'],
+                                       self.sweep.data['dac'] + 1))
+
+    def test_pinned_columns_are_kept(self):
+        pdata = self.sweep.pdata
+        pdata.max_bytes = 0
+        pdata.pin(self, ['shown'])
+        pdata['shown']
+        pdata['cheap']
+        self.assertEqual(set(pdata), {'shown', 'cheap'})
+        pdata['expensive']
+        self.assertEqual(set(pdata), {'shown', 'expensive'})
+        pdata.pin(self, ())
+        self.assertEqual(len(pdata), 0)
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import sys
+sys.path.append('..')
+import threading
+import unittest
+import numpy as np
+from pyramid import ImagePyramid, decimate
+from datahandler import data_handler_factory
+
+
+class ImagePyramidTestCase(unittest.TestCase):
+    def setUp(self):
+        self.z = np.arange(1000 * 600, dtype=float).reshape(600, 1000)
+        self.z[:2, :2] = np.nan
+        self.z[2, 2] = np.nan
+        self.pyramid = ImagePyramid(self.z, [0, 1000, 0, 600], min_size=100)
+        self.pyramid.build()
+
+    def test_levels_ignore_nan(self):
+        factors = [level['factor'] for level in self.pyramid.levels]
+        self.assertEqual(factors, [1, 2, 4, 8, 16])
+        level = self.pyramid.levels[1]
+        self.assertEqual(level['mean'].shape, (300, 500))
+        # The first block has only NaN.
+        self.assertTrue(np.isnan(level['mean'][0, 0]))
+        block = self.z[2:4, 2:4]
+        self.assertEqual(level['min'][1, 1], np.nanmin(block))
+        self.assertEqual(level['mean'][1, 1], np.nanmean(block))
+        self.assertEqual(level['max'][1, 1], np.nanmax(block))
+        # The mean of a coarser level is weighted by the finite values.
+        level = self.pyramid.levels[2]
+        self.assertAlmostEqual(level['mean'][0, 0],
+                               np.nanmean(self.z[:4, :4]))
+        self.assertEqual(level['max'][-1, -1], self.z[-1, -1])
+
+    def test_counts_use_small_integers(self):
+        z = np.ones((32, 32))
+        stats = {'min': z, 'mean': z, 'max': z}
+        counts = np.isfinite(z).view(np.uint8)
+        factor = 1
+        dtypes = []
+        while counts.shape[0] > 1:
+            stats, counts = decimate(stats, counts, factor**2)
+            factor *= 2
+            dtypes.append(counts.dtype)
+            self.assertTrue(np.all(counts == factor**2))
+        self.assertEqual(dtypes, [np.uint8] * 3 + [np.uint16] * 2)
+        self.assertEqual(stats['mean'][0, 0], 1)
+
+    def test_level_matches_view_and_canvas(self):
+        z, extent, factor = self.pyramid.get_level([0, 1000], [0, 600],
+                                                   (150, 250))
+        self.assertEqual(factor, 4)
+        self.assertEqual(z.shape, (150, 250))
+        self.assertEqual(extent, [0, 1000, 0, 600])
+        # Zooming in gives a finer level which covers the view.
+        z, extent, factor = self.pyramid.get_level([100, 200], [100, 200],
+                                                   (150, 250))
+        self.assertEqual(factor, 1)
+        self.assertLessEqual(extent[0], 100)
+        self.assertGreaterEqual(extent[1], 200)
+        self.assertLess(z.size, self.z.size)
+
+    def test_data_handler_builds_pyramid_in_background(self):
+        x, y = np.meshgrid(np.linspace(0, 1, 600), np.linspace(-1, 1, 1000))
+        data_h = data_handler_factory(x, y, self.z.T)
+        self.assertFalse(data_h.start_pyramid())
+        data_h.pyramid_min_points = 1000
+        done = threading.Event()
+        self.assertTrue(data_h.start_pyramid(done.set))
+        self.assertTrue(done.wait(10))
+        z, extent, factor = data_h.get_level([0, 1], [-1, 1], (100, 100))
+        self.assertGreater(factor, 1)
+        np.testing.assert_allclose(extent, [0, 1, -1, 1])
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import sys
+sys.path.append('..')
+import unittest
+import numpy as np
+from resampling import resample_to_raster, get_axis_profiles, \
+    get_line_indices
+from datahandler import data_handler_factory
+
+
+class ResamplingTestCase(unittest.TestCase):
+    def setUp(self):
+        # Log-spaced x varying along axis 1 and jittered y along axis 0.
+        rng = np.random.default_rng(0)
+        x_1D = np.logspace(0, 2, 30)
+        y_1D = np.linspace(-1, 1, 20)
+        self.x, self.y = np.meshgrid(x_1D, y_1D)
+        self.y = self.y + rng.uniform(-0.01, 0.01, self.y.shape)
+        self.z = np.arange(self.x.size, dtype=float).reshape(self.x.shape)
+
+    def test_profiles_of_non_uniform_grid(self):
+        axis_x, x_profile, axis_y, y_profile = get_axis_profiles(self.x,
+                                                                 self.y)
+        self.assertEqual((axis_x, axis_y), (1, 0))
+        np.testing.assert_allclose(x_profile, self.x[0])
+
+    def test_pixels_take_value_of_nearest_point(self):
+        xlim, ylim = [1, 100], [-1, 1]
+        raster, extent = resample_to_raster(self.x, self.y, self.z, xlim,
+                                            ylim, (40, 50))
+        self.assertEqual(raster.shape, (40, 50))
+        self.assertEqual(extent, [1, 100, -1, 1])
+        # Along x, the pixels take the values of the nearest columns.
+        centers = 1 + (np.arange(50) + 0.5) * 99 / 50
+        nearest = np.abs(self.x[0][:, np.newaxis] - centers).argmin(axis=0)
+        np.testing.assert_array_equal(raster[0], self.z[0, nearest])
+        self.assertEqual(raster[-1, -1], self.z[-1, -1])
+        self.assertFalse(np.isnan(raster).any())
+        # Every value in the raster comes from the data.
+        self.assertTrue(np.isin(raster, self.z).all())
+
+    def test_pixels_outside_data_are_nan(self):
+        raster, _ = resample_to_raster(self.x, self.y, self.z, [200, 300],
+                                       [-1, 1], (10, 10))
+        self.assertTrue(np.isnan(raster).all())
+
+    def test_scattered_points_are_binned(self):
+        rng = np.random.default_rng(1)
+        x = rng.uniform(0, 1, (100, 100))
+        y = rng.uniform(0, 1, (100, 100))
+        z = np.ones_like(x)
+        raster, _ = resample_to_raster(x, y, z, [0, 1], [0, 1], (10, 20))
+        self.assertEqual(raster.shape, (10, 20))
+        np.testing.assert_array_equal(raster, 1)
+
+    def test_data_handler_caches_rasters(self):
+        data_h = data_handler_factory(self.x, self.y, self.z)
+        self.assertFalse(data_h.imshow_eligible)
+        first = data_h.get_resampled([1, 100], [-1, 1], (40, 50))
+        self.assertIs(data_h.get_resampled([1, 100], [-1, 1], (40, 50)),
+                      first)
+
+
+class LineDecimationTestCase(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.x = np.cumsum(rng.uniform(0.5, 1.5, 100000))
+        self.y = np.sin(self.x / 1000) + rng.normal(0, 0.01, self.x.size)
+
+    def test_envelope_and_spikes_are_kept(self):
+        self.y[12345] = 50
+        self.y[54321] = -50
+        xlim = [self.x[0], self.x[-1]]
+        idx = get_line_indices(self.x, self.y, xlim, 100)
+        self.assertLessEqual(len(idx), 4 * 100 + 2)
+        self.assertIn(12345, idx)
+        self.assertIn(54321, idx)
+        # Every pixel has the same lowest and highest value as before.
+        edges = np.linspace(xlim[0], xlim[1], 101)
+        for i in range(0, 100, 7):
+            full = (self.x >= edges[i]) & (self.x < edges[i + 1])
+            kept = (self.x[idx] >= edges[i]) & (self.x[idx] < edges[i + 1])
+            self.assertEqual(self.y[full].min(), self.y[idx][kept].min())
+            self.assertEqual(self.y[full].max(), self.y[idx][kept].max())
+
+    def test_pixels_with_only_nan_leave_a_gap(self):
+        self.y[40000:50000] = np.nan
+        idx = get_line_indices(self.x, self.y, [self.x[0], self.x[-1]], 100)
+        self.assertTrue(np.isnan(self.y[idx]).any())
+
+    def test_few_points_per_pixel_are_kept(self):
+        idx = get_line_indices(self.x, self.y, [1000, 1100], 100)
+        self.assertIsInstance(idx, slice)
+        # The nearest points outside xlim are included.
+        self.assertLess(self.x[idx][0], 1000)
+        self.assertGreater(self.x[idx][-1], 1100)
+
+    def test_data_handler_decimates_decreasing_x(self):
+        data_h = data_handler_factory(self.x[::-1], self.y[::-1])
+        self.assertEqual(data_h.get_x_order(), -1)
+        x, y = data_h.get_decimated([self.x[0], self.x[-1]], 100)
+        self.assertLess(len(x), 500)
+        self.assertEqual(y.max(), self.y.max())
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,253 @@
+import sys
+sys.path.append('..')
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from sweep import Sweep
+from columncache import ColumnCache, warm_cache
+from datparser import parse_dat_file
+
+
+class ColumnCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sweep_path = os.path.join(self.tmp_dir, '2016-09-26#001')
+        shutil.copytree('../data/2016-09-26#001', self.sweep_path)
+        self.cache_dir = os.path.join(self.tmp_dir, 'cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def load(self):
+        return Sweep.load_dir(self.sweep_path, cache_dir=self.cache_dir)
+
+    def test_cache_is_written(self):
+        cache = ColumnCache(self.sweep_path, self.cache_dir)
+        self.assertFalse(cache.is_valid())
+        self.load()
+        self.assertTrue(cache.is_valid())
+
+    def test_cached_data_equals_text_data(self):
+        text_data, _ = Sweep.load_dir(self.sweep_path, use_cache=False)
+        self.load()
+        cached_data, _ = self.load()
+        self.assertEqual(text_data.dtype.names, cached_data.dtype.names)
+        for name in text_data.dtype.names:
+            np.testing.assert_array_equal(text_data[name], cached_data[name])
+
+    def test_stale_cache_is_not_used(self):
+        data, _ = self.load()
+        dat_path = os.path.join(self.sweep_path, 'data.dat')
+        with open(dat_path) as f:
+            first_line = f.readline()
+        with open(dat_path, 'a') as f:
+            f.write(first_line)
+        cache = ColumnCache(self.sweep_path, self.cache_dir)
+        self.assertFalse(cache.is_valid())
+        new_data, _ = self.load()
+        self.assertEqual(len(new_data), len(data) + 1)
+
+    def test_open_sweep_survives_new_cache(self):
+        text_data, _ = Sweep.load_dir(self.sweep_path, use_cache=False)
+        self.load()
+        # Mapped from the first cache.
+        data, _ = self.load()
+        names = data.dtype.names
+        old_values = {name: np.array(data[name]) for name in names[:2]}
+        dat_path = os.path.join(self.sweep_path, 'data.dat')
+        with open(dat_path) as f:
+            lines = f.readlines()
+        with open(dat_path, 'w') as f:
+            f.writelines(lines[:len(lines) // 2])
+        counts = warm_cache(self.tmp_dir, cache_dir=self.cache_dir)
+        self.assertEqual(counts['cached'], 1)
+        # Columns mapped before, and a column first read now, both come from
+        # the cache which was valid when the sweep was loaded.
+        for name, values in old_values.items():
+            np.testing.assert_array_equal(data[name], values)
+        np.testing.assert_array_equal(data[names[-1]],
+                                      text_data[names[-1]])
+
+    def test_generations(self):
+        cache = ColumnCache(self.sweep_path, self.cache_dir)
+        data, _ = Sweep.load_dir(self.sweep_path, use_cache=False)
+        signature = cache.get_signature(self.sweep_path)
+        self.assertTrue(cache.write(data, signature))
+        first = cache.read_index()['generation']
+        # On Windows memory-mapped files can be neither replaced nor removed.
+        with mock.patch('columncache.shutil.rmtree'):
+            self.assertTrue(cache.write(data, signature))
+        second = cache.read_index()['generation']
+        self.assertNotEqual(first, second)
+        self.assertTrue(os.path.isdir(os.path.join(cache.path, first)))
+        columns = [{'name': name} for name in data.dtype.names]
+        self.assertIsNotNone(cache.read(columns))
+        # The old generation is removed by the next write.
+        self.assertTrue(cache.write(data, signature))
+        generations = [name for name in os.listdir(cache.path)
+                       if name.startswith(cache.generation_prefix)]
+        self.assertEqual(generations, [cache.read_index()['generation']])
+
+    def test_warm_cache(self):
+        counts = warm_cache(self.tmp_dir, cache_dir=self.cache_dir)
+        self.assertEqual(counts['cached'], 1)
+        counts = warm_cache(self.tmp_dir, cache_dir=self.cache_dir)
+        self.assertEqual(counts['up_to_date'], 1)
+
+
+class LazyColumnsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sweep_path = '../data/2016-09-26#001'
+        # Load twice so the second sweep is memory-mapped from the cache.
+        Sweep(self.sweep_path, cache_dir=self.tmp_dir)
+        self.sweep = Sweep(self.sweep_path, cache_dir=self.tmp_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_columns_are_loaded_on_demand(self):
+        self.assertEqual(self.sweep.data.get_loaded_names(), [])
+        self.sweep.data['time']
+        self.assertEqual(self.sweep.data.get_loaded_names(), ['time'])
+
+    def test_reshaped_columns_equal_text_data(self):
+        text_data, _ = Sweep.load_dir(self.sweep_path, use_cache=False)
+        c1 = text_data.dtype.names[0]
+        reshaped = Sweep.reshape2d(text_data[c1], text_data)
+        self.assertEqual(self.sweep.data.dtype.names, text_data.dtype.names)
+        self.assertEqual(self.sweep.data.shape, reshaped.shape)
+        for name in text_data.dtype.names:
+            np.testing.assert_array_equal(self.sweep.data[name],
+                                          reshaped[name])
+
+    def test_missing_column_raises_value_error(self):
+        with self.assertRaises(ValueError):
+            self.sweep.data['not a column']
+
+
+class TextParserTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_pandas_and_no_pandas_are_identical(self):
+        for sweep_dir in ('2016-09-26#001', '2016-09-01#006'):
+            path = os.path.join('../data', sweep_dir)
+            data_p, meta = Sweep.load_dir(path, use_pandas=True,
+                                          use_cache=False)
+            data_np, _ = Sweep.load_dir(path, use_pandas=False,
+                                        use_cache=False)
+            self.assertEqual(data_p.dtype.names, data_np.dtype.names)
+            for name in data_p.dtype.names:
+                np.testing.assert_array_equal(data_p[name], data_np[name])
+
+    def test_trailing_tabs_and_blank_lines(self):
+        dat_path = os.path.join(self.tmp_dir, 'data.dat')
+        with open(dat_path, 'w') as f:
+            f.write('1\t2.5\t\n\n3\tNaN\t\n4\t5')
+        values, end_offset = parse_dat_file(dat_path, 2)
+        np.testing.assert_array_equal(values, [[1, 2.5], [3, np.nan], [4, 5]])
+        self.assertEqual(end_offset, os.path.getsize(dat_path))
+        values, end_offset = parse_dat_file(dat_path, 2,
+                                            complete_lines_only=True)
+        self.assertEqual(values.shape, (2, 2))
+        self.assertEqual(end_offset, os.path.getsize(dat_path) - 3)
+
+    def test_wrong_number_of_columns(self):
+        dat_path = os.path.join(self.tmp_dir, 'data.dat')
+        with open(dat_path, 'w') as f:
+            f.write('1\t2\t3\n')
+        with self.assertRaises(ValueError):
+            parse_dat_file(dat_path, 2)
+
+
+class RefreshTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sweep_path = os.path.join(self.tmp_dir, '2016-09-26#001')
+        shutil.copytree('../data/2016-09-26#001', self.sweep_path)
+        self.dat_path = os.path.join(self.sweep_path, 'data.dat')
+        with open(self.dat_path) as f:
+            self.lines = f.readlines()
+        # 151 points per trace. Start with two and a half traces.
+        self.write_lines(self.lines[:377], mode='w')
+        self.sweep = Sweep(self.sweep_path, use_cache=False)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def write_lines(self, lines, mode='a'):
+        with open(self.dat_path, mode) as f:
+            f.writelines(lines)
+
+    def test_partial_trace_is_padded(self):
+        self.assertEqual(self.sweep.data.shape, (151, 2))
+        self.assertEqual(self.sweep.refresh(), 0)
+        self.assertEqual(self.sweep.data.shape, (151, 3))
+        time = self.sweep.data['time']
+        self.assertFalse(np.isnan(time[:75, 2]).any())
+        self.assertTrue(np.isnan(time[75:, 2]).all())
+        sL = self.sweep.data['sL_phys']
+        np.testing.assert_array_equal(sL[:, 2], sL[:, 0])
+
+    def test_only_complete_lines_are_appended(self):
+        self.sweep.refresh()
+        partial_line = self.lines[500][:10]
+        self.write_lines(self.lines[377:500] + [partial_line])
+        self.assertEqual(self.sweep.refresh(), 123)
+        self.assertEqual(self.sweep.data.shape, (151, 4))
+        self.write_lines([self.lines[500][10:]])
+        self.assertEqual(self.sweep.refresh(), 1)
+        self.assertEqual(self.sweep.refresh(), 0)
+        full_data, _ = Sweep.load_dir(self.sweep_path, use_cache=False)
+        np.testing.assert_array_equal(
+            self.sweep.data['time'].T.ravel()[:501], full_data['time'])
+
+    def test_first_trace_of_repeat_job(self):
+        # The inner sweep is replaced by a Repeat job, which has repeats but
+        # no points.
+        meta_path = os.path.join(self.sweep_path, 'meta.json')
+        with open(meta_path) as f:
+            meta = json.load(f)
+        inputs_job = meta['job']['job']['job']
+        meta['job']['job'] = {'type': 'Repeat', 'repeats': 151,
+                              'job': inputs_job}
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+        sweep = Sweep(self.sweep_path, use_cache=False)
+        # Measurement restarted, so refresh starts over in the first trace.
+        self.write_lines(self.lines[:75], mode='w')
+        sweep.refresh()
+        self.assertEqual(sweep.data.shape, (151, 1))
+        time = sweep.data['time']
+        self.assertFalse(np.isnan(time[:75, 0]).any())
+        self.assertTrue(np.isnan(time[75:, 0]).all())
+
+    def test_first_trace_of_job_without_length(self):
+        meta_path = os.path.join(self.sweep_path, 'meta.json')
+        with open(meta_path) as f:
+            meta = json.load(f)
+        inputs_job = meta['job']['job']['job']
+        meta['job']['job'] = {'type': 'Forever', 'job': inputs_job}
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f)
+        sweep = Sweep(self.sweep_path, use_cache=False)
+        self.write_lines(self.lines[:75], mode='w')
+        sweep.refresh()
+        self.assertEqual(sweep.data.shape, (75, 1))
+        self.assertFalse(np.isnan(sweep.data['time']).any())
+        # The trace length is known once the second trace has started.
+        self.write_lines(self.lines[75:200])
+        sweep.refresh()
+        self.assertEqual(sweep.data.shape, (151, 2))
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import sys
+sys.path.append('..')
+import os
+import shutil
+import tempfile
+import unittest
+from sweep import Sweep
+from sweepcache import SweepCache
+
+
+class SweepCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.paths = []
+        for sweep_dir in ('2016-09-01#006', '2016-09-01#008', '2016-10-20#003'):
+            path = os.path.join(self.tmp_dir, sweep_dir)
+            shutil.copytree(os.path.join('../data', sweep_dir), path)
+            self.paths.append(path)
+        self.sweeps = [Sweep(path, use_cache=False) for path in self.paths]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_hit_and_miss(self):
+        cache = SweepCache()
+        self.assertIsNone(cache.get(self.paths[0]))
+        cache.put(self.sweeps[0])
+        self.assertIs(cache.get(self.paths[0]), self.sweeps[0])
+        stats = cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['nbytes'], self.sweeps[0].get_nbytes())
+
+    def test_least_recently_used_is_evicted(self):
+        max_bytes = self.sweeps[0].get_nbytes() + self.sweeps[2].get_nbytes()
+        cache = SweepCache(max_bytes=max_bytes)
+        cache.put(self.sweeps[0])
+        cache.put(self.sweeps[1])
+        cache.get(self.paths[0])
+        cache.put(self.sweeps[2])
+        self.assertIn(self.paths[0], cache)
+        self.assertNotIn(self.paths[1], cache)
+        self.assertEqual(cache.evictions, 1)
+        self.assertLessEqual(cache.get_nbytes(), max_bytes)
+
+    def test_modified_sweep_is_not_returned(self):
+        cache = SweepCache()
+        cache.put(self.sweeps[0])
+        dat_path = os.path.join(self.paths[0], 'data.dat')
+        with open(dat_path, 'a') as f:
+            f.write('\n')
+        self.assertIsNone(cache.get(self.paths[0]))
+
+
+if __name__=='__main__':
+    unittest.main()
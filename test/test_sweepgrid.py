@@ -0,0 +1,63 @@
+import sys
+sys.path.append('..')
+import unittest
+from unittest import mock
+import numpy as np
+from sweep import Sweep
+from sweepgrid import SweepGrid
+from datahandler import DataHandler, data_handler_factory
+
+
+class SweepGridTestCase(unittest.TestCase):
+    def test_sweep_jobs(self):
+        sweep = Sweep('../data/2016-09-26#001')
+        grid = sweep.get_grid()
+        self.assertEqual(grid.shape, (151, 171))
+        self.assertEqual(grid.get_axis('mL'), 1)
+        self.assertEqual(grid.get_axis('sL_phys'), 0)
+        self.assertIsNone(grid.get_axis('time'))
+        self.assertIs(sweep.get_grid(), grid)
+
+    def test_line_job(self):
+        grid = Sweep('../data/2016-08-31#003').get_grid()
+        self.assertEqual(grid.get_axis('source'), 1)
+        self.assertEqual(grid.get_axis('gL'), 0)
+        self.assertEqual(grid.get_axis('gR'), 0)
+
+    def test_incomplete_1d_sweep(self):
+        sweep = Sweep('../data/2016-09-01#006')
+        self.assertLess(len(sweep.data['backgate']),
+                        sweep.meta['job']['points'])
+        self.assertEqual(sweep.get_grid().get_axis('backgate'), 0)
+
+    def test_verify_drops_channels_not_recorded_as_described(self):
+        sweep = Sweep('../data/2016-09-26#001')
+        data = {'mL': np.array(sweep.data['mL']),
+                'sL_phys': np.array(sweep.data['sL_phys'])}
+        data['sL_phys'][-1, -1] *= 2
+        grid = SweepGrid(sweep.meta, data['mL'].shape)
+        grid.verify(data)
+        self.assertEqual(list(grid.channels), ['mL'])
+
+    def test_data_handler_uses_grid(self):
+        sweep = Sweep('../data/2016-09-26#001')
+        names = ['sL_phys', 'mL', 'lockin_curr_left/R']
+        cols = [sweep.data[name] for name in names]
+        lin_axes = [sweep.get_grid().get_axis(name) for name in names]
+        expected = data_handler_factory(*cols)
+        with mock.patch.object(DataHandler, 'is_linear_on_axis',
+                               wraps=expected.is_linear_on_axis) as scan:
+            data_h = data_handler_factory(*cols, lin_axes=lin_axes)
+        # Only the column which is not swept is searched.
+        self.assertEqual(scan.call_count, 1)
+        self.assertTrue(data_h.imshow_eligible)
+        self.assertEqual(data_h.lin_axis_for_data,
+                         expected.lin_axis_for_data)
+        for i in range(3):
+            np.testing.assert_array_equal(data_h.tdata[i], expected.tdata[i])
+            self.assertEqual(data_h.get_extent_of_data_dim(i),
+                             expected.get_extent_of_data_dim(i))
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,144 @@
+import sys
+sys.path.append('..')
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+from sweep import Sweep
+from sweepindex import SweepIndex
+
+
+class CountingSweepIndex(SweepIndex):
+    n_parsed = 0
+
+    @classmethod
+    def make_entry(cls, sweep_path, dir_mtime, *args):
+        cls.n_parsed += 1
+        return super().make_entry(sweep_path, dir_mtime, *args)
+
+
+class SweepIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.tmp_dir, 'data')
+        for sweep_dir in ('2016-09-01#006', '2016-09-01#008'):
+            shutil.copytree(os.path.join('../data', sweep_dir),
+                            os.path.join(self.data_dir, 'sub', sweep_dir))
+        self.db_path = os.path.join(self.tmp_dir, 'index.sqlite')
+        CountingSweepIndex.n_parsed = 0
+        self.index = CountingSweepIndex(self.data_dir, self.db_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_scan(self):
+        entries = self.index.rescan()
+        self.assertEqual(len(entries), 2)
+        path = os.path.join(self.index.dir_path, 'sub', '2016-09-01#006')
+        self.assertEqual(entries[path]['name'], 'BG[-11,-9] gate sweep')
+        self.assertEqual(entries[path]['time_stamp'], '2016-09-01#006')
+        self.assertEqual(entries[path]['dimension'], 1)
+
+    def test_index_is_persistent(self):
+        self.index.rescan()
+        new_index = SweepIndex(self.data_dir, self.db_path)
+        self.assertEqual(new_index.get_entries(), self.index.get_entries())
+
+    def test_unchanged_directories_are_not_parsed(self):
+        self.index.rescan()
+        self.assertEqual(CountingSweepIndex.n_parsed, 2)
+        self.index.rescan()
+        self.assertEqual(CountingSweepIndex.n_parsed, 2)
+
+    def test_added_and_removed_sweeps(self):
+        self.index.rescan()
+        shutil.copytree('../data/2016-10-20#003',
+                        os.path.join(self.data_dir, '2016-10-20#003'))
+        shutil.rmtree(os.path.join(self.data_dir, 'sub', '2016-09-01#006'))
+        entries = self.index.rescan()
+        self.assertEqual(CountingSweepIndex.n_parsed, 3)
+        time_stamps = sorted(e['time_stamp'] for e in entries.values())
+        self.assertEqual(time_stamps, ['2016-09-01#008', '2016-10-20#003'])
+        self.assertEqual(self.index.get_entries(), entries)
+
+    def test_values_are_indexed_in_separate_pass(self):
+        with mock.patch.object(Sweep, 'load_dir',
+                               wraps=Sweep.load_dir) as load_dir:
+            self.index.rescan()
+            # The scan only reads the end of meta.json.
+            self.assertEqual(load_dir.call_count, 0)
+            self.assertEqual(self.index.query('MC<1'), set())
+            self.assertEqual(self.index.index_pending_values(), 2)
+            self.assertEqual(load_dir.call_count, 2)
+        self.assertEqual(len(self.index.query('MC<1')), 2)
+        self.assertEqual(self.index.index_pending_values(), 0)
+        # A changed sweep is indexed again.
+        path = os.path.join(self.data_dir, 'sub', '2016-09-01#006')
+        meta_path = os.path.join(path, 'meta.json')
+        os.utime(meta_path, ns=(0, 0))
+        os.utime(path, ns=(0, 0))
+        self.index.rescan()
+        self.assertEqual(len(self.index.query('MC<1')), 1)
+        self.assertEqual(self.index.index_pending_values(), 1)
+        self.assertEqual(len(self.index.query('MC<1')), 2)
+
+    def test_values_can_be_disabled(self):
+        index = SweepIndex(self.data_dir, self.db_path, index_values=False)
+        index.rescan()
+        self.assertEqual(index.index_pending_values(), 0)
+        self.assertEqual(index.query('MC<1'), set())
+
+    def test_rescan_sub_dir(self):
+        self.index.rescan()
+        shutil.copytree('../data/2016-10-20#003',
+                        os.path.join(self.data_dir, '2016-10-20#003'))
+        sub_dir = os.path.join(self.data_dir, 'sub')
+        shutil.rmtree(os.path.join(sub_dir, '2016-09-01#006'))
+        entries = self.index.rescan(sub_dir=sub_dir)
+        self.assertEqual(CountingSweepIndex.n_parsed, 2)
+        time_stamps = sorted(e['time_stamp'] for e in entries.values())
+        self.assertEqual(time_stamps, ['2016-09-01#008'])
+        self.assertEqual(self.index.get_entries(), entries)
+
+
+class SweepIndexQueryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.index = SweepIndex('../data',
+                                os.path.join(self.tmp_dir, 'index.sqlite'))
+        self.index.rescan()
+        self.index.index_pending_values()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def query(self, query_str):
+        paths = self.index.query(query_str)
+        return sorted(os.path.basename(path) for path in paths)
+
+    def test_name_and_dimension(self):
+        self.assertEqual(self.query('gate dim=1'), ['2016-09-01#006'])
+        self.assertEqual(self.query('"name=gate sweep"'), ['2016-09-01#006'])
+        self.assertEqual(len(self.query('')), 9)
+
+    def test_jobs(self):
+        self.assertEqual(self.query('chan=mL dim=2 points>170'),
+                         ['2016-09-19#015', '2016-09-26#001'])
+        self.assertEqual(self.query('chan=gR to=-5'),
+                         ['2016-08-31#002', '2016-08-31#003'])
+        self.assertEqual(self.query('chan=backgate from=-11'),
+                         ['2016-09-01#006', '2016-09-01#007'])
+
+    def test_instrument_values(self):
+        self.assertEqual(len(self.query('MC<0.05')), 9)
+        self.assertEqual(self.query('triton/MC<0.05'), self.query('MC<0.05'))
+        self.assertEqual(self.query('MC>1'), [])
+
+    def test_invalid_query(self):
+        with self.assertRaises(ValueError):
+            self.index.query('dim=two')
+
+
+if __name__=='__main__':
+    unittest.main()
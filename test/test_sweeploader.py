@@ -0,0 +1,221 @@
+import sys
+sys.path.append('..')
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+from PyQt5 import QtCore
+from sweep import Sweep
+from sweepcache import SweepCache
+from sweepindex import SweepIndex
+from sweeploader import SweepLoader, SweepPrefetcher, SweepScanner
+
+
+app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+
+
+def wait_for(condition, timeout=10):
+    t_start = time.monotonic()
+    while not condition() and time.monotonic() - t_start < timeout:
+        app.processEvents()
+        time.sleep(0.01)
+    return condition()
+
+
+def process_events(duration):
+    wait_for(lambda: False, duration)
+
+
+class SlowSweep(Sweep):
+    """
+    Sweep which blocks in load until release is set, and records the thread
+    in which set_pdata is called. Its size is nbytes.
+    """
+    started = threading.Event()
+    release = threading.Event()
+    pdata_threads = []
+    nbytes = 100
+
+    def load(self):
+        self.started.set()
+        self.release.wait(10)
+        super().load()
+
+    def get_nbytes(self):
+        return self.nbytes
+
+    def set_pdata(self, name_func_dict=None):
+        self.pdata_threads.append(threading.current_thread())
+        return super().set_pdata(name_func_dict)
+
+
+class SweepLoaderTestCase(unittest.TestCase):
+    paths = ['../data/2016-09-01#006', '../data/2016-09-01#008',
+             '../data/2016-10-20#003']
+
+    def setUp(self):
+        self.patcher = mock.patch('sweeploader.Sweep', SlowSweep)
+        self.patcher.start()
+        SlowSweep.started.clear()
+        SlowSweep.release.clear()
+        SlowSweep.pdata_threads = []
+        self.tmp_dir = tempfile.mkdtemp()
+        self.name_func_dict = {}
+        self.sweep_cache = SweepCache()
+        self.loader = SweepLoader(cache_dir=self.tmp_dir,
+                                  sweep_cache=self.sweep_cache)
+        self.loaded = []
+        self.loader.loaded.connect(
+            lambda sweep, context: self.loaded.append(context))
+
+    def tearDown(self):
+        SlowSweep.release.set()
+        self.loader.thread_pool.waitForDone()
+        self.patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_only_newest_request_is_delivered(self):
+        for i, path in enumerate(self.paths):
+            self.loader.load(path, self.name_func_dict, context=i)
+        SlowSweep.release.set()
+        self.assertTrue(wait_for(lambda: self.loaded))
+        process_events(0.3)
+        self.assertEqual(self.loaded, [2])
+        # The pseudocolumns are only set in the GUI thread.
+        self.assertTrue(SlowSweep.pdata_threads)
+        for thread in SlowSweep.pdata_threads:
+            self.assertIs(thread, threading.main_thread())
+
+    def test_stale_tasks_are_cancelled(self):
+        self.loader.thread_pool.setMaxThreadCount(1)
+        self.loader.load(self.paths[0], self.name_func_dict, context=0)
+        # The first task is blocked in load, so the second is still queued
+        # when the last request is made.
+        self.assertTrue(SlowSweep.started.wait(10))
+        self.loader.load(self.paths[1], self.name_func_dict, context=1)
+        self.loader.load(self.paths[2], self.name_func_dict, context=2)
+        SlowSweep.release.set()
+        self.assertTrue(wait_for(lambda: self.loaded))
+        self.loader.thread_pool.waitForDone()
+        process_events(0.3)
+        self.assertEqual(self.loaded, [2])
+        # The running task finished and was cached, the queued one was never
+        # started.
+        self.assertIn(self.paths[0], self.sweep_cache)
+        self.assertNotIn(self.paths[1], self.sweep_cache)
+
+    def test_cached_sweep_is_delivered_immediately(self):
+        SlowSweep.release.set()
+        self.loader.load(self.paths[0], self.name_func_dict, context=0)
+        self.assertTrue(wait_for(lambda: self.loaded))
+        new_dict = {}
+        self.loader.load(self.paths[0], new_dict, context=1)
+        self.assertEqual(self.loaded, [0, 1])
+        self.assertIs(self.sweep_cache.get(self.paths[0]).name_func_dict,
+                      new_dict)
+
+
+class SweepPrefetcherTestCase(unittest.TestCase):
+    paths = SweepLoaderTestCase.paths
+
+    def setUp(self):
+        self.patcher = mock.patch('sweeploader.Sweep', SlowSweep)
+        self.patcher.start()
+        SlowSweep.started.clear()
+        SlowSweep.release.clear()
+        SlowSweep.pdata_threads = []
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sweep_cache = SweepCache()
+
+    def tearDown(self):
+        SlowSweep.release.set()
+        self.prefetcher.thread_pool.waitForDone()
+        self.patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_prefetch_yields_to_selection(self):
+        self.prefetcher = SweepPrefetcher(self.sweep_cache,
+                                          cache_dir=self.tmp_dir)
+        self.prefetcher.prefetch(self.paths, {})
+        self.assertTrue(SlowSweep.started.wait(10))
+        # What FolderBrowser does when the user selects a sweep.
+        self.prefetcher.cancel()
+        SlowSweep.release.set()
+        self.prefetcher.thread_pool.waitForDone()
+        process_events(0.3)
+        # The sweep being loaded is kept, the queued ones are dropped.
+        self.assertIn(self.paths[0], self.sweep_cache)
+        for path in self.paths[1:]:
+            self.assertNotIn(path, self.sweep_cache)
+        self.assertEqual(self.prefetcher.in_progress, set())
+        for thread in SlowSweep.pdata_threads:
+            self.assertIs(thread, threading.main_thread())
+
+    def test_prefetch_respects_budget(self):
+        SlowSweep.release.set()
+        max_bytes = SlowSweep.nbytes * 3 // 2
+        self.prefetcher = SweepPrefetcher(self.sweep_cache,
+                                          cache_dir=self.tmp_dir,
+                                          max_bytes=max_bytes)
+        self.prefetcher.prefetch(self.paths, {})
+        self.assertTrue(wait_for(lambda: self.paths[0] in self.sweep_cache))
+        self.prefetcher.thread_pool.waitForDone()
+        process_events(0.3)
+        self.assertNotIn(self.paths[1], self.sweep_cache)
+        self.assertLessEqual(self.prefetcher.get_unused_nbytes(), max_bytes)
+        # Sweeps selected by the user no longer count toward the budget.
+        self.prefetcher.mark_used(self.paths[0])
+        self.assertEqual(self.prefetcher.get_unused_nbytes(), 0)
+
+
+
+class SweepScannerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.data_dir = os.path.join(self.tmp_dir, 'data')
+        for sweep_dir in ('2016-09-01#006', '2016-09-01#008'):
+            shutil.copytree(os.path.join('../data', sweep_dir),
+                            os.path.join(self.data_dir, sweep_dir))
+        db_path = os.path.join(self.tmp_dir, 'index.sqlite')
+        self.scanner = SweepScanner(SweepIndex(self.data_dir, db_path))
+        self.signals = []
+        for name in ('finished', 'failed', 'values_indexed',
+                     'values_failed'):
+            getattr(self.scanner, name).connect(
+                lambda result, name=name: self.signals.append(name))
+
+    def tearDown(self):
+        self.scanner.thread_pool.waitForDone()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_values_are_indexed_after_scan(self):
+        self.scanner.scan()
+        self.assertTrue(wait_for(lambda: 'values_indexed' in self.signals))
+        self.assertEqual(self.signals, ['finished', 'values_indexed'])
+        self.assertFalse(self.scanner.is_scanning)
+
+    def test_empty_sub_dirs(self):
+        entries = []
+        self.scanner.finished.connect(entries.append)
+        self.scanner.scan([])
+        self.assertTrue(wait_for(lambda: entries))
+        self.assertEqual(entries, [{}])
+        self.assertFalse(self.scanner.is_scanning)
+
+    def test_failed_value_indexing_is_not_a_failed_scan(self):
+        error = RuntimeError('values')
+        with mock.patch.object(SweepIndex, 'index_pending_values',
+                               side_effect=error):
+            self.scanner.scan()
+            self.assertTrue(wait_for(
+                lambda: 'values_failed' in self.signals))
+        self.assertEqual(self.signals, ['finished', 'values_failed'])
+        self.assertFalse(self.scanner.is_scanning)
+
+
+if __name__=='__main__':
+    unittest.main()
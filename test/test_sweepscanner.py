@@ -0,0 +1,63 @@
+import sys
+sys.path.append('..')
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from sweepscanner import read_meta_fields, find_members_in_tail, \
+    iter_sweep_dirs
+import sweepscanner
+
+
+class ReadMetaFieldsTestCase(unittest.TestCase):
+    keys = ('name', 'timestamp', 'job')
+
+    def test_fields_equal_full_parse(self):
+        for sweep_dir in os.listdir('../data'):
+            sweep_path = os.path.join('../data', sweep_dir)
+            with open(os.path.join(sweep_path, 'meta.json')) as f:
+                meta = json.load(f)
+            fields = read_meta_fields(sweep_path, self.keys)
+            expected = {key: meta[key] for key in self.keys}
+            self.assertEqual(fields, expected)
+
+    def test_small_tail_falls_back(self):
+        tail_size = sweepscanner.tail_size
+        sweepscanner.tail_size = 16
+        try:
+            self.test_fields_equal_full_parse()
+        finally:
+            sweepscanner.tail_size = tail_size
+
+    def test_nested_keys_and_strings(self):
+        text = ('"x": {"name": "inner"}, "name": "a \\"}{, b", '
+                '"job": {"name": ["}", 1]}}')
+        fields = find_members_in_tail(text, {'name', 'job'})
+        self.assertEqual(fields, {'name': 'a "}{, b',
+                                  'job': {'name': ['}', 1]}})
+
+
+class IterSweepDirsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        for sweep_dir in ('2016-09-01#006', '2016-09-01#008'):
+            shutil.copytree(os.path.join('../data', sweep_dir),
+                            os.path.join(self.tmp_dir, 'sub', sweep_dir))
+        os.makedirs(os.path.join(self.tmp_dir, 'empty'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_known_directories(self):
+        found = list(iter_sweep_dirs(self.tmp_dir))
+        self.assertEqual(len(found), 2)
+        self.assertFalse(any(is_known for path, mtime, is_known in found))
+        known_mtimes = {path: mtime for path, mtime, is_known in found}
+        found = list(iter_sweep_dirs(self.tmp_dir, known_mtimes))
+        self.assertTrue(all(is_known for path, mtime, is_known in found))
+        self.assertEqual(len(found), 2)
+
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import sys
+sys.path.append('..')
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from sweep import Sweep
+from columncache import ColumnCache
+import thumbnails
+from thumbnails import ThumbnailProvider, render_line, render_image, \
+    block_mean
+
+
+class RenderTestCase(unittest.TestCase):
+    def test_line_spans_every_column(self):
+        x = np.linspace(0, 1, 10000)
+        y = np.sin(20 * x)
+        rgba = render_line(x, y, 64, 40)
+        self.assertEqual(rgba.shape, (40, 64, 4))
+        self.assertTrue((rgba[..., 3] > 0).any(axis=0).all())
+        # The extremes of the line reach the top and bottom rows.
+        self.assertTrue(rgba[0, :, 3].any() and rgba[-1, :, 3].any())
+
+    def test_block_mean_ignores_nan(self):
+        z = np.arange(12, dtype=float).reshape(3, 4)
+        z[0, 0] = np.nan
+        means = block_mean(z, 2, 2)
+        self.assertEqual(means.shape, (2, 2))
+        self.assertEqual(means[0, 0], np.mean([1, 4, 5]))
+        self.assertEqual(means[1, 1], np.mean([10, 11]))
+
+    def test_image_of_incomplete_sweep(self):
+        y, x = np.meshgrid(np.linspace(0, 1, 100), np.linspace(0, 1, 50),
+                           indexing='ij')
+        z = x + y
+        z[:, 40:] = np.nan
+        rgba = render_image(x, y, z, 25, 20)
+        self.assertEqual(rgba.shape, (20, 25, 4))
+        self.assertFalse(rgba[:, -5:, 3].any())
+        self.assertTrue(rgba[:, :20, 3].all())
+
+
+class ThumbnailProviderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sweep_path = os.path.join(self.tmp_dir, '2016-09-26#001')
+        shutil.copytree('../data/2016-09-26#001', self.sweep_path,
+                        ignore=shutil.ignore_patterns(ColumnCache.dir_name))
+        self.sweeps = []
+        def render_thumbnail(sweep, *args, **kwargs):
+            self.sweeps.append(sweep)
+            return self.render_thumbnail(sweep, *args, **kwargs)
+        self.render_thumbnail = thumbnails.render_thumbnail
+        self.patcher = mock.patch('thumbnails.render_thumbnail',
+                                  render_thumbnail)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_preview_writes_nothing_to_data_directory(self):
+        fnames = sorted(os.listdir(self.sweep_path))
+        provider = ThumbnailProvider()
+        image = provider.load_image(self.sweep_path)
+        self.assertFalse(image.isNull())
+        self.assertEqual(sorted(os.listdir(self.sweep_path)), fnames)
+
+    def test_preview_reads_only_its_columns_from_cache(self):
+        cache_dir = os.path.join(self.tmp_dir, 'cache')
+        Sweep(self.sweep_path, cache_dir=cache_dir)
+        provider = ThumbnailProvider(cache_dir=cache_dir)
+        image = provider.load_image(self.sweep_path)
+        self.assertFalse(image.isNull())
+        sweep = self.sweeps[-1]
+        col_names = thumbnails.get_default_columns(sweep)
+        self.assertEqual(sorted(sweep.data.get_loaded_names()),
+                         sorted(col_names))
+        self.assertTrue(os.path.exists(
+            provider.get_thumbnail_path(self.sweep_path)))
+        # The stored preview is used the next time.
+        provider.load_image(self.sweep_path)
+        self.assertEqual(len(self.sweeps), 1)
+
+
+if __name__=='__main__':
+    unittest.main()
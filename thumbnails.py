@@ -0,0 +1,328 @@
+import os
+import json
+import warnings
+from collections import OrderedDict
+import numpy as np
+import matplotlib.cm
+from PyQt5 import QtCore, QtGui
+from sweep import Sweep
+from columncache import ColumnCache
+
+
+line_color = (31, 119, 180, 255)
+
+
+class ThumbnailProvider(QtCore.QObject):
+    """
+    Renders small previews of sweeps on background threads and keeps them in
+    memory and on disk.
+
+    The preview of a 1D sweep is the first measured column against the swept
+    channel, and the preview of a 2D sweep is an image of the first measured
+    column against the two swept channels (see get_default_columns). Previews
+    are stored as PNG files next to the ColumnCache of the sweep together with
+    the signature of the sweep, so they are only rendered again when data.dat
+    or meta.json changes.
+
+    Rendering a preview does not write a ColumnCache. A valid ColumnCache is
+    memory-mapped, so only the columns of the preview are read, and other
+    sweeps are parsed from data.dat. If cache_dir is None the previews are
+    only stored on disk for sweeps which already have a cache directory, so
+    scrolling past a sweep does not write to its directory.
+
+    Parameters
+    ----------
+    size : tuple of integers
+        Width and height of the previews in pixels.
+    cache_dir : str or None
+        Passed on to Sweep and ColumnCache.
+    cmap_name : str
+        Name of the colormap used for 2D sweeps.
+    max_threads : integer
+        Maximum number of previews rendered concurrently.
+    max_items : integer
+        Maximum number of previews kept in memory.
+    parent : QtCore.QObject instance
+        Parent of the provider.
+
+    Signals
+    -------
+    ready(key)
+        Emitted when the preview requested with key is available from get.
+    """
+    ready = QtCore.pyqtSignal(object)
+
+    def __init__(self, size=(64, 40), cache_dir=None, cmap_name='Reds',
+                 max_threads=2, max_items=5000, parent=None):
+        super().__init__(parent)
+        self.size = tuple(size)
+        self.cache_dir = cache_dir
+        self.cmap_name = cmap_name
+        self.max_items = max_items
+        # Maps key to a QPixmap, or to None if no preview could be made.
+        self.pixmaps = OrderedDict()
+        self.pending = set()
+        self.thread_pool = QtCore.QThreadPool(self)
+        self.thread_pool.setMaxThreadCount(max_threads)
+        # Created after thread_pool, so it is deleted after the thread pool
+        # has waited for the running tasks.
+        self.signals = ThumbnailTaskSignals(self)
+        self.signals.finished.connect(self.on_task_finished)
+
+    def get(self, key, path):
+        """
+        Returns the preview of the sweep at path as a QPixmap, or None if it is
+        not available yet, in which case it is requested.
+        """
+        if key in self.pixmaps:
+            self.pixmaps.move_to_end(key)
+            return self.pixmaps[key]
+        self.request([(key, path)], replace=False)
+        return None
+
+    def request(self, items, replace=True):
+        """
+        Requests previews for the (key, path) pairs in items, the first pair
+        first. If replace is True requests which have not started are
+        dropped.
+        """
+        if replace:
+            self.thread_pool.clear()
+            self.pending = set()
+        for i, (key, path) in enumerate(items):
+            if key in self.pixmaps or key in self.pending:
+                continue
+            self.pending.add(key)
+            task = ThumbnailTask(key, path, self)
+            self.thread_pool.start(task, -i)
+
+    def remove(self, key):
+        """
+        Removes the preview for key from memory, e.g., because the sweep has
+        changed.
+        """
+        self.pixmaps.pop(key, None)
+
+    def on_task_finished(self, key, image):
+        self.pending.discard(key)
+        pixmap = None
+        if image is not None:
+            pixmap = QtGui.QPixmap.fromImage(image)
+        self.pixmaps[key] = pixmap
+        while len(self.pixmaps) > self.max_items:
+            self.pixmaps.popitem(last=False)
+        self.ready.emit(key)
+
+    def get_thumbnail_path(self, path):
+        cache_path = ColumnCache.get_cache_path(path, self.cache_dir)
+        fname = 'thumb_{}x{}.png'.format(*self.size)
+        return os.path.join(cache_path, fname)
+
+    def load_image(self, path):
+        """
+        Returns the preview of the sweep at path as a QImage or None. The
+        preview is read from disk if it is up to date and rendered otherwise.
+        This method is called on the worker threads.
+        """
+        signature = ColumnCache.get_signature(path)
+        if signature is None:
+            return None
+        signature_str = json.dumps(signature)
+        thumb_path = self.get_thumbnail_path(path)
+        image = QtGui.QImage(thumb_path)
+        if not image.isNull() and image.text('signature') == signature_str:
+            return image
+        cache = ColumnCache(path, self.cache_dir)
+        sweep = Sweep(path, use_cache=cache.is_valid(),
+                      cache_dir=self.cache_dir)
+        rgba = render_thumbnail(sweep, *self.size, cmap_name=self.cmap_name)
+        if rgba is None:
+            return None
+        height, width = rgba.shape[:2]
+        image = QtGui.QImage(rgba.tobytes(), width, height, 4 * width,
+                             QtGui.QImage.Format_RGBA8888).copy()
+        if (width, height) != self.size:
+            # Downsampled images of small 2D sweeps are scaled up.
+            image = image.scaled(*self.size)
+        image.setText('signature', json.dumps(sweep.signature))
+        if self.cache_dir is None and not os.path.isdir(cache.path):
+            return image
+        try:
+            os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+            tmp_path = thumb_path + '.tmp'
+            if image.save(tmp_path, 'PNG'):
+                os.replace(tmp_path, thumb_path)
+        except OSError:
+            # The preview is still shown if it cannot be cached, e.g., on
+            # read-only drives.
+            pass
+        return image
+
+
+class ThumbnailTaskSignals(QtCore.QObject):
+    finished = QtCore.pyqtSignal(object, object)
+
+
+class ThumbnailTask(QtCore.QRunnable):
+    def __init__(self, key, path, provider):
+        super().__init__()
+        self.key = key
+        self.path = path
+        self.provider = provider
+
+    def run(self):
+        QtCore.QThread.currentThread().setPriority(
+            QtCore.QThread.LowestPriority)
+        try:
+            image = self.provider.load_image(self.path)
+        except Exception:
+            image = None
+        self.provider.signals.finished.emit(self.key, image)
+
+
+def render_thumbnail(sweep, width, height, cmap_name='Reds'):
+    """
+    Returns an RGBA image of shape (height, width, 4) of the default columns of
+    sweep, or None if sweep has too few columns.
+    """
+    col_names = get_default_columns(sweep)
+    if col_names is None:
+        return None
+    cols = [np.asarray(sweep.data[name], dtype=float) for name in col_names]
+    if sweep.dimension == 1:
+        return render_line(*cols, width=width, height=height)
+    return render_image(*cols, width=width, height=height,
+                        cmap_name=cmap_name)
+
+
+def get_default_columns(sweep):
+    """
+    Returns the names of the swept columns followed by the first measured
+    column which is not time, or None if sweep has too few columns.
+    """
+    names = sweep.data.dtype.names
+    # The swept channels come first in the columns. Line jobs sweep several
+    # channels, of which the first is used.
+    axis_idxs = []
+    n_swept = 0
+    job = sweep.meta.get('job')
+    while isinstance(job, dict):
+        chans = job.get('chans') or ([job['chan']] if 'chan' in job else [])
+        if chans:
+            axis_idxs.append(n_swept)
+            n_swept += len(chans)
+        job = job.get('job')
+    if len(axis_idxs) != sweep.dimension:
+        axis_idxs = list(range(sweep.dimension))
+        n_swept = sweep.dimension
+    if sweep.dimension not in (1, 2) or len(names) <= n_swept:
+        return None
+    measured = [name for name in names[n_swept:] if name != 'time']
+    if not measured:
+        measured = names[n_swept:]
+    return [names[i] for i in axis_idxs] + [measured[0]]
+
+
+def render_line(x, y, width, height):
+    """
+    Draws y against x. Every pixel column spans the minimum and maximum of
+    the points falling in it, so no features are lost however many points
+    there are.
+    """
+    rgba = np.zeros((height, width, 4), dtype=np.uint8)
+    is_valid = np.isfinite(x) & np.isfinite(y)
+    x = x[is_valid]
+    y = y[is_valid]
+    if len(x) == 0:
+        return rgba
+    col = to_pixels(x, width, use_index_if_constant=True)
+    y_pix = (height - 1) - to_pixels(y, height)
+    top = np.full(width, height)
+    bottom = np.full(width, -1)
+    np.minimum.at(top, col, y_pix)
+    np.maximum.at(bottom, col, y_pix)
+    has_data = bottom >= 0
+    # Join neighbouring columns so the line is continuous.
+    top_valid = top[has_data]
+    bottom_valid = bottom[has_data]
+    top_valid[1:] = np.minimum(top_valid[1:], bottom_valid[:-1])
+    bottom_valid[1:] = np.maximum(bottom_valid[1:], top_valid[:-1])
+    top[has_data] = top_valid
+    bottom[has_data] = bottom_valid
+    rows = np.arange(height)[:, np.newaxis]
+    mask = (rows >= top) & (rows <= bottom)
+    rgba[mask] = line_color
+    return rgba
+
+
+def render_image(x, y, z, width, height, cmap_name='Reds'):
+    """
+    Draws z, whose first axis runs along y and second along x, downsampled by
+    block averaging to at most height by width pixels. The colour scale
+    excludes the lowest and highest percent of the values.
+    """
+    if x[0, 0] > x[0, -1]:
+        z = z[:, ::-1]
+    if y[0, 0] < y[-1, 0]:
+        # Row 0 is drawn at the top.
+        z = z[::-1, :]
+    z = block_mean(z, height, width)
+    rgba = np.zeros(z.shape + (4,), dtype=np.uint8)
+    is_valid = np.isfinite(z)
+    if not is_valid.any():
+        return rgba
+    z_min, z_max = np.percentile(z[is_valid], [1, 99])
+    if z_max <= z_min:
+        z_max = z_min + 1
+    z_norm = np.clip((z - z_min) / (z_max - z_min), 0, 1)
+    cmap = get_cmap(cmap_name)
+    rgba[is_valid] = cmap(z_norm[is_valid], bytes=True)
+    return rgba
+
+
+def get_cmap(cmap_name):
+    """
+    Returns the registered colormap named cmap_name. Only the colormap
+    registry is needed, so pyplot and its backend are not imported.
+    """
+    try:
+        return matplotlib.colormaps[cmap_name]
+    except AttributeError:
+        # Matplotlib older than 3.5.
+        return matplotlib.cm.get_cmap(cmap_name)
+
+
+def block_mean(z, n_rows, n_cols):
+    """
+    Averages blocks of z, ignoring NaN, such that the result has at most
+    n_rows rows and n_cols columns.
+    """
+    row_factor = -(-z.shape[0] // n_rows)
+    col_factor = -(-z.shape[1] // n_cols)
+    n_rows = -(-z.shape[0] // row_factor)
+    n_cols = -(-z.shape[1] // col_factor)
+    padded = np.full((n_rows * row_factor, n_cols * col_factor), np.nan)
+    padded[:z.shape[0], :z.shape[1]] = z
+    blocks = padded.reshape(n_rows, row_factor, n_cols, col_factor)
+    with warnings.catch_warnings():
+        # Blocks containing only NaN give NaN.
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmean(blocks, axis=(1, 3))
+
+
+def to_pixels(values, n_pixels, use_index_if_constant=False):
+    """
+    Maps values linearly to the pixel indices 0 to n_pixels-1. Constant values
+    are mapped to the middle pixel or, if use_index_if_constant is True,
+    their indices are mapped instead, e.g., for a time trace at a fixed
+    setpoint.
+    """
+    v_min = values.min()
+    v_max = values.max()
+    if v_max == v_min:
+        if not use_index_if_constant or len(values) == 1:
+            return np.full(len(values), n_pixels // 2)
+        values = np.arange(len(values), dtype=float)
+        v_min, v_max = 0, len(values) - 1
+    scaled = (values - v_min) / (v_max - v_min) * (n_pixels - 1)
+    return np.round(scaled).astype(int)